@@ -19,10 +19,7 @@ from __future__ import print_function
 import os
 import sys
 
-import subprocess
-
 from . import cli
-from . import version
 
 
 def charm():
@@ -39,6 +36,7 @@ def charm():
         cli.usage(0)
 
     if sub == '--version':
+        from . import version
         version.main()
         sys.exit(0)
 
@@ -46,13 +44,7 @@ def charm():
         print('\n'.join(cli.subcommands(os.path.realpath(__file__))))
         sys.exit(0)
 
-    sub_exec = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])),
-                            "charm-%s%s" % (sub, cli.ext()))
-
-    if not os.path.exists(sub_exec):
-        sys.stderr.write('Error: %s is not a valid subcommand\n\n' % sub)
-        cli.usage(2)
-    sys.exit(subprocess.call([sub_exec] + opts))
+    sys.exit(cli.run_subcommand(sub, opts))
 
 
 def bundle():
@@ -69,14 +61,7 @@ def bundle():
     if sub == '--help':
         cli.usage(0)
 
-    sub_exec = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])),
-                            "charm-%s%s" % (sub, cli.ext()))
-
-    if not os.path.exists(sub_exec):
-        sys.stderr.write('Error: %s is not a valid subcommand\n\n' % sub)
-        cli.usage(2)
-
-    sys.exit(subprocess.call([sub_exec, '--bundle'] + opts))
+    sys.exit(cli.run_subcommand(sub, ['--bundle'] + opts))
 
 
 if __name__ == '__main__':
@@ -1,12 +1,9 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import argparse
-import blessings
-import curses
 import json
 import logging
 import os
-import requests
 import subprocess
 import sys
 import uuid
@@ -18,21 +15,31 @@ import charmtools.build.tactics
 
 from path import Path as path
 from collections import OrderedDict
-from charmtools import (utils, repofinder, proof)
+from charmtools import (utils, repofinder, vcs)
 from charmtools.build import inspector
 from charmtools.build.errors import BuildError
 from charmtools.build.config import BuildConfig, DEFAULT_IGNORES
-from charmtools.build.tactics import Tactic, WheelhouseTactic
+from charmtools.build.resolver import IncludeResolver
+from charmtools.build.tactics import (
+    InstallerTactic,
+    Tactic,
+    WheelhouseTactic,
+)
 from charmtools.build.fetchers import (
     InterfaceFetcher,
     LayerFetcher,
     get_fetcher,
     FetchError,
+    LockedFetcher,
     RepoFetcher,
 )
 from charmtools.version import cached_charm_tools_version, format_version
 from zipfile import ZipFile, ZIP_DEFLATED
 
+blessings = utils.lazy_import('blessings')
+proof = utils.lazy_import('charmtools.proof')
+curses = utils.lazy_import('curses')
+requests = utils.lazy_import('requests')
 log = logging.getLogger("build")
 
 
@@ -71,6 +78,7 @@ class Fetched(Configable):
         self.fetched = False
         self.fetched_url = None
         self.vcs = None
+        self.subdir = None
         self.revision = None
         self.branch = None
         self.lock = lock
@@ -91,17 +99,22 @@ class Fetched(Configable):
     def __div__(self, other):
         return self.directory / other
 
+    def _get_fetcher(self):
+        if not self.lock:
+            return get_fetcher(self.url)
+        if LockedFetcher.can_fetch_lock(self.lock, self.use_branches):
+            # The lock records where the item was fetched from, so go
+            # straight there rather than through the layer index.
+            return LockedFetcher(self.NAMESPACE, self.lock)
+        # In order to lock the fetcher we need to adjust the self.url
+        # to get the right thing.  Curiously, self.url is actually
+        # "layer:something" here, and so we can match on that.
+        url = make_url_from_lock_for_layer(self.lock, self.use_branches)
+        return get_fetcher(url)
+
     def fetch(self):
         try:
-            # In order to lock the fetcher we need to adjust the self.url
-            # to get the right thing.  Curiously, self.url is actually
-            # "layer:something" here, and so we can match on that.
-            if self.lock:
-                url = make_url_from_lock_for_layer(
-                    self.lock, self.use_branches)
-            else:
-                url = self.url
-            fetcher = get_fetcher(url)
+            fetcher = self._get_fetcher()
         except FetchError:
             # We might be passing a local dir path directly
             # which fetchers don't currently  support
@@ -117,6 +130,7 @@ class Fetched(Configable):
                 self.fetched = True
                 self.fetched_url = getattr(fetcher, "fetched_url", None)
                 self.vcs = getattr(fetcher, "vcs", None)
+                self.subdir = getattr(fetcher, "subdir", None)
             self.revision = fetcher.get_revision(self.directory)
             # NOTE(ajkavanagh): Due to bug:#606 there isn't a good way to
             # determine the branch for a revision as there isn't a one-to-one
@@ -173,9 +187,12 @@ class Builder(object):
         self.hide_metrics = os.environ.get('CHARM_HIDE_METRICS', False)
         self.wheelhouse_overrides = None
         self.wheelhouse_per_layer = False
+        self.wheelhouse_source = None
         self._warned_home = False
         self.lock_items = []
         self.with_locks = {}
+        self.lock_graph = None
+        self.graph = None
         self.charm_file = False
 
     @property
@@ -288,7 +305,7 @@ class Builder(object):
                     'url': i.url,
                     'rev': i.revision,
                 }
-                for opt in ('branch', 'fetched_url'):
+                for opt in ('branch', 'fetched_url', 'vcs', 'subdir'):
                     attr = getattr(i, opt, None)
                     if attr:
                         item[opt] = attr
@@ -312,52 +329,46 @@ class Builder(object):
 
     def fetch_deps(self, layer):
         self.cache_dir.makedirs_p()
-        results = {"layers": [], "interfaces": []}
-        self.fetch_dep(layer, results)
+        resolver = IncludeResolver(self.make_dep, self.dep_fetched)
+        self.graph = None
+        if self.lock_graph:
+            self.graph = resolver.load(self.lock_graph, layer, self.is_pinned)
+        if self.graph is None:
+            self.graph = resolver.resolve(layer)
         # results should now be a bottom up list
         # of deps. Using the in order results traversal
         # we can build out our plan for each file in the
         # output layer
-        results["layers"].append(layer)
+        results = self.graph.results()
         self._layers = results["layers"]
         self._interfaces = results["interfaces"]
         return results
 
-    def fetch_dep(self, layer, results):
-        # Recursively fetch and scan layers
-        # This returns a plan for each file in the result
-        baselayers = layer.config.get('includes', [])
-        if not baselayers:
-            # no deps, this is possible for any base
-            # but questionable for the target
-            return
-
-        if isinstance(baselayers, str):
-            baselayers = [baselayers]
-
-        for base in baselayers:
-            # The order of these commands is important. We only want to
-            # fetch something if we haven't already fetched it.
-            if base.startswith("interface:"):
-                iface = Interface(base, self.cache_dir,
-                                  lock=self.lock_for(base),
-                                  use_branches=getattr(
-                                      self, 'use_lock_file_branches', False))
-                if iface.name in [i.name for i in results['interfaces']]:
-                    continue
-                results["interfaces"].append(iface.fetch())
-                self.post_metrics('interface', iface.name, iface.fetched)
-            else:
-                base_layer = Layer(base, self.cache_dir,
-                                   lock=self.lock_for(base),
-                                   use_branches=getattr(
-                                       self, 'use_lock_file_branches', False))
-                if base_layer.name in [i.name for i in results['layers']]:
-                    continue
-                base_layer.fetch()
-                self.fetch_dep(base_layer, results)
-                results["layers"].append(base_layer)
-                self.post_metrics('layer', base_layer.name, base_layer.fetched)
+    def make_dep(self, base):
+        """Create the (unfetched) Layer or Interface for an include."""
+        cls = Interface if base.startswith("interface:") else Layer
+        return cls(base, self.cache_dir,
+                   lock=self.lock_for(base),
+                   use_branches=getattr(self, 'use_lock_file_branches',
+                                        False))
+
+    def dep_fetched(self, item):
+        self.post_metrics(item.NAMESPACE, item.name, item.fetched)
+
+    def is_pinned(self, entry):
+        """Whether a resolved graph entry is pinned to its recorded revision
+        by a lock for a remotely fetched item."""
+        lock = self.lock_for(entry['item'])
+        if not (lock.get('url') and lock.get('commit')):
+            return False
+        branch = lock.get('branch') or ''
+        if branch.startswith("refs/heads/"):
+            branch = branch[len("refs/heads/"):]
+        if getattr(self, 'use_lock_file_branches', False) and \
+                branch not in ('', 'master', 'main'):
+            # tracking a branch, so the revision can move
+            return False
+        return lock['commit'] == entry['rev']
 
     def lock_for(self, base):
         """Return a lock description for an item 'base' if it exists."""
@@ -695,13 +706,17 @@ class Builder(object):
                 'item': layer['url'],
                 'url': layer.get('fetched_url', None),
                 'vcs': layer.get('vcs', None),
+                'subdir': layer.get('subdir', None),
                 'branch': branch,
                 'commit': tag
             }
             locks.append(lock_item)
         # now iterate through the other lock items and add them in
         locks.extend(self.lock_items)
-        self.lock_file.write_text(json.dumps({'locks': locks}, indent=2))
+        lock_data = {'locks': locks}
+        if self.graph is not None:
+            lock_data['graph'] = self.graph.serialize()
+        self.lock_file.write_text(json.dumps(lock_data, indent=2))
 
     def maybe_read_lock_file(self):
         """Read the lock file if it exists.
@@ -711,6 +726,7 @@ class Builder(object):
         that are used when rebuilding the charm.
         """
         self.with_locks = {}
+        self.lock_graph = None
         if (getattr(self, 'ignore_lock_file', False) or
                 getattr(self, 'write_lock_file', False)):
             return
@@ -736,6 +752,7 @@ class Builder(object):
                 self.with_locks[item['item']] = item
             else:
                 log.warning("Not sure how to deal with lock item '%s'?", item)
+        self.lock_graph = with_locks.get('graph')
         log.info("Using lockfile %s for build.", self.lock_file)
 
     def generate_python_modules_from_lock_file(self):
@@ -849,6 +866,8 @@ class Builder(object):
     def __call__(self):
         log.debug(json.dumps(
             self.status(), indent=2, sort_keys=True, default=str))
+        vcs.clear_cache()
+        InstallerTactic.clear_pending()
         self.validate()
         self.find_or_create_target()
         self.generate()
@@ -859,9 +878,17 @@ class Builder(object):
     def inspect(self):
         self.charm = path(self.charm).abspath()
         self._check_path(self.charm)
+        if not (self.charm / '.build.manifest').exists():
+            raise BuildError('{} is not a built charm: no '
+                             '.build.manifest'.format(self.charm))
+        if getattr(self, 'query', None):
+            return inspector.query(self.charm, self.query,
+                                   verify=self.verify,
+                                   as_json=self.as_json)
         inspector.inspect(self.charm,
                           force_styling=self.force_color,
-                          annotate=self.annotate)
+                          annotate=self.annotate,
+                          as_json=self.as_json)
 
     def normalize_build_dir(self):
         charm_build_dir = os.environ.get('CHARM_BUILD_DIR')
@@ -923,6 +950,7 @@ class Builder(object):
         self._check_path(self.build_dir, need_write=True, can_create=True)
         self._check_path(self.cache_dir, need_write=True, can_create=True)
         self._check_path(self.wheelhouse_overrides)
+        self._check_path(self.wheelhouse_source)
 
     def clean_removed(self, signatures):
         """
@@ -974,7 +1002,8 @@ def make_url_from_lock_for_layer(lock_spec, use_branches=False):
       "item": "layer:basic",
       "type": "layer",
       "url": "https://github.com/juju-solutions/layer-basic.git",
-      "vcs": null
+      "vcs": "git",
+      "subdir": null
     }
 
     If the 'item' is present, then use that, so that the correct LayerFetcher
@@ -1060,6 +1089,19 @@ def inspect(args=None):
                              "rather than just using colors "
                              "(this is enabled automatically enabled if "
                              "colors are unavailable)")
+    parser.add_argument('--json', action="store_true", dest='as_json',
+                        help="Emit the tree of files, annotated with their "
+                             "layer and status, as JSON")
+    parser.add_argument('-q', '--query', action="append",
+                        help="Answer a query from the build manifest "
+                             "instead of rendering the tree: 'changed' for "
+                             "the files changed since the build, a layer "
+                             "name for the files it provided, or a file "
+                             "path for the layer it came from.  May be "
+                             "repeated")
+    parser.add_argument('--verify', action="store_true",
+                        help="Hash the files of the charm to verify the "
+                             "answers to --query, and find added files")
     parser.add_argument('-l', '--log-level', default=logging.INFO)
     parser.add_argument('charm', nargs="?", default=".", type=path)
     utils.add_plugin_description(parser)
@@ -1067,7 +1109,8 @@ def inspect(args=None):
     parser.parse_args(args, namespace=build)
     configLogging(build)
     try:
-        build.inspect()
+        if build.inspect() is False:
+            raise SystemExit(1)
     except BuildError as e:
         if e.args:
             log.error(*e.args)
@@ -1179,6 +1222,10 @@ def main(args=None):
     parser.add_argument('-W', '--wheelhouse-per-layer', action="store_true",
                         help="Deprecated: Use original wheelhouse processing "
                              "method (see PR juju/charm-tools#569)")
+    parser.add_argument('--wheelhouse-source', type=path,
+                        help="Build the wheelhouse only from the packages "
+                             "in this local directory (or its per-project "
+                             "subdirectories), instead of from PyPI")
     parser.add_argument('-v', '--verbose', action='store_true', default=False,
                         help="Increase output (same as -l DEBUG)")
     parser.add_argument('--debug', action='store_true',
@@ -1237,6 +1284,7 @@ def main(args=None):
     WheelhouseTactic.use_python_from_snap = build.use_python_from_snap
     WheelhouseTactic.upgrade_deps = build.upgrade_buildvenv_core_deps
     WheelhouseTactic.ignore_requires_python = build.ignore_requires_python
+    WheelhouseTactic.source = build.wheelhouse_source
 
     configLogging(build)
 
@@ -1244,13 +1292,17 @@ def main(args=None):
         build.check_series()
         build.normalize_build_dir()
         build.normalize_cache_dir()
+        LockedFetcher.MIRROR_DIR = build.cache_dir.dirname() / 'mirrors'
+        InstallerTactic.CACHE_DIR = build.cache_dir.dirname() / 'pip'
+        WheelhouseTactic.STORE_DIR = build.cache_dir.dirname() / 'wheels'
         build.check_paths()
         build.maybe_read_lock_file()
         build.workaround_charmcraft_maybe_ensure_build_packages()
 
         build()
 
-        lint, exit_code = proof.proof(build.target_dir, False, False)
+        lint, exit_code = proof.proof(build.target_dir, False, False,
+                                      build.cache_dir.dirname() / 'proof')
         llog = logging.getLogger("proof")
 
         if not lint:
@@ -1,10 +1,11 @@
+import hashlib
 import os
 import json
 import logging
 import shutil
+import tempfile
 
-import requests
-from charmtools import fetchers
+from charmtools import fetchers, utils
 from charmtools.fetchers import (git,  # noqa
                                  Fetcher,
                                  get_fetcher,
@@ -13,6 +14,7 @@ from charmtools.fetchers import (git,  # noqa
 from path import Path as path
 
 
+requests = utils.lazy_import('requests')
 log = logging.getLogger(__name__)
 
 
@@ -211,3 +213,100 @@ class InterfaceFetcher(LayerFetcher):
 
 
 fetchers.FETCHERS.insert(0, InterfaceFetcher)
+
+
+class LockedFetcher(Fetcher):
+    """Fetch a layer or interface straight from the repository and commit
+    recorded for it in a lock file.
+
+    Unlike :class:`LayerFetcher`, this never consults the layer index or the
+    local layer directories.  If ``MIRROR_DIR`` is set, a bare mirror of each
+    repository is kept there and reused across builds, so that rebuilding
+    from a lock file whose commits have all been seen before does not need
+    the network at all.
+
+    This is not registered in ``FETCHERS`` since it works from a lock entry
+    rather than a url.
+    """
+    MIRROR_DIR = None
+
+    def __init__(self, namespace, lock):
+        super(LockedFetcher, self).__init__(
+            lock['url'],
+            revision=lock['commit'],
+            fetched_url=lock['url'],
+            vcs=lock['vcs'],
+            subdir=lock.get('subdir'))
+        item = lock['item']
+        if item.startswith(namespace + ':'):
+            self.name = item[len(namespace) + 1:]
+        else:
+            self.name = item.rstrip('/').rsplit('/', 1)[-1]
+
+    @classmethod
+    def can_fetch_lock(cls, lock, use_branches=False):
+        """Whether the lock entry pins a git commit from a known repo."""
+        if not lock or lock.get('vcs') != 'git':
+            return False
+        if not (lock.get('url') and lock.get('commit')):
+            return False
+        if use_branches:
+            branch = lock.get('branch') or ''
+            if branch.startswith("refs/heads/"):
+                branch = branch[len("refs/heads/"):]
+            if branch not in ('', 'master', 'main'):
+                # tracking a branch; resolve it through the normal fetchers
+                return False
+        return True
+
+    def _has_commit(self, repo):
+        try:
+            git('cat-file -e {}^{{commit}}'.format(self.revision), cwd=repo)
+        except FetchError:
+            return False
+        return True
+
+    def mirror(self):
+        """Return the path of an up to date mirror of the repository which
+        contains the locked commit, creating or updating it if needed."""
+        mirror_dir = path(self.MIRROR_DIR)
+        mirror = mirror_dir / hashlib.sha1(self.url.encode('utf8')).hexdigest()
+        if mirror.exists():
+            if not self._has_commit(mirror):
+                log.debug('Updating mirror of %s', self.url)
+                git('fetch --prune origin', cwd=mirror)
+            return mirror
+        log.debug('Creating mirror of %s', self.url)
+        mirror_dir.makedirs_p()
+        tmp = tempfile.mkdtemp(dir=mirror_dir)
+        try:
+            git('clone --mirror {} {}'.format(self.url, tmp))
+            os.rename(tmp, mirror)
+        except OSError:
+            # another build published the mirror first
+            path(tmp).rmtree_p()
+        except FetchError:
+            path(tmp).rmtree_p()
+            raise
+        return mirror
+
+    def fetch(self, dir_):
+        clone_dir = tempfile.mkdtemp(dir=dir_)
+        if self.MIRROR_DIR:
+            git('clone --shared --no-checkout {} {}'.format(self.mirror(),
+                                                            clone_dir))
+        else:
+            git('clone --no-checkout {} {}'.format(self.url, clone_dir))
+        log.debug('Switching to revision: {}'.format(self.revision))
+        git('checkout {}'.format(self.revision), cwd=clone_dir)
+        target = path(dir_) / self.name
+        target.rmtree_p()
+        if self.subdir:
+            shutil.copytree(path(clone_dir) / self.subdir, target)
+            path(clone_dir).rmtree_p()
+        else:
+            os.rename(clone_dir, target)
+        return target
+
+    def get_revision(self, dir_):
+        return self.revision
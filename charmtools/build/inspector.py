@@ -1,7 +1,13 @@
 # coding=utf-8
 import json
+import os
+import sys
+from collections import defaultdict
+
+from path import Path as path
 from ruamel import yaml
 from charmtools.build import config
+from charmtools.build.errors import BuildError
 from charmtools import utils
 
 theme = {
@@ -21,31 +27,216 @@ theme = {
 }
 
 
-def scan_for(col, cur, depth):
-    for e, (rel, d) in col[cur:]:
-        if d and d == depth:
-            return True
-    return False
+def get_guides(depths):
+    """
+    Return the guide drawn before each entry of a walk, given the depth of
+    every entry.  Column ``i`` of an entry's guide has a line if an entry at
+    depth ``i`` occurs at or after it in the walk.
 
+    This is worked out in a single backwards pass over the walk.
+    """
+    guides = [None] * len(depths)
+    seen = set()
+    for cur in range(len(depths) - 1, -1, -1):
+        depth = depths[cur]
+        if depth:
+            seen.add(depth)
+        guides[cur] = "".join(" │  " if i in seen else "    "
+                              for i in range(depth))
+    return guides
 
-def get_prefix(walk, cur, depth, next_depth):
-    guide = []
-    for i in range(depth):
-        # scan forward in walk from i seeing if a subsequent
-        # entry happens at each depth
-        if scan_for(walk, cur, i):
-            guide.append(" │  ")
-        else:
-            guide.append("    ")
+
+def get_prefix(guide, depth, next_depth):
     if depth == next_depth:
         prefix = " ├─── "
     else:
         prefix = " └─── "
-    return "{}{}".format("".join(guide), prefix)
+    return "{}{}".format(guide, prefix)
+
+
+def get_layers(manifest):
+    """Return the ordered list of layers used for the legend."""
+    if isinstance(manifest['layers'][0], dict):
+        layers = [layer['url'] for layer in manifest['layers']]
+    else:
+        layers = list(manifest['layers'])
+    layers.reverse()
+    while layers[0].startswith('interface:'):
+        layers.append(layers.pop(0))
+    return layers
+
+
+def get_status(rel, added, changed):
+    if rel in added:
+        return "added"
+    elif rel in changed:
+        return "changed"
+    return None
+
+
+class ManifestIndex(object):
+    """
+    Index of the provenance of the files of a built charm, loaded from its
+    ``.build.manifest``.
+
+    Maps each path to the ``(layer, kind, sha256)`` it was built from and
+    each layer to the paths it provided, so that queries don't need to walk
+    or hash the charm unless asked to verify the answers.
+    """
+
+    def __init__(self, charm):
+        self.charm = path(charm)
+        self.manifest_path = self.charm / ".build.manifest"
+        if not self.manifest_path.exists():
+            raise BuildError('{} is not a built charm: no '
+                             '.build.manifest'.format(self.charm))
+        manifest = json.loads(self.manifest_path.text())
+        self.layers = get_layers(manifest)
+        self.files = {}
+        self.owned = defaultdict(list)
+        for rel, sig in sorted(manifest['signatures'].items()):
+            self.files[rel] = tuple(sig)
+            self.owned[sig[0]].append(rel)
+
+    def relpath(self, name):
+        name = path(name)
+        if name.isabs():
+            name = name.relpath(self.charm)
+        return str(name.normpath())
+
+    def which(self, name, verify=False):
+        """Return the layer, kind and sha a file was built from."""
+        rel = self.relpath(name)
+        result = {'path': rel, 'layer': None, 'kind': None, 'sha': None}
+        if rel in self.files:
+            result['layer'], result['kind'], result['sha'] = self.files[rel]
+            if verify:
+                result['status'] = self.verify_file(rel)
+        return result
+
+    def verify_file(self, rel):
+        layer, kind, sha = self.files[rel]
+        target = self.charm / rel
+        if not target.isfile():
+            return "deleted"
+        if layer == "build" or utils.sign(target) == sha:
+            return "unchanged"
+        return "changed"
+
+    def changed(self, verify=False):
+        """
+        Return the files that changed since the charm was built.
+
+        Without ``verify``, only the files listed in the manifest are
+        checked, and those modified after the manifest was written are
+        reported as changed.  With ``verify``, the charm is walked and
+        hashed, which also finds added files and ignores files that were
+        touched but not modified.
+        """
+        if verify:
+            added, changed, deleted = utils.delta_signatures(
+                self.manifest_path)
+        else:
+            added, changed, deleted = set(), set(), set()
+            built = self.manifest_path.stat().st_mtime
+            for rel, (layer, kind, sha) in self.files.items():
+                if layer == "build":
+                    continue
+                try:
+                    mtime = os.stat(self.charm / rel).st_mtime
+                except OSError:
+                    deleted.add(rel)
+                    continue
+                if mtime > built:
+                    changed.add(rel)
+        return {
+            'added': sorted(str(p) for p in added),
+            'changed': sorted(str(p) for p in changed),
+            'deleted': sorted(str(p) for p in deleted),
+            'verified': verify,
+        }
+
+    def query(self, term, verify=False):
+        """
+        Answer a single query: ``changed`` for the files that changed since
+        the build, the name of a layer for the files it provided, or else the
+        path of a file for the layer it came from.
+        """
+        if term == "changed":
+            result = self.changed(verify)
+        elif term in self.owned:
+            result = {'layer': term, 'files': list(self.owned[term])}
+        else:
+            result = self.which(term, verify)
+        result['query'] = term
+        return result
+
 
+def format_query(result):
+    """Return the lines used to show the result of a query as text."""
+    if 'files' in result:
+        return list(result['files'])
+    if 'changed' in result:
+        return (["+ {}".format(p) for p in result['added']] +
+                ["* {}".format(p) for p in result['changed']] +
+                ["- {}".format(p) for p in result['deleted']])
+    if result['layer'] is None:
+        return ["{}: not in manifest".format(result['path'])]
+    line = "{path}: {layer} ({kind}) {sha}".format(**result)
+    if 'status' in result:
+        line = "{} [{}]".format(line, result['status'])
+    return [line]
 
-def inspect(charm, force_styling=False, annotate=False):
-    tw = utils.TermWriter(force_styling=force_styling)
+
+def query(charm, terms, verify=False, as_json=False, fp=None):
+    """
+    Answer provenance queries about a built charm from its manifest.
+
+    :returns: False if any of the queried paths is not in the manifest.
+    """
+    fp = fp or sys.stdout
+    index = ManifestIndex(charm)
+    results = [index.query(term, verify) for term in terms]
+    if as_json:
+        json.dump(results, fp, indent=2)
+        fp.write("\n")
+    else:
+        for result in results:
+            for line in format_query(result):
+                fp.write(line + "\n")
+    fp.flush()
+    return all(result.get('layer', True) is not None for result in results)
+
+
+def annotated_tree(charm, walk, manifest, added, changed):
+    """
+    Return the files of the charm as a tree of nested dicts, each with the
+    name, path, type, layer (if known) and status (added or changed since
+    the build, if either) of the entry, and the children of directories.
+    """
+    root = {'name': charm.name, 'path': '.', 'type': 'dir', 'layer': None,
+            'status': None, 'children': []}
+    dirs = {'.': root}
+    for entry, (rel, depth) in walk:
+        sig = manifest['signatures'].get(rel)
+        node = {
+            'name': rel.name,
+            'path': str(rel),
+            'type': 'dir' if entry.isdir() else 'file',
+            'layer': sig[0] if sig else None,
+            'status': get_status(rel, added, changed),
+        }
+        if node['type'] == 'dir':
+            node['children'] = []
+            dirs[str(rel)] = node
+        parent = dirs.get(str(rel.dirname()) or '.', root)
+        parent['children'].append(node)
+    return root
+
+
+def inspect(charm, force_styling=False, annotate=False, as_json=False,
+            fp=None):
+    tw = utils.TermWriter(fp=fp, force_styling=force_styling)
     manp = charm / ".build.manifest"
     comp = charm / "layer.yaml"
     if not manp.exists() or not comp.exists():
@@ -54,14 +245,10 @@ def inspect(charm, force_styling=False, annotate=False):
     composer = yaml.safe_load(comp.open())
     a, c, d = utils.delta_signatures(manp)
 
-    # ordered list of layers used for legend
-    if isinstance(manifest['layers'][0], dict):
-        layers = [layer['url'] for layer in manifest['layers']]
-    else:
-        layers = list(manifest['layers'])
-    layers.reverse()
-    while layers[0].startswith('interface:'):
-        layers.append(layers.pop(0))
+    layers = get_layers(manifest)
+    layer_keys = {}
+    for i, layer in enumerate(layers):
+        layer_keys.setdefault(layer, i)
 
     def get_depth(e):
         rel = e.relpath(charm)
@@ -76,23 +263,32 @@ def inspect(charm, force_styling=False, annotate=False):
             suffix = "*"
         return suffix
 
-    def get_color(rel):
+    def get_color(entry, rel):
         # name of layer this belongs to
         color = tw.term.normal
         if rel in manifest['signatures']:
             layer = manifest['signatures'][rel][0]
-            if layer in layers:
-                layer_key = layers.index(layer)
-            else:
-                # handle special build created artifacts, which have
-                # a "layer name" of "build" (mostly the manifest itself)
-                layer_key = -1
+            # handle special build created artifacts, which have
+            # a "layer name" of "build" (mostly the manifest itself)
+            layer_key = layer_keys.get(layer, -1)
             color = getattr(tw, theme.get(layer_key, "normal"))
         else:
             if entry.isdir():
                 color = tw.blue
         return color
 
+    ignorer = utils.ignore_matcher(config.DEFAULT_IGNORES)
+    walk = sorted(utils.walk(charm, get_depth),
+                  key=lambda x: x[1][0])
+
+    if as_json:
+        tree = annotated_tree(charm, [w for w in walk if ignorer(w[1][0])],
+                              manifest, a, c)
+        json.dump({'charm': composer['is'], 'target': str(charm),
+                   'layers': layers, 'tree': tree}, tw.fp, indent=2)
+        tw.fp.write("\n")
+        return
+
     tw.write("Inspect %s\n" % composer["is"])
     if tw.does_styling or force_styling:
         tw.write("\n")
@@ -107,9 +303,7 @@ def inspect(charm, force_styling=False, annotate=False):
     tw.write("\n")
     tw.write("{t.blue}{target}{t.normal}\n", target=charm)
 
-    ignorer = utils.ignore_matcher(config.DEFAULT_IGNORES)
-    walk = sorted(utils.walk(charm, get_depth),
-                  key=lambda x: x[1][0])
+    guides = get_guides([depth for _, (_, depth) in walk])
     for i in range(len(walk) - 1):
         entry, (rel, depth) = walk[i]
         nEnt, (nrel, ndepth) = walk[i + 1]
@@ -124,15 +318,17 @@ def inspect(charm, force_styling=False, annotate=False):
                 annotation = ' ({}build artifact{})'.format(tw.bright_black,
                                                             tw.normal)
             else:
-                annotation = ' (from {}{}{})'.format(get_color(rel),
+                annotation = ' (from {}{}{})'.format(get_color(entry, rel),
                                                      layer_name,
                                                      tw.normal)
         else:
             annotation = ''
+        # written line by line, so output appears as it is produced
         tw.write("{prefix}{layerColor}{entry} "
                  "{t.bold}{suffix}{t.normal}{annotation}\n",
-                 prefix=get_prefix(walk, i, depth, ndepth),
-                 layerColor=get_color(rel),
+                 prefix=get_prefix(guides[i], depth, ndepth),
+                 layerColor=get_color(entry, rel),
                  suffix=get_suffix(rel),
                  entry=rel.name,
                  annotation=annotation)
+    tw.fp.flush()
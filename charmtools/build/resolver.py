@@ -0,0 +1,185 @@
+import logging
+from collections import OrderedDict
+
+from charmtools.build.errors import BuildError
+
+log = logging.getLogger(__name__)
+
+GRAPH_VERSION = 1
+
+
+class IncludeCycleError(BuildError):
+    pass
+
+
+def includes_of(layer):
+    """Return the list of includes declared by a fetched layer."""
+    includes = layer.config.get('includes', []) or []
+    if isinstance(includes, str):
+        includes = [includes]
+    return list(includes)
+
+
+class ResolvedGraph(object):
+    """
+    The flattened include graph of a charm.
+
+    Layers are kept bottom up, in the order in which they must be applied,
+    followed by the top layer.  Interfaces are kept in the order in which
+    they were first included.  Both are keyed by name so that membership
+    checks are constant time.
+    """
+
+    def __init__(self):
+        self.layers = OrderedDict()
+        self.interfaces = OrderedDict()
+        self.includes = {}
+
+    def __contains__(self, name):
+        return name in self.layers or name in self.interfaces
+
+    def add_layer(self, layer):
+        self.layers[layer.name] = layer
+        self.includes[layer.name] = includes_of(layer)
+
+    def add_interface(self, iface):
+        self.interfaces[iface.name] = iface
+
+    def results(self):
+        """
+        Return the graph in the form historically produced by
+        :meth:`Builder.fetch_deps`.
+        """
+        return {
+            "layers": list(self.layers.values()),
+            "interfaces": list(self.interfaces.values()),
+        }
+
+    def serialize(self):
+        """
+        Return a JSON compatible description of the graph, with the revision
+        of every layer and interface, suitable for storing in ``build.lock``.
+        """
+        def entry(item):
+            return {
+                'item': item.url,
+                'name': item.name,
+                'rev': item.revision,
+                'includes': self.includes.get(item.name, []),
+            }
+
+        layers = list(self.layers.values())
+        return {
+            'version': GRAPH_VERSION,
+            'top': {
+                'name': layers[-1].name,
+                'includes': self.includes[layers[-1].name],
+            },
+            'layers': [entry(layer) for layer in layers[:-1]],
+            'interfaces': [entry(iface) for iface in self.interfaces.values()],
+        }
+
+
+class IncludeResolver(object):
+    """
+    Resolve the include graph of a layer into a :class:`ResolvedGraph`.
+
+    :param make_item: Callable taking an include string (e.g. ``layer:basic``
+        or ``interface:http``) and returning an unfetched
+        :class:`~charmtools.build.builder.Layer` or
+        :class:`~charmtools.build.builder.Interface`.
+    :param on_fetched: Optional callable invoked with each item after it has
+        been fetched.
+    """
+
+    def __init__(self, make_item, on_fetched=None):
+        self.make_item = make_item
+        self.on_fetched = on_fetched or (lambda item: None)
+
+    def resolve(self, top_layer):
+        """
+        Recursively fetch and order everything included by ``top_layer``.
+
+        The ordering is a depth-first post-order traversal of the includes,
+        with the first inclusion of a given name winning.
+
+        :raises IncludeCycleError: if a layer (indirectly) includes itself.
+        """
+        graph = ResolvedGraph()
+        # the top layer is in progress too, so including it again is a cycle
+        in_progress = OrderedDict([(top_layer.name, top_layer.url)])
+        self._visit(top_layer, graph, in_progress)
+        graph.add_layer(top_layer)
+        return graph
+
+    def _visit(self, layer, graph, in_progress):
+        for base in includes_of(layer):
+            item = self.make_item(base)
+            if base.startswith("interface:"):
+                if item.name in graph.interfaces:
+                    continue
+                graph.add_interface(item.fetch())
+                self.on_fetched(item)
+                continue
+            if item.name in graph.layers:
+                continue
+            if item.name in in_progress:
+                chain = list(in_progress.values())
+                chain = chain[chain.index(in_progress[item.name]):]
+                raise IncludeCycleError(
+                    'Layer include cycle detected: {}'.format(
+                        ' -> '.join(chain + [base])))
+            item.fetch()
+            in_progress[item.name] = base
+            self._visit(item, graph, in_progress)
+            del in_progress[item.name]
+            graph.add_layer(item)
+            self.on_fetched(item)
+
+    def load(self, data, top_layer, is_pinned):
+        """
+        Rebuild a graph from its serialized form without re-resolving the
+        includes of every layer.
+
+        The stored graph is only used if it was recorded for the same top
+        layer includes and ``is_pinned`` confirms that every item is still
+        pinned to the revision it was recorded at; the items are then fetched
+        in the recorded order.  After fetching, each item must report the
+        recorded revision.
+
+        :param data: Graph, as produced by :meth:`ResolvedGraph.serialize`.
+        :param top_layer: The fetched top layer.
+        :param is_pinned: Callable taking a serialized entry and returning
+            whether it is pinned to an exact revision.
+        :returns: A :class:`ResolvedGraph`, or ``None`` if the stored graph
+            cannot be used and the includes must be resolved.
+        """
+        if not data or data.get('version') != GRAPH_VERSION:
+            return None
+        if data['top']['includes'] != includes_of(top_layer):
+            log.debug('Top layer includes changed; re-resolving layers')
+            return None
+        entries = data['layers'] + data['interfaces']
+        if not all(is_pinned(entry) for entry in entries):
+            log.debug('Not all layers are pinned; re-resolving layers')
+            return None
+        graph = ResolvedGraph()
+        fetched = []
+        for kind, add in (('layers', graph.add_layer),
+                          ('interfaces', graph.add_interface)):
+            for entry in data[kind]:
+                item = self.make_item(entry['item']).fetch()
+                if item.revision != entry['rev']:
+                    log.debug('%s is at %s rather than %s; re-resolving '
+                              'layers', entry['item'], item.revision,
+                              entry['rev'])
+                    return None
+                add(item)
+                fetched.append(item)
+        graph.add_layer(top_layer)
+        # only once the stored graph is known to be usable, as otherwise
+        # the items are fetched (and reported) again while resolving
+        for item in fetched:
+            self.on_fetched(item)
+        log.debug('Using resolved layer graph from lock file')
+        return graph
@@ -1,23 +1,30 @@
+from collections import OrderedDict
 from inspect import getfullargspec
+import base64
+import csv
 import errno
+import filecmp
 import json
 import logging
 import os
+import pathlib
 import re
+import stat
 import tarfile
 import tempfile
 import zipfile
 
-import jsonschema
-
-import requirements
 from path import Path as path
 
 from ruamel import yaml
 from charmtools import utils
 from charmtools import fetchers
+from charmtools import vcs
 from charmtools.build.errors import BuildError
 
+jsonschema = utils.lazy_import('jsonschema')
+requirements = utils.lazy_import('requirements')
+specifiers = utils.lazy_import('packaging.specifiers')
 log = logging.getLogger(__name__)
 
 
@@ -26,6 +33,25 @@ if not hasattr(yaml, 'danger_load'):
     yaml.danger_load = yaml.load
 
 
+def _dist_key(spec):
+    """Normalized project name of a requirement spec, or of an installed
+    ``.dist-info`` / ``.egg-info`` entry or top level package"""
+    egg = re.search(r'[#&]egg=([A-Za-z0-9][A-Za-z0-9._-]*)', spec)
+    if egg:
+        # a URL or VCS spec, named by its fragment
+        return re.sub(r'[-_.]+', '-', egg.group(1)).lower()
+    if '://' in spec or spec.startswith(('.', '/')):
+        return None
+    match = re.match(r'\s*([A-Za-z0-9][A-Za-z0-9._-]*)', spec)
+    if match is None:
+        return None
+    name = match.group(1)
+    if name.endswith(('.dist-info', '.egg-info')):
+        # the name is escaped, so anything after a hyphen is the version
+        name = name.rsplit('.', 1)[0].split('-')[0]
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
 def safe_name(name):
     """One-to-one equivalent to pkg_resources.safe_name"""
     return re.sub('[^A-Za-z0-9.]+', '-', name)
@@ -304,12 +330,30 @@ class CopyTactic(Tactic):
         if (self.entity != target) and not target.exists() \
                 or not self.entity.samefile(target):
             data = self.read()
+            if data:
+                same = target.isfile() and target.bytes() == data
+            else:
+                same = target.isfile() and filecmp.cmp(self.entity, target,
+                                                       shallow=False)
+            # the target may share its storage with other files, such as a
+            # wheel linked from the store, which mustn't change with it
+            shared = target.isfile() and target.stat().st_nlink > 1
+            if same and not (shared and self._mode_differs(target)):
+                # leave identical files (and their mtimes) alone
+                self.entity.copymode(target)
+                return
+            if shared:
+                target.unlink()
             if data:
                 target.write_bytes(data)
                 self.entity.copymode(target)
             else:
                 self.entity.copy2(target)
 
+    def _mode_differs(self, target):
+        return (stat.S_IMODE(self.entity.stat().st_mode) !=
+                stat.S_IMODE(target.stat().st_mode))
+
     def __str__(self):
         return "Copy {}".format(self.entity)
 
@@ -422,6 +466,7 @@ class DynamicHookBind(Tactic):
     """
     List of all hooks to populate.
     """
+    _templates = {}  # template file -> (stat when read, text)
 
     def __init__(self, name, owner, target, config, output_files,
                  template_file):
@@ -467,15 +512,37 @@ class DynamicHookBind(Tactic):
 
         The template is generally located at ``hooks/hook.template``
         """
-        template = self._template_file.text()
+        template = self.template()
         for target in self.targets:
             if target.relpath(self._target.directory) in self._output_files:
                 continue
             target.parent.makedirs_p()
-            target.write_text(template.format(self.name))
-            target.chmod(0o755)
+            content = template.format(self.name)
+            try:
+                unchanged = target.text() == content
+            except (OSError, UnicodeDecodeError):
+                unchanged = False
+            if not unchanged:
+                target.write_text(content)
+            if stat.S_IMODE(target.stat().st_mode) != 0o755:
+                target.chmod(0o755)
             self.tracked.append(target)
 
+    def template(self):
+        """
+        Return the text of the hook template.
+
+        The template is shared by all of the hook tactics of a build, so it is
+        only read again if it has changed since it was last read.
+        """
+        st = self._template_file.stat()
+        key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        cached = self._templates.get(self._template_file)
+        if cached is None or cached[0] != key:
+            cached = (key, self._template_file.text())
+            DynamicHookBind._templates[self._template_file] = cached
+        return cached[1]
+
     def sign(self):
         """
         Sign all hook files generated by this tactic.
@@ -960,6 +1027,41 @@ class ResourcesYAML(YAMLTactic):
     FILENAME = "resources.yaml"
 
 
+class RequirementLine(object):
+    """
+    A single line of a ``wheelhouse.txt`` or constraints file.
+
+    Lines are parsed once and memoized by their text, so that combining the
+    wheelhouses of many layers doesn't re-parse the lower layers' lines at
+    every level.  Comments, blank lines and lines which can't be parsed have
+    no ``req``.
+    """
+    _cache = {}
+
+    def __init__(self, line):
+        self.line = line
+        self.error = None
+        try:
+            self.requirements = tuple(requirements.parse(line))
+        except ValueError as e:
+            self.requirements = ()
+            self.error = e
+        self.req = self.requirements[0] if self.requirements else None
+        self.key = None
+        if self.req is not None and self.req.name is not None:
+            self.key = safe_name(self.req.name)
+
+    @classmethod
+    def parse(cls, line):
+        """Return the (possibly cached) parsed form of ``line``."""
+        if line.lstrip().startswith(('-r', '--requirement')):
+            # depends on the contents of another file
+            return cls(line)
+        if line not in cls._cache:
+            cls._cache[line] = cls(line)
+        return cls._cache[line]
+
+
 class InstallerTactic(Tactic):
     """
     Tactic to process any ``.pypi`` files and install Python packages directly
@@ -967,7 +1069,32 @@ class InstallerTactic(Tactic):
 
     This is used in Kubernetes type charms due to the lack of a proper install
     or bootstrap phase.
+
+    All of the ``.pypi`` files which install into the same directory are
+    resolved and installed by a single pip run, which uses ``CACHE_DIR`` (if
+    set) as its wheel cache so that downloads and built wheels are shared
+    between builds.  The installed files are then tracked and signed from the
+    ``RECORD`` of each installed distribution.  Files of the distributions
+    requested by a ``.pypi`` file are signed as coming from its layer, and
+    those of their dependencies as coming from ``__pip__``.
     """
+    CACHE_DIR = None
+    _pending = {}  # tactics read but not yet installed, by install directory
+
+    def __init__(self, *args, **kwargs):
+        super(InstallerTactic, self).__init__(*args, **kwargs)
+        self._installed = False
+        # top level entries which need to be walked to be signed, along with
+        # the layer they are credited to
+        self._tracked = []
+        # installed files and their layer and sha256 from a RECORD (None if
+        # unhashed)
+        self._record = {}
+
+    @classmethod
+    def clear_pending(cls):
+        """Forget the tactics read by an earlier build."""
+        cls._pending = {}
 
     def __str__(self):
         return "Installing software to {}".format(self.relpath)
@@ -979,14 +1106,37 @@ class InstallerTactic(Tactic):
         ext = relpath.splitext()[1]
         return ext in [".pypi", ]
 
+    @property
+    def spec(self):
+        return self.entity.text().strip()
+
+    def read(self):
+        ""  # suppress inherited doc
+        batch = self._pending.setdefault(self.target_file.dirname(), [])
+        if self not in batch:
+            batch.append(self)
+
     def __call__(self):
         # install package reference in trigger file
         # in place directory of target
         # XXX: Should this map multiline to "-r", self.entity
-        spec = self.entity.text().strip()
+        if self._installed:
+            # already installed as part of another tactic's batch
+            return
         target = self.target_file.dirname()
+        batch = self._pending.pop(target, [])
+        if self not in batch:
+            batch.insert(0, self)
+        owners = {}
+        for tactic in batch:
+            tactic._installed = True
+            owners.setdefault(_dist_key(tactic.spec), tactic.layer.url)
+        specs = list(OrderedDict.fromkeys(t.spec for t in batch))
         log.debug("pip installing {} as {}".format(
-            spec, target))
+            " ".join(specs), target))
+        cache_opts = ()
+        if self.CACHE_DIR:
+            cache_opts = ("--cache-dir", self.CACHE_DIR)
         with utils.tempdir(chdir=False) as temp_dir:
             # We do this dance so we don't have
             # to guess package and .egg file names
@@ -997,14 +1147,15 @@ class InstallerTactic(Tactic):
             utils.Process(("pip3",
                            "install",
                            "--user",
-                           "--ignore-installed",
-                           spec), env=localenv).exit_on_error()()
-            self._tracked = []
+                           "--ignore-installed") +
+                          cache_opts +
+                          tuple(specs), env=localenv).exit_on_error()()
             # We now manage two classes of explicit mappings
             # When python packages are installed into a prefix
             # we know that bin/* should map to <charmdir>/bin/
             # and lib/python*/site-packages/* should map to
             # <target>/*
+            mapping = {}
             src_paths = ["bin/*", "lib/python*/site-packages/*"]
             for p in src_paths:
                 for d in temp_dir.glob(p):
@@ -1012,35 +1163,81 @@ class InstallerTactic(Tactic):
                         continue
                     bp = d.relpath(temp_dir)
                     if bp.startswith("bin/"):
-                        dst = self.target / bp
-                    elif bp.startswith("lib"):
+                        dst = self.target.directory / bp
+                    else:
                         dst = target / d.name
+                    mapping[d] = dst
+            recorded = set()
+            for record in temp_dir.glob(
+                    "lib/python*/site-packages/*.dist-info/RECORD"):
+                owner = owners.get(_dist_key(record.dirname().name),
+                                   '__pip__')
+                roots = (record.dirname().dirname(), temp_dir / "bin")
+                for src, sha in self._read_record(record):
+                    for root in roots:
+                        rel = src.relpath(root)
+                        if not rel.startswith(".."):
+                            top = root / rel.splitall()[1]
+                            break
                     else:
-                        dst = target / bp
-                    if dst.exists():
-                        if dst.isdir():
-                            dst.rmtree_p()
-                        elif dst.isfile():
-                            dst.remove()
-                    if not dst.parent.exists():
-                        dst.parent.makedirs_p()
-                    log.debug("Installer moving {} to {}".format(d, dst))
-                    d.move(dst)
-                    self._tracked.append(dst)
+                        top = None
+                    if top not in mapping:
+                        continue  # not installed into the charm
+                    dst = mapping[top] / src.relpath(top)
+                    self._record[dst.normpath()] = owner, sha
+                    recorded.add(top)
+            for d, dst in mapping.items():
+                if dst.exists():
+                    if dst.isdir():
+                        dst.rmtree_p()
+                    elif dst.isfile():
+                        dst.remove()
+                if not dst.parent.exists():
+                    dst.parent.makedirs_p()
+                log.debug("Installer moving {} to {}".format(d, dst))
+                d.move(dst)
+                if d not in recorded:
+                    # e.g. a legacy egg install; no RECORD to go by
+                    self._tracked.append(
+                        (owners.get(_dist_key(d.name), '__pip__'), dst))
+
+    @staticmethod
+    def _read_record(record):
+        """
+        Yield the installed files listed in a distribution's ``RECORD``,
+        along with their sha256 hex digest, or None if it isn't recorded.
+        """
+        site_packages = record.dirname().dirname()
+        with open(record, newline='') as fp:
+            for row in csv.reader(fp):
+                if not row:
+                    continue
+                src = (site_packages / row[0]).normpath()
+                algo, _, digest = (row[1] if len(row) > 1 else '').partition(
+                    '=')
+                sha = None
+                if algo == 'sha256' and digest:
+                    sha = base64.urlsafe_b64decode(
+                        digest + '=' * (-len(digest) % 4)).hex()
+                yield src, sha
 
     def sign(self):
         ""  # suppress inherited doc
         sigs = {}
-        for d in self._tracked:
+        for f, (layer, sha) in self._record.items():
+            if not f.isfile():
+                continue
+            relpath = f.relpath(self.target.directory)
+            sigs[relpath] = (layer, "dynamic", sha or utils.sign(f))
+        for layer, d in self._tracked:
             if d.isdir():
                 for entry, sig in utils.walk(d,
                                              utils.sign, kind="files"):
                     relpath = entry.relpath(self.target.directory)
-                    sigs[relpath] = (self.layer.url, "dynamic", sig)
+                    sigs[relpath] = (layer, "dynamic", sig)
             elif d.isfile():
                 relpath = d.relpath(self.target.directory)
-                sigs[relpath] = (
-                    self.layer.url, "dynamic", utils.sign(d))
+                sigs[relpath] = (layer, "dynamic", utils.sign(d))
         return sigs
 
 
@@ -1061,6 +1258,11 @@ class WheelhouseTactic(ExactMatch, Tactic):
     use_python_from_snap = False
     upgrade_deps = False
     ignore_requires_python = False
+    # shared store of downloaded wheels, linked into each wheelhouse
+    STORE_DIR = None
+    # local directory to get packages from, instead of the package index
+    source = None
+    SDIST_EXTENSIONS = ('.tar.gz', '.tgz', '.tar.bz2', '.tar.xz', '.zip')
     _default_cons = [
         "setuptools<82",
     ]
@@ -1083,6 +1285,8 @@ class WheelhouseTactic(ExactMatch, Tactic):
         self.modules = {}
         self.constraints = {}
         self.lock_info = []
+        # sha256 of the wheels taken from the store
+        self._signatures = {}
 
     def __str__(self):
         directory = self.target.directory / 'wheelhouse'
@@ -1095,8 +1299,97 @@ class WheelhouseTactic(ExactMatch, Tactic):
         :rtype: dict[str, str]
         """
         if self.use_python_from_snap:
-            return os.environ.copy()
-        return utils.host_env()
+            env = os.environ.copy()
+        else:
+            env = utils.host_env()
+        if self.source:
+            # applies to every use of pip, including setting up the venv
+            env['PIP_NO_INDEX'] = '1'
+            env['PIP_FIND_LINKS'] = ' '.join(
+                pathlib.Path(d).absolute().as_uri()
+                for d in self._source_dirs())
+        return env
+
+    def _source_dirs(self):
+        """The source directory, and any per-project directories within it
+        (as in a simple index)."""
+        source = path(self.source)
+        return [source] + sorted(source.dirs())
+
+    def _source_versions(self):
+        """Return the versions of each project available from the source.
+
+        :returns: Mapping of normalized project name to versions
+        :rtype: dict[str, set[str]]
+        """
+        available = {}
+        for directory in self._source_dirs():
+            for dist in directory.files():
+                name = dist.name
+                if name.endswith('.whl'):
+                    parts = name.split('-')
+                    if len(parts) < 5:
+                        continue
+                    project, version = parts[:2]
+                else:
+                    ext = next((ext for ext in self.SDIST_EXTENSIONS
+                                if name.endswith(ext)), None)
+                    if ext is None or '-' not in name:
+                        continue
+                    project, version = name[:-len(ext)].rsplit('-', 1)
+                available.setdefault(_dist_key(project), set()).add(version)
+        return available
+
+    def _check_source(self):
+        """Check that every requirement and constraint can be satisfied by
+        the packages in the source directory, before spending any time
+        building the wheelhouse.
+
+        Only the requirements themselves are checked; their dependencies
+        can only be found by pip.  Requirements given as a URL are skipped.
+
+        :raises BuildError: listing all of the missing requirements
+        """
+        available = self._source_versions()
+        reqs, cons = [], {}
+        for tactic in (self.previous + [self] if self.per_layer
+                       else [self]):
+            tactic.read()
+            for line in tactic.lines or []:
+                parsed_line = RequirementLine.parse(line)
+                req = parsed_line.req
+                if req is not None and req.name and not req.uri:
+                    reqs.append(parsed_line)
+            for line in tactic.cons_lines or []:
+                parsed_line = RequirementLine.parse(line)
+                if parsed_line.req is not None and parsed_line.req.name:
+                    cons.setdefault(_dist_key(parsed_line.req.name),
+                                    []).append(parsed_line)
+
+        def satisfied(key, lines):
+            spec = specifiers.SpecifierSet(','.join(
+                op + version
+                for parsed_line in lines
+                for op, version in parsed_line.req.specs))
+            return any(spec.contains(version)
+                       for version in available.get(key, ()))
+
+        missing = []
+        for parsed_line in reqs:
+            key = _dist_key(parsed_line.req.name)
+            if not satisfied(key, [parsed_line] + cons.get(key, [])):
+                missing.append(parsed_line.line.strip())
+        required = {_dist_key(parsed_line.req.name) for parsed_line in reqs}
+        for key, lines in cons.items():
+            # constraints on projects which aren't available may simply not
+            # be needed, but if they are available they must fit
+            if key not in required and key in available and \
+                    not satisfied(key, lines):
+                missing.extend(line.line.strip() for line in lines)
+        if missing:
+            raise BuildError(
+                'Unable to satisfy the following requirements from '
+                '{}:\n    {}'.format(self.source, '\n    '.join(missing)))
 
     def combine(self, existing):
         """Combine the current layer's  WheelhouseTactic with the previous
@@ -1116,57 +1409,47 @@ class WheelhouseTactic(ExactMatch, Tactic):
         self.cons_layer_refs.update(existing.cons_layer_refs)
         self.read()
 
-        # Update packages from the current layer
-        new_pkgs = set()
-        for line in self.lines or []:
-            try:
-                req = next(requirements.parse(line))
-                new_pkgs.add(safe_name(req.name))
-                self.modules[req.name] = req
-            except (StopIteration, ValueError):
-                pass  # ignore comments, blank lines, etc
-        existing_lines = []
-        for line in existing.lines or []:
-            try:
-                req = next(requirements.parse(line))
-                # new explicit reqs will override existing ones
-                if safe_name(req.name) not in new_pkgs:
-                    existing_lines.append(line)
-                    self.modules[req.name] = req
-                else:
-                    existing_lines.append(
-                        f'# {line}  # overridden by {self.layer.url}')
-            except (StopIteration, ValueError):
-                existing_lines.append(line)  # ignore comments, blank lines, &c
-        self.lines = existing_lines + (self.lines or [])
-
-        # Update constraints from the current layer
-        new_cons = set()
-        for line in self.cons_lines or []:
-            try:
-                req = next(requirements.parse(line))
-                new_cons.add(safe_name(req.name))
-                self.constraints[req.name] = req
-            except (StopIteration, ValueError):
-                pass  # ignore comments, blank lines, etc
-        existing_cons_lines = []
-        for line in existing.cons_lines or []:
-            try:
-                req = next(requirements.parse(line))
-                # New constraints will override existing ones
-                if safe_name(req.name) not in new_cons:
-                    existing_cons_lines.append(line)
-                    self.constraints[req.name] = req
-                else:
-                    existing_cons_lines.append(
-                        f'# {line}  # overridden by {self.layer.url}')
-            except (StopIteration, ValueError):
-                # ignore comments, blank lines, &c
-                existing_cons_lines.append(line)
-        self.cons_lines = existing_cons_lines + (self.cons_lines or [])
+        self.lines = self._merge_lines(existing.lines, self.lines,
+                                       self.modules)
+        self.cons_lines = self._merge_lines(existing.cons_lines,
+                                            self.cons_lines,
+                                            self.constraints)
 
         return self
 
+    def _merge_lines(self, lower, upper, parsed):
+        """Merge the requirement lines of this layer over those of the lower
+        layers, commenting out any lower requirements which are overridden.
+
+        :param lower: Lines from the lower layers
+        :type lower: list[str] or None
+        :param upper: Lines from this layer
+        :type upper: list[str] or None
+        :param parsed: Requirements by name, updated with the merged ones
+        :type parsed: dict
+        :returns: Merged lines
+        :rtype: list[str]
+        """
+        upper = upper or []
+        new = set()
+        for line in upper:
+            parsed_line = RequirementLine.parse(line)
+            if parsed_line.req is not None:
+                new.add(parsed_line.key)
+                parsed[parsed_line.req.name] = parsed_line.req
+        merged = []
+        for line in lower or []:
+            parsed_line = RequirementLine.parse(line)
+            if parsed_line.req is None:
+                merged.append(line)  # ignore comments, blank lines, &c
+            elif parsed_line.key not in new:
+                merged.append(line)
+                parsed[parsed_line.req.name] = parsed_line.req
+            else:
+                # new explicit reqs will override existing ones
+                merged.append(f'# {line}  # overridden by {self.layer.url}')
+        return merged + upper
+
     def read(self):
         """Read the package requirements from the current ``wheelhouse.txt``
         and the constraints from the current ``wheelhouse-constraints.txt``
@@ -1176,12 +1459,7 @@ class WheelhouseTactic(ExactMatch, Tactic):
         if self.lines is None:
             src = path(self.entity)
             if src.exists():
-                for req in requirements.parse(src.text()):
-                    if req.name is None:
-                        raise BuildError(
-                            'Unable to determine package name for '
-                            f'"{req.line.strip()}"; did you forget "#egg=..."?'
-                        )
+                for req in self._parse_file(src):
                     self.layer_refs[safe_name(req.name)] = self.layer.url
                 self.lines = (['# ' + self.layer.url] +
                               src.lines(retain=False) +
@@ -1193,12 +1471,7 @@ class WheelhouseTactic(ExactMatch, Tactic):
         if self.cons_lines is None:
             src = path(self.entity).dirname() / self.CONS_FILENAME
             if src.exists():
-                for req in requirements.parse(src.text()):
-                    if req.name is None:
-                        raise BuildError(
-                            'Unable to determine package name for '
-                            f'"{req.line.strip()}"; did you forget "#egg=..."?'
-                        )
+                for req in self._parse_file(src):
                     self.cons_layer_refs[safe_name(req.name)] = self.layer.url
                 self.cons_lines = (['# ' + self.layer.url] +
                                    src.lines(retain=False) +
@@ -1206,6 +1479,22 @@ class WheelhouseTactic(ExactMatch, Tactic):
             else:
                 self.cons_lines = []
 
+    @staticmethod
+    def _parse_file(src):
+        """Yield the requirements of a requirements file, requiring a name
+        for each of them."""
+        for line in src.text().splitlines():
+            parsed_line = RequirementLine.parse(line)
+            if parsed_line.error is not None:
+                raise parsed_line.error
+            for req in parsed_line.requirements:
+                if req.name is None:
+                    raise BuildError(
+                        'Unable to determine package name for '
+                        f'"{req.line.strip()}"; did you forget "#egg=..."?'
+                    )
+                yield req
+
     def _add(self, wheelhouse, *reqs, constraints=None):
         """
         Helper method to add the given requirements to the wheelhouse
@@ -1309,11 +1598,46 @@ class WheelhouseTactic(ExactMatch, Tactic):
                             "vcs": None,
                             "version": version,
                         })
-                wheel.move(wheelhouse)
+                if self.STORE_DIR:
+                    self._signatures[dest] = self._link_from_store(wheel,
+                                                                   dest)
+                else:
+                    wheel.move(wheelhouse)
                 self.tracked.append(dest)
 
+    def _link_from_store(self, wheel, dest):
+        """
+        Add a downloaded wheel to the store, keyed by its filename and
+        sha256, and link the stored copy into the wheelhouse as ``dest``.
+
+        :returns: The sha256 of the wheel
+        :rtype: str
+        """
+        sha = utils.sign(wheel)
+        stored = path(self.STORE_DIR) / sha / wheel.name
+        if not stored.exists():
+            stored.parent.makedirs_p()
+            # another build may be storing the same wheel; only ever replace
+            # it with a complete copy
+            fd, temp = tempfile.mkstemp(dir=stored.parent,
+                                        prefix='.' + wheel.name)
+            os.close(fd)
+            wheel.move(temp)
+            # the stored copy is shared by every charm linking it, so it
+            # must never be written to through any of them
+            os.chmod(temp, 0o444)
+            os.replace(temp, stored)
+        log.debug('Linking %s from %s', dest.name, stored.parent)
+        utils.link_or_copy(stored, dest)
+        return sha
+
     @staticmethod
     def _extract_pkg_vcs(wheel, req):
+        try:
+            # only reads the VCS markers, rather than extracting everything
+            return vcs.get_archive_revision(wheel, req.name) or ''
+        except vcs.UnreadableArchive as e:
+            log.debug('Extracting %s to find its revision: %s', wheel.name, e)
         with utils.tempdir(chdir=False) as temp_dir:
             dst_file = temp_dir / wheel.name
             dst_dir = temp_dir / 'unarchive'
@@ -1351,6 +1675,8 @@ class WheelhouseTactic(ExactMatch, Tactic):
         return self._run_in_venv('pip3', *args, env=env)
 
     def __call__(self):
+        if self.source:
+            self._check_source()
         create_venv = self._venv is None
         self._venv = self._venv or path(tempfile.mkdtemp())
         wheelhouse = self.target.directory / 'wheelhouse'
@@ -1402,21 +1728,15 @@ class WheelhouseTactic(ExactMatch, Tactic):
         if not self.cons_lines:
             self.cons_lines = self._default_cons
         else:
-            existing_cons = set()
-            for line in self.cons_lines:
-                try:
-                    req = next(requirements.parse(line))
-                    existing_cons.add(safe_name(req.name))
-                except (StopIteration, ValueError):
-                    pass  # ignore comments, blank lines, etc
+            existing_cons = {RequirementLine.parse(line).key
+                             for line in self.cons_lines}
             def_cons_added = []
             for def_cons in self._default_cons:
-                try:
-                    req = next(requirements.parse(def_cons))
-                    if safe_name(req.name) not in existing_cons:
-                        def_cons_added.append(def_cons)
-                except (StopIteration, ValueError):
-                    pass  # ignore comments, blank lines, etc
+                parsed_line = RequirementLine.parse(def_cons)
+                if parsed_line.req is None:
+                    continue  # ignore comments, blank lines, etc
+                if parsed_line.key not in existing_cons:
+                    def_cons_added.append(def_cons)
             if def_cons_added:
                 self.cons_lines.append('# Default constraints')
                 self.cons_lines.extend(def_cons_added)
@@ -1461,7 +1781,8 @@ class WheelhouseTactic(ExactMatch, Tactic):
             pkg_name = safe_name(d.basename().split('-')[0])
             layer_url = self.layer_refs.get(pkg_name, '__pip__')
             sigs[relpath] = (
-                layer_url, "dynamic", utils.sign(d))
+                layer_url, "dynamic",
+                self._signatures.get(d) or utils.sign(d))
         return sigs
 
 
@@ -1569,8 +1890,12 @@ class VersionTactic(Tactic):
         return True
 
     def _try_to_get_current_sha(self):
+        # only ask the VCS the charm is actually in
+        vcs_name, _ = vcs.find_root(self.charm)
         with utils.cd(str(self.charm)):
             for cmd in self.CMDS:
+                if cmd[0] != vcs_name:
+                    continue
                 try:
                     log.debug('Trying to determine version with: '
                               '{}'.format(cmd[0]))
@@ -5,11 +5,11 @@ import os
 import re
 import yaml
 
-import jujubundlelib.validation
-from charmtools.utils import validate_display_name
+from charmtools.utils import lazy_import, validate_display_name
 
 from charmtools.linter import Linter
 
+bundle_validation = lazy_import('jujubundlelib.validation')
 
 charm_url_includes_id = re.compile(r'-\d+$').search
 
@@ -54,7 +54,7 @@ class BundleLinter(Linter):
         if len(readmes) < 1:
             self.warn('No readme file found')
 
-        errors = jujubundlelib.validation.validate(data)
+        errors = bundle_validation.validate(data)
         for error in errors:
             self.err(error)
         self.validate(data)
@@ -67,6 +67,7 @@ class Bundle(object):
             'bundle.yaml'
         ]
         self.debug = debug
+        self._data = None
         if not self.is_bundle():
             raise Exception('Not a bundle')
 
@@ -92,10 +93,15 @@ class Bundle(object):
         return bool(v4_keys & bundle_keys)
 
     def bundle_file(self, parse=True):
+        if parse and self._data is not None:
+            return self._data
         for f in self.supported_files:
             if os.path.isfile(os.path.join(self.bundle_path, f)):
                 with open(os.path.join(self.bundle_path, f)) as d:
-                    return yaml.safe_load(d.read()) if parse else d.read()
+                    if not parse:
+                        return d.read()
+                    self._data = yaml.safe_load(d.read())
+                    return self._data
 
         raise Exception('No bundle.json or bundle.yaml file found')
 
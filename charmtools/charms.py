@@ -2,13 +2,17 @@ from __future__ import absolute_import
 
 import os
 import re
+import json
+import errno
 import hashlib
 import email.utils
+import functools
 import six
 
 import colander
 import yaml
 
+from collections import deque
 from stat import ST_MODE
 from stat import S_IXUSR
 
@@ -76,6 +80,85 @@ class RelationError(Exception):
     pass
 
 
+class PatternMatcher(object):
+    """
+    Aho-Corasick automaton finding which of a set of patterns occur in a
+    text, in a single pass over the text regardless of the number of
+    patterns.
+
+    The automaton is built as a DFA (failure transitions are folded into
+    each state's transitions) so that matching does a single dict lookup
+    per character.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        goto = [{}]
+        out = [set()]
+        for i, pattern in enumerate(self.patterns):
+            state = 0
+            for ch in pattern:
+                if ch not in goto[state]:
+                    goto.append({})
+                    out.append(set())
+                    goto[state][ch] = len(goto) - 1
+                state = goto[state][ch]
+            out[state].add(i)
+
+        fail = [0] * len(goto)
+        delta = [None] * len(goto)
+        delta[0] = dict(goto[0])
+        queue = deque(goto[0].values())
+        while queue:
+            # breadth first, so the failure state is always complete
+            state = queue.popleft()
+            delta[state] = dict(delta[fail[state]])
+            delta[state].update(goto[state])
+            for ch, target in goto[state].items():
+                fail[target] = delta[fail[state]].get(ch, 0)
+                out[target] |= out[fail[target]]
+                queue.append(target)
+        self._delta = delta
+        self._out = out
+
+    def search(self, chunks):
+        """
+        Return the set of indices of the patterns occurring in the text
+        given as an iterable of ``chunks``; matches may span chunks.
+        """
+        delta, out = self._delta, self._out
+        state = 0
+        found = set()
+        for chunk in chunks:
+            for ch in chunk:
+                state = delta[state].get(ch, 0)
+                if out[state]:
+                    found |= out[state]
+            if len(found) == len(self.patterns):
+                break
+        return found
+
+
+@functools.lru_cache(maxsize=None)
+def template_icon_sha1():
+    """Return the sha1 of the template icon.svg, computed once."""
+    with open(TEMPLATE_ICON, 'rb') as ti:
+        return hashlib.sha1(ti.read()).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def boilerplate_matcher():
+    """Return a :class:`PatternMatcher` for the lines of the template README
+    considered boilerplate, built once."""
+    with open(TEMPLATE_README) as tr:
+        return PatternMatcher(line.strip() for line in tr
+                              if len(line) >= 40 and line.strip())
+
+
+def _read_chunks(fp, size=64 * 1024):
+    return iter(lambda: fp.read(size), '')
+
+
 class CharmLinter(Linter):
 
     # _WINDOWS_HOOKS_EXTS is the list of possible extensions for hooks
@@ -83,38 +166,70 @@ class CharmLinter(Linter):
     # we must specially check for them when linting the hooks.
     _WINDOWS_HOOKS_EXTS = [".ps1", ".cmd", ".bat", ".exe"]
 
+    # Rules applied to every line of every hook, as (pattern, message)
+    # pairs; a warning is emitted for each line matching a pattern.
+    HOOK_RULES = [
+        (re.compile(r"http://169\.254\.169\.254/"),
+         "hook accesses EC2 metadata service directly"),
+    ]
+
+    def __init__(self, *args, **kwargs):
+        super(CharmLinter, self).__init__(*args, **kwargs)
+        self._hook_indexes = {}
+        self._hook_scans = {}
+
+    def _hook_index(self, hooks_path):
+        """Return a mapping of file name to ``os.DirEntry`` for the hooks
+        directory, listing it only the first time."""
+        index = self._hook_indexes.get(hooks_path)
+        if index is None:
+            try:
+                with os.scandir(hooks_path) as entries:
+                    index = {entry.name: entry for entry in entries}
+            except OSError:
+                index = {}
+            self._hook_indexes[hooks_path] = index
+        return index
+
+    def _scan_hook(self, hook_path):
+        """Return ``(line number, message)`` for every line of the hook
+        matching one of the ``HOOK_RULES``, reading the hook only once."""
+        if hook_path not in self._hook_scans:
+            matches = []
+            with open(hook_path, 'r') as hook_file:
+                for count, line in enumerate(hook_file, 1):
+                    for pattern, msg in self.HOOK_RULES:
+                        if pattern.search(line):
+                            matches.append((count, msg))
+            self._hook_scans[hook_path] = matches
+        return self._hook_scans[hook_path]
+
     def check_hook(self, hook, hooks_path, recommended=False):
-        hook_path = os.path.join(hooks_path, hook)
+        index = self._hook_index(hooks_path)
+        entry = index.get(hook)
         ispscharm = False  # flag to indicate whether PowerShell charm or not.
 
         # iterate through the possible hook-extension
         # combinations and find the right one:
-        for path in [hook_path + ext for ext in self._WINDOWS_HOOKS_EXTS]:
-            if os.path.isfile(path):
-                hook_path = path
+        for ext in self._WINDOWS_HOOKS_EXTS:
+            candidate = index.get(hook + ext)
+            if candidate is not None and candidate.is_file():
+                entry = candidate
                 ispscharm = True
                 break
 
         try:
-            mode = os.stat(hook_path)[ST_MODE]
+            if entry is None:
+                raise OSError(errno.ENOENT, 'No such hook', hook)
+            mode = entry.stat()[ST_MODE]
 
             # NOTE: hooks on Windows are judged as executable depending on
             # their extension; not their mode.
             if (not mode & S_IXUSR) and not ispscharm:
                 self.info(hook + " not executable")
 
-            with open(hook_path, 'r') as hook_file:
-                count = 0
-                for line in hook_file:
-                    count += 1
-                    hook_warnings = [
-                        {'re': re.compile(r"http://169\.254\.169\.254/"),
-                         'msg': "hook accesses EC2 metadata service directly"}]
-                    for warning in hook_warnings:
-                        if warning['re'].search(line):
-                            self.warn(
-                                "(%s:%d) - %s" %
-                                (hook, count, warning['msg']))
+            for count, msg in self._scan_hook(entry.path):
+                self.warn("(%s:%d) - %s" % (hook, count, msg))
             return True
 
         except OSError:
@@ -336,15 +451,14 @@ class Charm(object):
                 lint.info("No icon.svg file.")
             else:
                 # should have an icon.svg
-                template_sha1 = hashlib.sha1()
                 icon_sha1 = hashlib.sha1()
                 try:
-                    with open(TEMPLATE_ICON, 'rb') as ti:
-                        template_sha1.update(ti.read())
-                        icon_file = os.path.join(charm_path, 'icon.svg')
-                        with open(icon_file, 'rb') as ci:
-                            icon_sha1.update(ci.read())
-                    if template_sha1.hexdigest() == icon_sha1.hexdigest():
+                    template_sha1 = template_icon_sha1()
+                    icon_file = os.path.join(charm_path, 'icon.svg')
+                    with open(icon_file, 'rb') as ci:
+                        for chunk in iter(lambda: ci.read(64 * 1024), b''):
+                            icon_sha1.update(chunk)
+                    if template_sha1 == icon_sha1.hexdigest():
                         lint.info("Includes template icon.svg file.")
                 except IOError as e:
                     lint.info(
@@ -369,24 +483,16 @@ class Charm(object):
                 if 'README.ex' in found_readmes:
                     lint.warn("Includes template README.ex file")
                 try:
-                    with open(TEMPLATE_README) as tr:
-                        bad_lines = []
-                        for line in tr:
-                            if len(line) >= 40:
-                                bad_lines.append(line.strip())
-                        for readme in found_readmes:
-                            readme_path = os.path.join(charm_path, readme)
-                            with open(readme_path) as r:
-                                readme_content = r.read()
-                                lc = 0
-                                for bl in bad_lines:
-                                    if not len(bl):
-                                        continue
-                                    lc += 1
-                                    if bl in readme_content:
-                                        err_msg = ('%s includes boilerplate: '
-                                                   '%s')
-                                        lint.warn(err_msg % (readme, bl))
+                    matcher = boilerplate_matcher()
+                    for readme in found_readmes:
+                        readme_path = os.path.join(charm_path, readme)
+                        with open(readme_path) as r:
+                            found = matcher.search(_read_chunks(r))
+                        for i, bl in enumerate(matcher.patterns):
+                            if i in found:
+                                err_msg = ('%s includes boilerplate: '
+                                           '%s')
+                                lint.warn(err_msg % (readme, bl))
                 except IOError as e:
                     lint.warn(
                         "Error while opening %s (%s)" %
@@ -666,18 +772,46 @@ class PayloadItem(colander.MappingSchema):
     )
 
 
+# Schemas are compiled once per process and reused across items and charms:
+# item schemas are keyed by their class, extension schemas by a hash of the
+# extensions dict.
+_ROOT_SCHEMA = colander.SchemaNode(colander.Mapping())
+_item_schemas = {}
+_extension_schemas = {}
+
+
+def _item_schema(item_class, name):
+    """Return the cached schema for ``item_class``, named ``name`` so that
+    errors are reported against the item being validated."""
+    schema = _item_schemas.get(item_class)
+    if schema is None:
+        schema = _item_schemas[item_class] = item_class()
+    schema.name = name
+    return schema
+
+
+def _extensions_schema(proof_extensions):
+    key = hashlib.sha256(json.dumps(
+        proof_extensions, sort_keys=True, default=str).encode('utf8')
+    ).hexdigest()
+    schema = _extension_schemas.get(key)
+    if schema is None:
+        schema = _extension_schemas[key] = SchemaBuilder().dict_to_schema({
+            'name': 'extensions',
+            'type': 'Mapping',
+            'subnodes': proof_extensions,
+        })
+    return schema
+
+
 def _try_proof_extensions(e, proof_extensions):
     if not proof_extensions:
         raise e
-    proof_extensions = {'name': 'extensions',
-                        'type': 'Mapping',
-                        'subnodes': proof_extensions}
     new_e = colander.Invalid(e.node)
     for child_e in e.children:
         if isinstance(child_e, colander.UnsupportedFields):
             try:
-                schema_builder = SchemaBuilder()
-                schema = schema_builder.dict_to_schema(proof_extensions)
+                schema = _extensions_schema(proof_extensions)
                 schema.deserialize(child_e.fields)
             except colander.Invalid as ext_e:
                 new_e.add(ext_e)
@@ -687,6 +821,24 @@ def _try_proof_extensions(e, proof_extensions):
         raise new_e
 
 
+def _validate_items(section, items, item_class, linter, proof_extensions):
+    """Validate each of the ``items`` of a metadata ``section`` against the
+    cached schema for ``item_class``, reporting errors to ``linter``.
+
+    """
+    for name, value in items.items():
+        try:
+            try:
+                _item_schema(item_class, name).deserialize(value)
+            except colander.Invalid as item_e:
+                e = colander.Invalid(_ROOT_SCHEMA)
+                e.add(item_e)
+                _try_proof_extensions(e, proof_extensions)
+        except colander.Invalid as e:
+            for k, v in e.asdict().items():
+                linter.err('{}.{}: {}'.format(section, k, v))
+
+
 def validate_terms(charm, linter):
     """Validate terms in charm metadata.
 
@@ -721,18 +873,8 @@ def validate_resources(charm, linter, proof_extensions=None):
         linter.err('resources: must be a dictionary of resource definitions')
         return
 
-    schema = colander.SchemaNode(colander.Mapping())
-    for resource_def in charm['resources']:
-        schema.add(ResourceItem(name=resource_def))
-
-    try:
-        try:
-            schema.deserialize(charm['resources'])
-        except colander.Invalid as e:
-            _try_proof_extensions(e, proof_extensions)
-    except colander.Invalid as e:
-        for k, v in e.asdict().items():
-            linter.err('resources.{}: {}'.format(k, v))
+    _validate_items('resources', charm['resources'], ResourceItem, linter,
+                    proof_extensions)
 
 
 def validate_deployment(charm, linter, proof_extensions=None):
@@ -753,18 +895,8 @@ def validate_deployment(charm, linter, proof_extensions=None):
         return
 
     deployment = dict(deployment=deployment)
-    schema = colander.SchemaNode(colander.Mapping())
-    for item in deployment:
-        schema.add(DeploymentItem(name=item))
-
-    try:
-        try:
-            schema.deserialize(deployment)
-        except colander.Invalid as e:
-            _try_proof_extensions(e, proof_extensions)
-    except colander.Invalid as e:
-        for k, v in e.asdict().items():
-            linter.err('deployment.{}: {}'.format(k, v))
+    _validate_items('deployment', deployment, DeploymentItem, linter,
+                    proof_extensions)
 
 
 def validate_extra_bindings(charm, linter):
@@ -844,18 +976,8 @@ def validate_storage(charm, linter, proof_extensions=None):
         linter.err('storage: must be a dictionary of storage definitions')
         return
 
-    schema = colander.SchemaNode(colander.Mapping())
-    for storage_def in charm['storage']:
-        schema.add(StorageItem(name=storage_def))
-
-    try:
-        try:
-            schema.deserialize(charm['storage'])
-        except colander.Invalid as e:
-            _try_proof_extensions(e, proof_extensions)
-    except colander.Invalid as e:
-        for k, v in e.asdict().items():
-            linter.err('storage.{}: {}'.format(k, v))
+    _validate_items('storage', charm['storage'], StorageItem, linter,
+                    proof_extensions)
 
 
 def validate_devices(charm, linter, proof_extensions=None):
@@ -877,18 +999,8 @@ def validate_devices(charm, linter, proof_extensions=None):
         linter.err('devices: must be a dictionary of device definitions')
         return
 
-    schema = colander.SchemaNode(colander.Mapping())
-    for dev in devices:
-        schema.add(DevicesItem(name=dev))
-
-    try:
-        try:
-            schema.deserialize(devices)
-        except colander.Invalid as e:
-            _try_proof_extensions(e, proof_extensions)
-    except colander.Invalid as e:
-        for k, v in e.asdict().items():
-            linter.err('devices.{}: {}'.format(k, v))
+    _validate_items('devices', devices, DevicesItem, linter,
+                    proof_extensions)
 
 
 def validate_payloads(charm, linter, proof_extensions=None):
@@ -910,18 +1022,8 @@ def validate_payloads(charm, linter, proof_extensions=None):
         linter.err('payloads: must be a dictionary of payload definitions')
         return
 
-    schema = colander.SchemaNode(colander.Mapping())
-    for payload_def in charm['payloads']:
-        schema.add(PayloadItem(name=payload_def))
-
-    try:
-        try:
-            schema.deserialize(charm['payloads'])
-        except colander.Invalid as e:
-            _try_proof_extensions(e, proof_extensions)
-    except colander.Invalid as e:
-        for k, v in e.asdict().items():
-            linter.err('payloads.{}: {}'.format(k, v))
+    _validate_items('payloads', charm['payloads'], PayloadItem, linter,
+                    proof_extensions)
 
 
 def validate_actions(actions, action_hooks, linter):
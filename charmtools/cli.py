@@ -1,6 +1,7 @@
 import os
 import sys
 import glob
+import subprocess
 
 
 def parser_defaults(parser):
@@ -16,15 +17,67 @@ def usage(exit_code=0, bundle=False):
     sys.stderr.write(
         'Get help for a charm subcommand\n\n'
         'usage: %s subcommand\n' % os.path.basename(sys.argv[0]))
-    subs = subcommands(os.path.dirname(os.path.realpath(__file__)))
+    subs = sorted(builtin_subcommands())
     sys.stderr.write('\n  Available subcommands are:\n    ')
     sys.stderr.write('\n    '.join(subs))
     sys.stderr.write('\n')
     sys.exit(exit_code)
 
 
+def _console_scripts():
+    # importlib.metadata is imported here rather than at module level as
+    # every subcommand imports this module.
+    try:
+        from importlib.metadata import distribution, PackageNotFoundError
+    except ImportError:
+        import pkg_resources
+        try:
+            dist = pkg_resources.get_distribution('charm-tools')
+        except pkg_resources.DistributionNotFound:
+            return []
+        return list(dist.get_entry_map('console_scripts').values())
+    try:
+        eps = distribution('charm-tools').entry_points
+    except PackageNotFoundError:
+        return []
+    return [ep for ep in eps if ep.group == 'console_scripts']
+
+
+def builtin_subcommands():
+    """
+    Return a mapping of the subcommands provided by charm-tools itself to
+    the ``console_scripts`` entry points implementing them.
+
+    Only the entry points of the charm-tools distribution are read, rather
+    than searching ``PATH`` for ``charm-*`` executables.
+    """
+    return {ep.name[len('charm-'):]: ep for ep in _console_scripts()
+            if ep.name.startswith('charm-')}
+
+
+def run_subcommand(sub, opts):
+    """
+    Run ``charm-<sub>`` with the arguments ``opts`` and return its exit code.
+
+    Built-in subcommands are run in the current process, saving the start
+    up of a new interpreter; anything else is looked for next to the
+    running script, as external plugins are.  Exits with usage if the
+    subcommand can't be found.
+    """
+    builtin = builtin_subcommands().get(sub)
+    if builtin is not None:
+        sys.argv = [builtin.name] + opts
+        return builtin.load()()
+    sub_exec = os.path.join(os.path.dirname(os.path.realpath(sys.argv[0])),
+                            "charm-%s%s" % (sub, ext()))
+    if not os.path.exists(sub_exec):
+        sys.stderr.write('Error: %s is not a valid subcommand\n\n' % sub)
+        usage(2)
+    return subprocess.call([sub_exec] + opts)
+
+
 def subcommands(scripts_dir):
-    subs = []
+    subs = list(builtin_subcommands())
     for path in os.environ['PATH'].split(os.pathsep):
         path = path.strip('"')
         for cmd in glob.glob(os.path.join(path, 'charm-*%s' % ext())):
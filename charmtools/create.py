@@ -26,6 +26,7 @@ import argparse
 from charmtools.generators import (
     CharmGenerator,
     CharmGeneratorException,
+    TemplateMirror,
     get_installed_templates,
 )
 from . import utils
@@ -57,6 +58,12 @@ def setup_parser():
         help='Accept all template configuration defaults without prompting.',
         action='store_true', default=False,
     )
+    parser.add_argument(
+        '--offline',
+        help='Create the charm from the cached copy of the template '
+             'repository, without updating it.',
+        action='store_true', default=False,
+    )
     parser.add_argument(
         '-v', '--verbose',
         help='Print debug information',
@@ -101,6 +108,7 @@ def main():
         raise Exception("No template available for '%s'. Available templates "
                         "may be listed by running 'charm create --help'.")
 
+    TemplateMirror.OFFLINE = args.offline
     generator = CharmGenerator(args)
     try:
         generator.create_charm()
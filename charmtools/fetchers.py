@@ -1,20 +1,31 @@
 import errno
+import hashlib
 import logging
 import os
 import re
 import shlex
 import shutil
+import stat
 import subprocess
 import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
 import yaml
 from path import Path as path
 
+from charmtools import utils, vcs
+
+requests = utils.lazy_import('requests')
 
 log = logging.getLogger(__name__)
 
 REQUEST_TIMEOUT_SECS = 45
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_ATTEMPTS = 3
+DOWNLOAD_PARTS = 4
+PARALLEL_DOWNLOAD_MIN_SIZE = 16 * 1024 * 1024
+ZIP_UNIX_SYSTEM = 3
 
 
 def get(*args, **kw):
@@ -65,33 +76,176 @@ def extract_archive(archive, dir_):
     ``dir_`` and return the full path to the directory containing the
     extracted archive.
 
+    :raises FetchError: if the archive contains a symlink pointing outside
+        of it, or a member which would be extracted through a symlink.
     """
     tempdir = tempfile.mkdtemp(dir=dir_)
     log.debug("Extracting %s to %s", archive, tempdir)
-    # Can't  extract with python due to bug that drops file
-    # permissions: http://bugs.python.org/issue15795
-    # In particular, it's important that executable test files in the
-    # archive remain executable, otherwise the tests won't be run.
-    # Instead we use a shell equivalent of the following:
-    #     archive = zipfile.ZipFile(archive, 'r')
-    #     archive.extractall(tempdir)
-    check_call('unzip {} -d {}'.format(archive, tempdir))
+    try:
+        _extract_zip(archive, tempdir)
+    except BaseException:
+        shutil.rmtree(tempdir)
+        raise
     return tempdir
 
 
-def download_file(url, dir_):
+def _extract_zip(archive, tempdir):
+    # ZipFile.extractall drops file permissions
+    # (http://bugs.python.org/issue15795), but it's important that
+    # executable test files in the archive remain executable, otherwise the
+    # tests won't be run.  So the mode bits (and symlinks) recorded in the
+    # external attributes of each member are applied after extracting it.
+    root = os.path.realpath(tempdir)
+    dir_modes = []
+    with zipfile.ZipFile(archive, 'r') as zf:
+        for info in zf.infolist():
+            # never write through a symlink created by an earlier member
+            parent = tempdir
+            for part in os.path.dirname(info.filename.rstrip('/')).split('/'):
+                parent = os.path.join(parent, part)
+                if os.path.islink(parent):
+                    raise FetchError('Refusing to extract {} from {} through '
+                                     'a symlink'.format(info.filename,
+                                                        archive))
+            extracted = zf.extract(info, tempdir)
+            if info.create_system != ZIP_UNIX_SYSTEM:
+                continue
+            mode = info.external_attr >> 16
+            if stat.S_ISLNK(mode):
+                link_target = zf.read(info).decode('utf8')
+                resolved = os.path.realpath(os.path.join(
+                    os.path.dirname(extracted), link_target))
+                if (os.path.isabs(link_target) or
+                        os.path.commonpath([root, resolved]) != root):
+                    raise FetchError('Refusing to extract {} from {}: it '
+                                     'links outside of the archive'.format(
+                                         info.filename, archive))
+                os.remove(extracted)
+                os.symlink(link_target, extracted)
+            elif info.is_dir():
+                # applied last, in case a directory isn't writable
+                dir_modes.append((extracted, stat.S_IMODE(mode)))
+            elif stat.S_IMODE(mode):
+                os.chmod(extracted, stat.S_IMODE(mode))
+    for extracted, mode in reversed(dir_modes):
+        if mode:
+            os.chmod(extracted, mode)
+
+
+def verify_checksum(filename, checksum):
+    """Verify that the file at ``filename`` matches ``checksum``, which is
+    given as ``<algorithm>:<hexdigest>`` (e.g. ``sha256:...``).
+
+    :raises FetchError: if the checksum doesn't match.
+    """
+    algorithm, _, expected = checksum.partition(':')
+    digest = hashlib.new(algorithm)
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    if digest.hexdigest() != expected.lower():
+        raise FetchError('Checksum mismatch for {}: expected {}, got '
+                         '{}:{}'.format(filename, checksum, algorithm,
+                                        digest.hexdigest()))
+
+
+def _fetch_range(url, filename, start, end=None, response=None):
+    """Write the bytes ``[start, end)`` of ``url`` into the existing file at
+    ``filename``, at the same offset.
+
+    If the transfer is interrupted, it is resumed from where it stopped with
+    an HTTP Range request, up to ``DOWNLOAD_ATTEMPTS`` times.  An ``end`` of
+    ``None`` means the rest of the file.  If ``response`` is given, it is
+    used as the already opened stream for the first attempt.
+    """
+    offset = start
+    for attempt in range(DOWNLOAD_ATTEMPTS):
+        try:
+            if response is None:
+                headers = {}
+                if offset or end is not None:
+                    headers['Range'] = 'bytes={}-{}'.format(
+                        offset, '' if end is None else end - 1)
+                response = get(url, stream=True, headers=headers)
+                response.raise_for_status()
+                if headers and response.status_code != 206:
+                    if start:
+                        raise FetchError('Server does not support ranges '
+                                         'for {}'.format(url))
+                    # server ignored the range; start over
+                    offset = 0
+            with open(filename, 'r+b', buffering=DOWNLOAD_CHUNK_SIZE) as f:
+                f.seek(offset)
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    if end is not None:
+                        chunk = chunk[:end - offset]
+                    f.write(chunk)
+                    offset += len(chunk)
+                    if end is not None and offset >= end:
+                        break
+                if end is None:
+                    f.truncate()
+            response.close()
+            if end is None or offset >= end:
+                return
+            log.debug('Download of %s stopped at %d of %d bytes',
+                      url, offset, end)
+        except requests.exceptions.RequestException as e:
+            if isinstance(e, requests.exceptions.HTTPError):
+                raise FetchError('Unable to download {}: {}'.format(url, e))
+            log.debug('Download of %s interrupted at %d bytes: %s',
+                      url, offset, e)
+        response = None
+    raise FetchError('Unable to download {} after {} attempts'.format(
+        url, DOWNLOAD_ATTEMPTS))
+
+
+def download_file(url, dir_, checksum=None):
     """Download file at ``url`` into directory ``dir_`` and return the full
     path to the downloaded file.
 
+    Interrupted transfers are resumed with HTTP Range requests, and large
+    files are fetched in ``DOWNLOAD_PARTS`` ranges in parallel when the
+    server supports it.  If ``checksum`` (``<algorithm>:<hexdigest>``) is
+    given, the downloaded file is verified against it.  Nothing is left
+    behind in ``dir_`` if the download fails.
+
     """
-    _, filename = tempfile.mkstemp(dir=dir_)
+    fd, filename = tempfile.mkstemp(dir=dir_)
+    os.close(fd)
     log.debug("Downloading %s", url)
-    r = get(url, stream=True)
-    with open(filename, 'wb') as f:
-        for chunk in r.iter_content(chunk_size=1024):
-            if chunk:  # filter out keep-alive new chunks
-                f.write(chunk)
-                f.flush()
+    try:
+        try:
+            response = get(url, stream=True)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            raise FetchError('Unable to download {}: {}'.format(url, e))
+        headers = response.headers
+        size = None
+        if 'Content-Encoding' not in headers:
+            # the length of an encoded body isn't the length of the file
+            size = int(headers.get('Content-Length', 0)) or None
+        if (size and size >= PARALLEL_DOWNLOAD_MIN_SIZE and
+                headers.get('Accept-Ranges') == 'bytes'):
+            with open(filename, 'wb') as f:
+                f.truncate(size)
+            part = -(-size // DOWNLOAD_PARTS)
+            bounds = [(start, min(start + part, size))
+                      for start in range(0, size, part)]
+            with ThreadPoolExecutor(len(bounds)) as pool:
+                futures = [
+                    pool.submit(_fetch_range, url, filename, start, end,
+                                response if start == 0 else None)
+                    for start, end in bounds]
+                for future in futures:
+                    future.result()
+        else:
+            _fetch_range(url, filename, 0, size, response)
+        if checksum:
+            verify_checksum(filename, checksum)
+    except BaseException:
+        os.remove(filename)
+        raise
     return filename
 
 
@@ -108,19 +262,9 @@ class Fetcher(object):
         return match.groupdict() if match else {}
 
     def get_revision(self, dir_):
-        for cmd in ("git rev-parse HEAD",
-                    "bzr revision-info",
-                    "hg log -l 1 --template '{node}\n' -r ."):
-            try:
-                rev_info = check_output(cmd, cwd=dir_)
-                if cmd.startswith('git'):
-                    return rev_info.decode('utf8').strip()
-                if cmd.startswith('bzr'):
-                    return rev_info.decode('utf8').strip().split()[1]
-                if cmd.startswith('hg'):
-                    return rev_info.decode('utf8').strip()
-            except FetchError:
-                continue
+        revision = vcs.get_revision(dir_)
+        if revision:
+            return revision
         rev_file = path(dir_) / '.pull-source-rev'
         if rev_file.exists():
             return rev_file.read_text().strip()
@@ -321,16 +465,32 @@ class CharmstoreDownloader(Fetcher):
     STORE_URL = 'https://api.jujucharms.com/charmstore/v4/{}'
     ARCHIVE_URL = STORE_URL + '/archive'
     REVISION_URL = STORE_URL + '/meta/id-revision'
+    HASH_URL = STORE_URL + '/meta/hash256'
 
     def __init__(self, *args, **kw):
         super(CharmstoreDownloader, self).__init__(*args, **kw)
 
+    def get_checksum(self):
+        """Return the checksum of the archive published by the store, or
+        ``None`` if it isn't available."""
+        try:
+            result = get(self.HASH_URL.format(self.entity))
+            if result.ok:
+                return 'sha256:' + result.json()['Sum']
+        except (requests.exceptions.RequestException, KeyError,
+                ValueError) as e:
+            log.debug('Unable to get archive checksum: %s', e)
+        return None
+
     def fetch(self, dir_):
         url = self.ARCHIVE_URL.format(self.entity)
         self.fetched_url = url
         self.vcs = "charmstore"
-        archive = download_file(url, dir_)
-        entity_dir = extract_archive(archive, dir_)
+        archive = download_file(url, dir_, checksum=self.get_checksum())
+        try:
+            entity_dir = extract_archive(archive, dir_)
+        finally:
+            os.remove(archive)
         return rename(entity_dir)
 
     def get_revision(self, dir_):
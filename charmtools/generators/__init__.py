@@ -18,6 +18,7 @@
 from .generator import CharmGenerator           # noqa
 from .generator import CharmGeneratorException  # noqa
 from .template import CharmTemplate             # noqa
+from .mirror import TemplateMirror              # noqa
 from .prompt import Prompt                      # noqa
 from .prompt import PromptList                  # noqa
 from .utils import get_installed_templates      # noqa
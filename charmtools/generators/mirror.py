@@ -0,0 +1,134 @@
+#!/usr/bin/python
+
+#    Copyright (C) 2014  Canonical Ltd.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+
+from .generator import CharmGeneratorException
+
+log = logging.getLogger(__name__)
+
+
+class TemplateMirror(object):
+    """Local bare mirror of a charm template git repository.
+
+    Charms are created by exporting the tree of the mirror's HEAD with
+    ``git archive``, rather than cloning the template over the network for
+    every new charm.  The mirror is refreshed from the remote when it is
+    older than :attr:`MAX_AGE` seconds, unless :attr:`OFFLINE` is set.
+
+    """
+    OFFLINE = False
+    MAX_AGE = 24 * 60 * 60
+    CACHE_DIR = None
+    STAMP = 'charm-tools-updated'
+
+    def __init__(self, url):
+        self.url = url
+        name = url.rstrip('/').rsplit('/', 1)[-1]
+        if name.endswith('.git'):
+            name = name[:-len('.git')]
+        digest = hashlib.sha256(url.encode('utf-8')).hexdigest()[:12]
+        self.path = os.path.join(self.cache_dir(),
+                                 '{}-{}.git'.format(name, digest))
+
+    @classmethod
+    def cache_dir(cls):
+        cache_dir = (cls.CACHE_DIR or os.environ.get('CHARM_CACHE_DIR') or
+                     os.path.expanduser('~/.cache/charm'))
+        return os.path.join(cache_dir, 'templates')
+
+    def age(self):
+        """Return the seconds since the mirror was last updated, or None if
+        there is no mirror yet.
+
+        """
+        try:
+            return time.time() - os.stat(
+                os.path.join(self.path, self.STAMP)).st_mtime
+        except OSError:
+            return None
+
+    def _touch(self, git_dir):
+        with open(os.path.join(git_dir, self.STAMP), 'w'):
+            pass
+
+    def update(self):
+        """Create or refresh the mirror as needed, and return its path."""
+        age = self.age()
+        if age is None:
+            if self.OFFLINE:
+                raise CharmGeneratorException(
+                    'No cached copy of {} is available offline'.format(
+                        self.url))
+            self._clone()
+        elif age > self.MAX_AGE and not self.OFFLINE:
+            log.debug('Updating template mirror %s', self.path)
+            try:
+                subprocess.check_call(
+                    ['git', '--git-dir', self.path, 'fetch', '--quiet',
+                     '--prune', 'origin'])
+            except subprocess.CalledProcessError as e:
+                log.warning('Unable to update %s, using the cached copy: %s',
+                            self.url, e)
+            else:
+                self._touch(self.path)
+        return self.path
+
+    def _clone(self):
+        log.debug('Mirroring %s to %s', self.url, self.path)
+        parent = os.path.dirname(self.path)
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent)
+        try:
+            subprocess.check_call(
+                ['git', 'clone', '--quiet', '--mirror', self.url, tmp])
+            self._touch(tmp)
+            try:
+                os.rename(tmp, self.path)
+            except OSError:
+                # another process created the mirror first
+                if self.age() is None:
+                    raise
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp)
+
+    def export(self, output_dir):
+        """Write the files of the template to ``output_dir``."""
+        self.update()
+        os.makedirs(output_dir, exist_ok=True)
+        proc = subprocess.Popen(
+            ['git', '--git-dir', self.path, 'archive', '--format=tar',
+             'HEAD'], stdout=subprocess.PIPE)
+        try:
+            with tarfile.open(fileobj=proc.stdout, mode='r|') as archive:
+                if hasattr(tarfile, 'data_filter'):
+                    archive.extractall(output_dir, filter='data')
+                else:
+                    archive.extractall(output_dir)
+        finally:
+            proc.stdout.close()
+            if proc.wait():
+                raise subprocess.CalledProcessError(proc.returncode,
+                                                    'git archive')
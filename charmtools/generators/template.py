@@ -15,18 +15,57 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from concurrent.futures import ThreadPoolExecutor
 from fnmatch import fnmatch
+import hashlib
 import inspect
 import os
+import tempfile
+import threading
 import yaml
 
 from .prompt import PromptList
 
+# compiled Cheetah template classes, by sha256 of the template source
+_compiled_templates = {}
+_compile_lock = threading.Lock()
+
+
+def compiled_template(source):
+    """Return the compiled Cheetah template class for ``source``.
+
+    Classes are cached by the hash of the source, so rendering the same
+    template again (e.g. when creating many charms) doesn't recompile it.
+
+    """
+    from Cheetah.Template import Template
+
+    key = hashlib.sha256(source.encode('utf-8')).hexdigest()
+    with _compile_lock:
+        if key not in _compiled_templates:
+            _compiled_templates[key] = Template.compile(source=source)
+        return _compiled_templates[key]
+
+
+def write_atomic(filename, content, mode):
+    """Replace ``filename`` with ``content`` using a single rename."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.chmod(tmp, mode)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
 
 class CharmTemplate(object):
     """Base plugin for creating a new charm."""
 
     skip_parsing = ['README.ex', '*.pyc']
+    # most files rendered at once by render_files
+    render_workers = 8
 
     def skip_template(self, filename):
         """Return True if file should not be processed for template
@@ -81,6 +120,36 @@ class CharmTemplate(object):
         """
         raise NotImplementedError
 
+    def render_files(self, config, output_dir):
+        """Render every file under ``output_dir`` as a template, in place.
+
+        Symlinks and files matching :attr:`skip_parsing` are left alone.
+        The files are rendered on a thread pool.
+
+        """
+        outfiles = []
+        for root, dirs, files in os.walk(output_dir):
+            for outfile in files:
+                if self.skip_template(outfile):
+                    continue
+                outfiles.append(os.path.join(root, outfile))
+
+        with ThreadPoolExecutor(self.render_workers) as pool:
+            # consume the results to re-raise any rendering errors
+            list(pool.map(lambda f: self._template_file(config, f),
+                          outfiles))
+
+    def _template_file(self, config, outfile):
+        """Render ``outfile`` as a template with ``config``, in place."""
+        if os.path.islink(outfile):
+            return
+
+        mode = os.stat(outfile).st_mode
+        with open(outfile, 'r', encoding='utf-8') as f:
+            source = f.read()
+        t = compiled_template(source)(searchList=[config])
+        write_atomic(outfile, str(t).encode('utf-8'), mode)
+
     def configure_prompt(self, prompt, config):
         """Reconfigure a prompt based on already-gathered config options
 
@@ -18,20 +18,46 @@
 from __future__ import absolute_import
 
 import os
+import re
 import sys
+import json
+import hashlib
+import logging
 import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 from charmtools.bundles import Bundle
 from charmtools.charms import Charm
 from charmtools.cli import parser_defaults
+from charmtools.version import cached_charm_tools_version
 from charmtools import utils
 
+log = logging.getLogger(__name__)
+
+# VCS metadata is never looked at by proof, so is left out of the digest.
+DIGEST_SKIP_DIRS = ('.git', '.bzr', '.hg')
+
 
 def get_args(args=None):
     parser = argparse.ArgumentParser(
         description='perform static analysis on a charm or bundle')
-    parser.add_argument('charm_name', nargs='?', default=os.getcwd(),
-                        help='path of charm dir to check. Defaults to PWD')
+    parser.add_argument('charm_name', nargs='*', default=[os.getcwd()],
+                        help='paths of charm or bundle dirs to check, or of '
+                             'directories to search for charms and bundles. '
+                             'Defaults to PWD')
+    parser.add_argument('--format', choices=['text', 'json', 'report'],
+                        default='text',
+                        help='Output format. json emits one JSON object per '
+                             'line, with the path, level, message and exit '
+                             'code of each result; report emits a single '
+                             'JSON document covering every target')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='Number of charms and bundles to proof '
+                             'concurrently. Defaults to the number of CPUs')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Always proof, rather than reusing the results '
+                             'cached for unchanged charms and bundles')
     utils.add_plugin_description(parser)
     parser = parser_defaults(parser)
     args = parser.parse_args(args)
@@ -39,7 +65,103 @@ def get_args(args=None):
     return args
 
 
-def proof(path, is_bundle, debug):
+def default_cache_dir():
+    """Return the directory proof results are cached in by default."""
+    cache_dir = (os.environ.get('CHARM_CACHE_DIR') or
+                 os.path.expanduser('~/.cache/charm'))
+    return os.path.join(cache_dir, 'proof')
+
+
+def content_digest(path):
+    """
+    Return a sha256 digest of the content of the charm or bundle at ``path``.
+
+    Files listed in ``.build.manifest`` which haven't been changed since it
+    was written are represented by the sha256 recorded there rather than
+    being read again, so a freshly built charm can be digested with little
+    more than a walk of its tree.  Other files are hashed.  The executable
+    bits of every file, and the directories (even empty ones), are included
+    as proof checks them.
+    """
+    signatures = {}
+    built = None
+    manifest = os.path.join(path, '.build.manifest')
+    try:
+        with open(manifest) as f:
+            signatures = json.load(f)['signatures']
+        built = os.stat(manifest).st_mtime_ns
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d not in DIGEST_SKIP_DIRS)
+        for name in dirs:
+            digest.update('{}/\n'.format(os.path.relpath(
+                os.path.join(root, name), path)).encode('utf8'))
+        for name in sorted(files):
+            filename = os.path.join(root, name)
+            relpath = os.path.relpath(filename, path)
+            try:
+                st = os.stat(filename)
+                mode = st.st_mode
+                sig = signatures.get(relpath)
+                # the ctime catches edits which preserve the mtime
+                if (isinstance(sig, list) and len(sig) == 3 and
+                        sig[2] != 'unchecked' and
+                        max(st.st_mtime_ns, st.st_ctime_ns) < built):
+                    sha = sig[2]
+                else:
+                    sha = utils.sign(filename)
+            except OSError:
+                mode, sha = 0, None
+            digest.update('{}\0{:o}\0{}\n'.format(
+                relpath, mode & 0o111, sha).encode('utf8'))
+    return digest.hexdigest()
+
+
+def _cache_key(path, is_bundle, debug):
+    version = cached_charm_tools_version()
+    if version.get('version') == 'unavailable':
+        # results from an unknown version of the linter can't be reused
+        return None
+    # proof compares the metadata name with the name of the directory
+    name = os.path.basename(os.path.abspath(path))
+    return hashlib.sha256(json.dumps([
+        content_digest(path), name, bool(is_bundle), bool(debug), version,
+    ], sort_keys=True).encode('utf8')).hexdigest()
+
+
+def _read_cache(cache_file):
+    try:
+        with open(cache_file) as f:
+            result = json.load(f)
+        return result['lint'], result['exit_code']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _write_cache(cache_file, lint, exit_code):
+    cache_dir = os.path.dirname(cache_file)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'lint': lint, 'exit_code': exit_code}, f)
+        os.replace(tmp, cache_file)
+    except OSError as e:
+        log.debug('Unable to cache proof results in %s: %s', cache_dir, e)
+
+
+def proof(path, is_bundle, debug, cache_dir=None):
+    """
+    Proof the charm or bundle at ``path``.
+
+    If ``cache_dir`` is given, the results are cached there, keyed by the
+    content of the charm or bundle and the charm-tools version, and reused
+    for unchanged content.
+
+    :returns: Tuple of the list of lint messages and the exit code.
+    """
     messages = []
     exit_code = 0
     path = os.path.abspath(path)
@@ -47,6 +169,14 @@ def proof(path, is_bundle, debug):
         messages.append('Unable to read from {}'.format(path))
         exit_code = 200
         return messages, exit_code
+    cache_file = None
+    if cache_dir:
+        key = _cache_key(path, is_bundle, debug)
+        if key:
+            cache_file = os.path.join(cache_dir, key + '.json')
+            cached = _read_cache(cache_file)
+            if cached is not None:
+                return cached
     if not is_bundle:
         try:
             c = Charm(path)
@@ -60,17 +190,132 @@ def proof(path, is_bundle, debug):
         try:
             c = Bundle(path, debug)
         except Exception as e:
-            return ["FATAL: %s" % e.message], 200
+            return ["FATAL: %s" % e], 200
 
     lint, err_code = c.proof()
+    if cache_file:
+        _write_cache(cache_file, lint, err_code)
     return lint, err_code
 
 
+TARGET_FILES = ('metadata.yaml', 'bundle.yaml')
+LEVELS = {'E': 'error', 'W': 'warning', 'I': 'info'}
+LINT_RE = re.compile(r'^([EWI]): (.*)$', re.DOTALL)
+
+
+def find_targets(path):
+    """
+    Return the charms and bundles to proof for ``path``.
+
+    That is ``path`` itself if it is a charm or bundle (or isn't a directory),
+    otherwise every charm and bundle found beneath it.  The search doesn't
+    descend into the charms and bundles it finds, nor into hidden
+    directories.
+    """
+    path = os.path.abspath(path)
+    if not os.path.isdir(path) or any(
+            os.path.isfile(os.path.join(path, f)) for f in TARGET_FILES):
+        return [path]
+    targets = []
+    for root, dirs, files in os.walk(path):
+        if any(f in files for f in TARGET_FILES):
+            targets.append(root)
+            dirs[:] = []
+        else:
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+    return targets or [path]
+
+
+def _proof_target(target):
+    path, is_bundle, debug, cache_dir = target
+    lint, exit_code = proof(path, is_bundle, debug, cache_dir)
+    return path, lint, exit_code
+
+
+def proof_all(paths, is_bundle, debug, jobs=None, cache_dir=None):
+    """
+    Proof every charm and bundle in ``paths``, searching directories which
+    aren't themselves a charm or bundle.
+
+    Targets are proofed concurrently in a pool of ``jobs`` processes, using
+    the results cached in ``cache_dir``, if given.
+
+    :returns: Generator of ``(path, lint, exit_code)`` tuples, in the order
+        of ``paths``, yielded as soon as each result is available.
+    """
+    targets = [(target, is_bundle, debug, cache_dir)
+               for path in paths for target in find_targets(path)]
+    if len(targets) < 2 or jobs == 1:
+        for target in targets:
+            yield _proof_target(target)
+        return
+    with ProcessPoolExecutor(jobs) as pool:
+        for result in pool.map(_proof_target, targets):
+            yield result
+
+
+def lint_records(path, lint, exit_code):
+    """
+    Return the results of proofing ``path`` as a list of dicts with the
+    path, level, message and exit code of each lint message.  A target
+    without messages gets a single record with no level or message.
+    """
+    records = []
+    for line in lint:
+        match = LINT_RE.match(line)
+        if match:
+            level, message = LEVELS[match.group(1)], match.group(2)
+        else:
+            level, message = 'error', line
+        records.append({'path': path, 'level': level, 'message': message,
+                        'exit_code': exit_code})
+    return records or [{'path': path, 'level': None, 'message': None,
+                        'exit_code': exit_code}]
+
+
+def build_report(results):
+    """
+    Combine the results of :func:`proof_all` into a single report: a dict
+    with the overall exit code, a count of messages per level and, for each
+    target, its path, exit code and messages.
+    """
+    report = {'exit_code': 0, 'summary': {}, 'targets': []}
+    for path, lint, exit_code in results:
+        report['exit_code'] = max(report['exit_code'], exit_code)
+        messages = []
+        for record in lint_records(path, lint, exit_code):
+            if record['level'] is None:
+                continue
+            summary = report['summary']
+            summary[record['level']] = summary.get(record['level'], 0) + 1
+            messages.append({'level': record['level'],
+                             'message': record['message']})
+        report['targets'].append({'path': path, 'exit_code': exit_code,
+                                  'messages': messages})
+    return report
+
+
 def main():
     args_ = get_args()
-    lint, exit_code = proof(args_.charm_name, args_.bundle, args_.debug)
-    if lint:
-        print("\n".join(lint))
+    exit_code = 0
+    cache_dir = None if args_.no_cache else default_cache_dir()
+    results = proof_all(args_.charm_name, args_.bundle, args_.debug,
+                        args_.jobs, cache_dir)
+    if args_.format == 'report':
+        report = build_report(results)
+        print(json.dumps(report, indent=2, sort_keys=True))
+        sys.exit(report['exit_code'])
+    for path, lint, code in results:
+        exit_code = max(exit_code, code)
+        if args_.format == 'json':
+            for record in lint_records(path, lint, code):
+                print(json.dumps(record))
+        elif lint:
+            if len(args_.charm_name) > 1 or path != os.path.abspath(
+                    args_.charm_name[0]):
+                lint = ['{}: {}'.format(path, line) for line in lint]
+            print("\n".join(lint))
+        sys.stdout.flush()
     sys.exit(exit_code)
 
 
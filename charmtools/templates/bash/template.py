@@ -19,13 +19,7 @@
 import logging
 import os
 import os.path as path
-import time
 import shutil
-import sys
-import tempfile
-
-from Cheetah.Template import Template
-from stat import ST_MODE
 
 from charmtools.generators import CharmTemplate
 
@@ -38,12 +32,7 @@ class BashCharmTemplate(CharmTemplate):
     def create_charm(self, config, output_dir):
         self._copy_files(output_dir)
 
-        for root, dirs, files in os.walk(output_dir):
-            for outfile in files:
-                if self.skip_template(outfile):
-                    continue
-
-                self._template_file(config, path.join(root, outfile))
+        self.render_files(config, output_dir)
 
     def _copy_files(self, output_dir):
         here = path.abspath(path.dirname(__file__))
@@ -51,22 +40,3 @@ class BashCharmTemplate(CharmTemplate):
         if os.path.exists(output_dir):
             shutil.rmtree(output_dir)
         shutil.copytree(template_dir, output_dir)
-
-    def _template_file(self, config, outfile):
-        if path.islink(outfile):
-            return
-
-        mode = os.stat(outfile)[ST_MODE]
-        t = Template(file=outfile, searchList=(config))
-        o = tempfile.NamedTemporaryFile(
-            dir=path.dirname(outfile), delete=False)
-        os.chmod(o.name, mode)
-        st = str(t)
-        if sys.version_info >= (3, ):
-            st = st.encode('UTF-8')
-        o.write(st)
-        o.close()
-        backupname = outfile + str(time.time())
-        os.rename(outfile, backupname)
-        os.rename(o.name, outfile)
-        os.unlink(backupname)
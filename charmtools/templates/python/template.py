@@ -18,14 +18,8 @@
 import logging
 import os
 import os.path as path
-import time
-import sys
 import shutil
 import subprocess
-import tempfile
-
-from Cheetah.Template import Template
-from stat import ST_MODE
 
 from charmtools.generators import (
     CharmTemplate,
@@ -40,12 +34,7 @@ class PythonCharmTemplate(CharmTemplate):
     def create_charm(self, config, output_dir):
         self._copy_files(output_dir)
 
-        for root, dirs, files in os.walk(output_dir):
-            for outfile in files:
-                if self.skip_template(outfile):
-                    continue
-
-                self._template_file(config, path.join(root, outfile))
+        self.render_files(config, output_dir)
 
         self._install_charmhelpers(output_dir)
 
@@ -56,25 +45,6 @@ class PythonCharmTemplate(CharmTemplate):
             shutil.rmtree(output_dir)
         shutil.copytree(template_dir, output_dir)
 
-    def _template_file(self, config, outfile):
-        if path.islink(outfile):
-            return
-
-        mode = os.stat(outfile)[ST_MODE]
-        t = Template(file=outfile, searchList=(config))
-        o = tempfile.NamedTemporaryFile(
-            dir=path.dirname(outfile), delete=False)
-        os.chmod(o.name, mode)
-        st = str(t)
-        if sys.version_info >= (3, ):
-            st = st.encode('UTF-8')
-        o.write(st)
-        o.close()
-        backupname = outfile + str(time.time())
-        os.rename(outfile, backupname)
-        os.rename(o.name, outfile)
-        os.unlink(backupname)
-
     def _install_charmhelpers(self, output_dir):
         helpers_dest = os.path.join(output_dir, 'lib', 'charmhelpers')
         if not os.path.exists(helpers_dest):
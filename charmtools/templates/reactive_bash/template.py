@@ -18,17 +18,11 @@
 import logging
 import os
 import os.path as path
-import time
-import sys
 import shutil
-import subprocess
-import tempfile
-
-from Cheetah.Template import Template
-from stat import ST_MODE
 
 from charmtools.generators import (
     CharmTemplate,
+    TemplateMirror,
 )
 
 log = logging.getLogger(__name__)
@@ -46,44 +40,16 @@ class ReactiveBashCharmTemplate(CharmTemplate):
     def create_charm(self, config, output_dir):
         self._clone_template(config, output_dir)
 
-        for root, dirs, files in os.walk(output_dir):
-            for outfile in files:
-                if self.skip_template(outfile):
-                    continue
-
-                self._template_file(config, path.join(root, outfile))
-
-    def _template_file(self, config, outfile):
-        if path.islink(outfile):
-            return
-
-        mode = os.stat(outfile)[ST_MODE]
-        t = Template(file=outfile, searchList=(config))
-        o = tempfile.NamedTemporaryFile(
-            dir=path.dirname(outfile), delete=False)
-        os.chmod(o.name, mode)
-        st = str(t)
-        if sys.version_info >= (3, ):
-            st = st.encode('UTF-8')
-        o.write(st)
-        o.close()
-        backupname = outfile + str(time.time())
-        os.rename(outfile, backupname)
-        os.rename(o.name, outfile)
-        os.unlink(backupname)
+        self.render_files(config, output_dir)
 
     def _clone_template(self, config, output_dir):
-        cmd = "git clone {} {}".format(
-            self._TEMPLATE_URL, output_dir
-        )
-
         try:
-            subprocess.check_call(cmd.split())
+            TemplateMirror(self._TEMPLATE_URL).export(output_dir)
         except OSError as e:
             raise Exception(
                 "The below error has occurred whilst attempting to clone"
                 "the charm template. Please make sure you have git"
-                "installed on your system.\n" + e
+                "installed on your system.\n" + str(e)
             )
 
         # iterate and remove all the unwanted files from the git repo:
@@ -5,18 +5,25 @@ from __future__ import print_function
 
 import argparse
 import glob
+import json
 import logging
 import os
 import re
-import signal
+import shutil
 import six
 import subprocess
 import sys
+import tempfile
+import threading
 import time
 import yaml
 from datetime import timedelta
 from collections import OrderedDict
-from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from six.moves import queue
+from xml.etree import ElementTree
+
+from charmtools import utils
 
 TEST_PASS = '✔'
 TEST_FAIL = '✘'
@@ -25,6 +32,8 @@ TEST_TIMEOUT = '⌛'
 TEST_STATUS = {'pass': TEST_PASS, 'fail': TEST_FAIL, 'skip': TEST_SKIP,
                'timeout': TEST_TIMEOUT}
 TEST_RESERVED_EXITS = {0: 'pass', 100: 'skip', 124: 'timeout'}
+# states of the bootstrap node from which it will never start
+BOOTSTRAP_ERROR_STATES = {'error', 'start-error', 'provisioning-error'}
 
 LOG_LEVELS = [logging.INFO, logging.DEBUG]
 TEST_RESULT_LEVELV_NUM = 51
@@ -52,11 +61,6 @@ class SubstrateMismatch(Exception):
     pass
 
 
-class TimeoutError(Exception):
-    def __init__(self, value="Timed Out"):
-        self.value = value
-
-
 class TestingError(Exception):
     pass
 
@@ -66,6 +70,10 @@ class OrchestraError(Exception):
 
 
 class Conductor(object):
+    # backoff between probes of the bootstrap node, in seconds
+    POLL_INTERVAL = 1
+    POLL_MAX_INTERVAL = 15
+
     def __init__(self, arguments=None):
         self.args = arguments
         # Default home to what juju defaults to, can be overridden with "-p"
@@ -81,9 +89,13 @@ class Conductor(object):
         self.tests_requested = self.args.tests
         self.juju_version = None
         self.juju_env = self.args.juju_env
+        self.env_pool = self.args.env_pool or [self.juju_env]
         self.errors = 0
         self.fails = 0
         self.passes = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.results = []
 
         if self.tests_requested:
             self.tests_requested = [os.path.basename(t) for t in
@@ -91,46 +103,116 @@ class Conductor(object):
 
         if not self.tests:
             raise NoTests()
+        self.sinks = result_sinks(self.args)
 
     def run(self):
+        """
+        Run the requested tests, concurrently across the environments of the
+        pool with one test per environment at a time, and return the
+        aggregated ``(errors, fails, passes)`` counts.
+        """
         self.juju_version = get_juju_version()
-        requested_tests = self.tests
         if self.tests_requested:
-            for test in self.tests:
-                if test not in self.tests_requested:
-                    del self.tests[test]
+            self.tests = OrderedDict(
+                (name, test) for name, test in self.tests.items()
+                if name in self.tests_requested)
+
+        pending = queue.Queue()
+        for test in self.tests.values():
+            pending.put(test)
+
+        self._stopped.clear()
+        try:
+            with ThreadPoolExecutor(len(self.env_pool)) as pool:
+                workers = [pool.submit(self.run_worker, juju_env, pending)
+                           for juju_env in self.env_pool]
+            for worker in workers:
+                # re-raise anything unexpected from the workers
+                worker.result()
+        finally:
+            for sink in self.sinks:
+                sink.close()
+
+        return self.errors, self.fails, self.passes
 
-        for test in requested_tests.values():
+    def count(self, result):
+        with self._lock:
+            setattr(self, result, getattr(self, result) + 1)
+
+    def report(self, result):
+        """Record the result of a test and pass it on to the sinks."""
+        with self._lock:
+            self.results.append(result)
+            for sink in self.sinks:
+                sink.add(result)
+
+    def run_worker(self, juju_env, pending):
+        """
+        Run tests from the ``pending`` queue in ``juju_env`` until it is
+        empty.
+
+        The environment is bootstrapped before a test and destroyed after it,
+        unless ``--reuse-environments`` was given and the test passed, in
+        which case the next test runs in the same environment.
+        """
+        bootstrapped = False
+        while not self._stopped.is_set():
             try:
-                self.bootstrap(self.juju_env, self.args.setup_timeout)
-            except Exception as e:
-                self.log.warn('Could not bootstrap %s, got %s. Skipping' %
-                              (self.juju_env, e))
-                self.errors += 1
-                continue
+                test = pending.get_nowait()
+            except queue.Empty:
+                break
 
+            t = Orchestra(self, test, juju_env)
+            if not bootstrapped:
+                start = time.time()
+                try:
+                    self.bootstrap(juju_env, self.args.setup_timeout)
+                except Exception as e:
+                    self.log.warn('Could not bootstrap %s, got %s. Skipping' %
+                                  (juju_env, e))
+                    self.count('errors')
+                    t.result.bootstrap_time = time.time() - start
+                    t.result.status = 'error'
+                    t.result.message = str(e)
+                    self.report(t.result)
+                    continue
+                t.result.bootstrap_time = time.time() - start
+                bootstrapped = True
+
+            passed = False
             try:
-                t = Orchestra(self, test)
                 t.perform()
             except Exception:
-                self.fails += 1
+                self.count('fails')
                 if self.args.set_e:
                     self.log.info('Breaking here as requested by --set-e')
-                    return self.errors, self.fails, self.passes
+                    self._stopped.set()
+                    self.report(t.result)
+                    return
             else:
-                self.passes += 1
+                self.count('passes')
+                passed = True
 
-            try:
-                self.destroy(self.juju_env)
-            except DestroyUnreliable:
-                self.log.warn('Unable to destroy bootstrap, trying again')
-                time.sleep(2)
-                try:
-                    self.destroy(self.juju_env)
-                except Exception:
-                    continue
+            if not (passed and self.args.reuse_environments):
+                start = time.time()
+                self.teardown(juju_env)
+                t.result.teardown_time = time.time() - start
+                bootstrapped = False
+            self.report(t.result)
 
-        return self.errors, self.fails, self.passes
+        if bootstrapped:
+            self.teardown(juju_env)
+
+    def teardown(self, juju_env):
+        try:
+            self.destroy(juju_env)
+        except DestroyUnreliable:
+            self.log.warn('Unable to destroy bootstrap, trying again')
+            time.sleep(2)
+            try:
+                self.destroy(juju_env)
+            except Exception:
+                pass
 
     def find_tests(self):
         tests_dir = glob.glob(os.path.join('tests', '*'))
@@ -181,21 +263,29 @@ class Conductor(object):
         cmd.extend(['-e', juju_env])
 
         self.log.debug('Running the following: %s' % ' '.join(cmd))
+        # bootstraps run on the worker threads, where SIGALRM can't be used,
+        # so the command and the wait for the node share a single deadline
+        deadline = time.monotonic() + wait_for
         try:
-            subprocess.check_call(cmd, env=self.env)
+            subprocess.check_call(cmd, env=self.env, timeout=wait_for or None)
+            self.log.debug('Waiting for bootstrap')
+            if wait_for:
+                # poll() still probes once if the deadline has already passed
+                remaining = max(deadline - time.monotonic(), 0.001)
+            else:
+                remaining = 0
+            self.wait_for_bootstrap(juju_env, remaining)
         except subprocess.CalledProcessError:
             raise BootstrapError('Bootstrap returned with an exit > 0')
-
-        self.log.debug('Waiting for bootstrap')
-        try:
-            with timeout(wait_for):
-                self.wait_for_bootstrap(juju_env)
-        except TimeoutError:
+        except (subprocess.TimeoutExpired, utils.PollTimeout,
+                BootstrapError) as e:
             try:
-                self.destroy(self.juju_env)
+                self.destroy(juju_env)
             except Exception:
                 pass
 
+            if isinstance(e, BootstrapError):
+                raise
             raise BootstrapUnreliable('Bootstrap timeout after %ss' % wait_for)
 
     def destroy(self, juju_env):
@@ -224,8 +314,20 @@ class Conductor(object):
             except subprocess.CalledProcessError:
                 raise DestroyUnreliable('Unable to destroy %s' % juju_env)
 
-    def status(self, juju_env):
+    def status(self, juju_env, *scope, **kwargs):
+        """
+        Return the parsed ``juju status`` of ``juju_env``, limited to the
+        machines or services in ``scope`` if given, or ``None`` if it can't
+        be queried.
+
+        :param format: Output format to request, ``json`` being much cheaper
+            to parse than the default YAML.
+        """
+        fmt = kwargs.get('format')
         cmd = ['juju', 'status', '-e', juju_env]
+        if fmt:
+            cmd.extend(['--format', fmt])
+        cmd.extend(scope)
         self.log.debug('Running the following: %s' % ' '.join(cmd))
         try:
             output = subprocess.check_output(cmd, env=self.env)
@@ -233,29 +335,44 @@ class Conductor(object):
             self.log.debug('Status command failed, returning nothing')
             return None
 
+        if fmt == 'json':
+            return json.loads(six.ensure_str(output))
         return yaml.safe_load(output)
 
-    def wait_for_bootstrap(self, juju_env):
-        bootstrapped = False
-        while not bootstrapped:
-            self.log.debug('Still not bootstrapped')
-            time.sleep(5)
-            status = self.status(juju_env)
-            if not status:
-                continue
-
-            if self.juju_version.major > 0:
-                self.log.debug('State for %s: %s' %
-                               (self.juju_version,
-                                status['machines']['0']['agent-state']))
-                if status['machines']['0']['agent-state'] == 'started':
-                    bootstrapped = True
-            else:
-                self.log.debug('State for %s: %s' %
-                               (self.juju_version,
-                                status['machines'][0]['agent-state']))
-                if status['machines'][0]['agent-state'] == 'running':
-                    bootstrapped = True
+    def bootstrap_state(self, juju_env):
+        """
+        Return the agent state of the bootstrap node, and any information
+        about it, or ``(None, None)`` if it can't be determined yet.
+        """
+        status = self.status(juju_env, '0', format='json')
+        if not status:
+            return None, None
+        machines = status.get('machines') or {}
+        # the machine ids are strings in JSON and in juju >= 1 YAML
+        machine = machines.get('0', machines.get(0)) or {}
+        return machine.get('agent-state'), machine.get('agent-state-info')
+
+    def wait_for_bootstrap(self, juju_env, wait_for=0):
+        """
+        Poll the bootstrap node of ``juju_env``, with backoff, until it has
+        started.
+
+        :raises BootstrapError: if the node fails to start.
+        :raises charmtools.utils.PollTimeout: if the node hasn't started
+            after ``wait_for`` seconds.
+        """
+        started = 'started' if self.juju_version.major > 0 else 'running'
+
+        def probe():
+            state, info = self.bootstrap_state(juju_env)
+            self.log.debug('State for %s: %s' % (self.juju_version, state))
+            if state in BOOTSTRAP_ERROR_STATES:
+                raise BootstrapError('Bootstrap node is in state %s: %s' %
+                                     (state, info))
+            return state == started
+
+        utils.poll(probe, timeout=wait_for, interval=self.POLL_INTERVAL,
+                   max_interval=self.POLL_MAX_INTERVAL)
 
     def load_environments_yaml(self, juju_home='~/.juju'):
         env_yaml_file = os.path.join(os.path.expanduser(juju_home),
@@ -267,44 +384,65 @@ class Conductor(object):
 
 
 class Orchestra(object):
-    def __init__(self, conductor, arrangement):
+    # log transfers: the most machines copied from at once, and the seconds
+    # after which a single transfer is abandoned
+    ARCHIVE_WORKERS = 8
+    ARCHIVE_TIMEOUT = 300
+
+    def __init__(self, conductor, arrangement, juju_env=None):
         self.conductor = conductor
         self.test = arrangement
         self.name = os.path.basename(self.test)
         self.safe_name = self.conductor.safe_test_name(self.name)
         self.log = logging.getLogger('juju-test.conductor.%s' % self.safe_name)
-        self.archive = self.conductor.args.logdir
-        self.env = self.conductor.env
+        # each test's logs are archived to their own directory, so they
+        # aren't overwritten by those of the next test
+        self.archive = None
+        if self.conductor.args.logdir:
+            self.archive = os.path.join(self.conductor.args.logdir,
+                                        self.safe_name)
+        self.juju_env = juju_env or self.conductor.juju_env
+        # each test gets its own copy, as tests run concurrently
+        self.env = dict(self.conductor.env)
+        self.result = TestResult(self.name, self.juju_env)
 
     def perform(self):
         self.build_env()
         error = None
         self.log.debug('Running %s (%s)' % (self.name, self.test))
+        start = time.time()
         try:
-            with timeout(self.conductor.args.timeout):
-                output = subprocess.check_output(self.test, env=self.env)
-                self.log.debug(output)
-        except TimeoutError as e:
+            output = subprocess.check_output(
+                self.test, env=self.env, timeout=self.conductor.args.timeout)
+            self.log.debug(output)
+        except subprocess.TimeoutExpired as e:
             self.log.debug('Killed by timeout after %s seconds',
                            self.conductor.args.timeout)
-            self.print_status(124)
+            exit_code = 124
             error = e if not self.is_passing_code(124) else e
         except subprocess.CalledProcessError as e:
             self.log.debug(e.output)
             self.log.debug('Got exit code: %s', e.returncode)
-            self.print_status(e.returncode)
+            exit_code = e.returncode
             error = TestingError(e.returncode) if not \
                 self.is_passing_code(e.returncode) else e
         except Exception as e:
             self.log.debug('Encountered unexpected error %s', e)
-            self.print_status(9001)
+            exit_code = 9001
             error = e
         else:
-            self.print_status(0)
+            exit_code = 0
+        self.result.duration = time.time() - start
+        self.result.exit_code = exit_code
+        self.result.status = self.determine_status(exit_code)
+        if error:
+            self.result.message = str(error)
+        self.print_status(exit_code)
 
-        if self.conductor.args.logdir:
+        if self.archive:
             try:
                 self.archive_logs()
+                self.result.logdir = self.archive
             except OrchestraError as e:
                 self.log.error(e)
 
@@ -312,33 +450,88 @@ class Orchestra(object):
             raise error
 
     def archive_logs(self):
+        """
+        Copy the juju logs of every machine of the deployment to the log
+        directory of the test.
+
+        The status is queried once, each log is copied from a machine only
+        once however many of its services it is archived for, and the
+        machines are copied from in parallel on a bounded pool, each
+        transfer with its own timeout.
+        """
         logs = ['/var/./log/juju/*']
         status = self.conductor.status(self.env["JUJU_ENV"])
-        logdir = self.conductor.args.logdir
+        logdir = self.archive
         if not status:
             # Something is wrong, we need to throw up an archive error
             raise OrchestraError('Unable to query juju status')
 
         services = status['services']
-        # machines = status['machines']
+        addresses = machine_addresses(status)
 
         if self.conductor.juju_version.major == 0:
             logs.append('/var/lib/juju/units/./*/charm.log')
 
-        try:
-            self.rsync(0, logs[0], os.path.join(logdir, 'bootstrap', ''))
-        except Exception:
-            self.log.warn('Failed to fetch logs for bootstrap node')
+        # machine -> log -> dest -> units the copy is for, with None
+        # standing for the bootstrap node
+        transfers = OrderedDict()
+
+        def add(machine, log, dest, unit):
+            _, machine_transfers = transfers.setdefault(
+                str(machine), (machine, OrderedDict()))
+            dests = machine_transfers.setdefault(log, OrderedDict())
+            dests.setdefault(dest, []).append(unit)
 
+        add(0, logs[0], os.path.join(logdir, 'bootstrap', ''), None)
         for service in services:
             for unit in services[service]['units']:
                 machine = services[service]['units'][unit]['machine']
                 for log in logs:
-                    try:
-                        self.rsync(machine, log, os.path.join(logdir, service,
-                                                              ''))
-                    except Exception:
-                        self.log.warn('Failed to grab logs for %s' % unit)
+                    add(machine, log, os.path.join(logdir, service, ''),
+                        unit)
+
+        workers = min(self.ARCHIVE_WORKERS, len(transfers))
+        with ThreadPoolExecutor(workers) as pool:
+            for key, (machine, machine_transfers) in transfers.items():
+                pool.submit(self.archive_machine_logs, machine,
+                            machine_transfers, addresses.get(key))
+
+    def archive_machine_logs(self, machine, transfers, address):
+        for log, dests in transfers.items():
+            try:
+                if self.conductor.juju_version.major > 0 and not address:
+                    raise OrchestraError('No address for machine %s' %
+                                         machine)
+                self.fetch_log(machine, log, list(dests), address)
+            except Exception as e:
+                self.log.debug('Failed to copy %s from machine %s: %s',
+                               log, machine, e)
+                for units in dests.values():
+                    for unit in units:
+                        if unit is None:
+                            self.log.warn('Failed to fetch logs for '
+                                          'bootstrap node')
+                        else:
+                            self.log.warn('Failed to grab logs for %s' %
+                                          unit)
+
+    def fetch_log(self, machine, log, dests, address):
+        """
+        Copy ``log`` from ``machine`` into each of the ``dests``
+        directories, transferring it only once.
+        """
+        if len(dests) == 1:
+            self.rsync(machine, log, dests[0], address)
+            return
+        os.makedirs(self.archive, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='.machine-%s-' % machine,
+                                   dir=self.archive)
+        try:
+            self.rsync(machine, log, os.path.join(staging, ''), address)
+            for dest in dests:
+                fan_out(staging, dest)
+        finally:
+            shutil.rmtree(staging)
 
     def print_status(self, exit_code):
         actual = self.map_status_code(exit_code)
@@ -392,19 +585,156 @@ class Orchestra(object):
             return 'fail'
 
     def build_env(self):
-        self.env["JUJU_ENV"] = self.conductor.juju_env
+        self.env["JUJU_ENV"] = self.juju_env
 
-    def rsync(self, machine, path, dest):
+    def rsync(self, machine, path, dest, dns_name=None):
         if self.conductor.juju_version.major == 0:
             cmd = ['rsync', '-a', '-v', '-z', '-R', '-e', 'juju ssh -e %s' %
                    self.env['JUJU_ENV'], '%s:%s' % (machine, path), dest]
         else:  # http://pad.lv/1183159
-            status = self.conductor.status(self.env['JUJU_ENV'])
-            dns_name = status['machines'][machine]['dns-name']
+            if not dns_name:
+                status = self.conductor.status(self.env['JUJU_ENV'])
+                dns_name = machine_addresses(status)[str(machine)]
             cmd = ['rsync', '-a', '-v', '-z', '-R', '-e', 'ssh',
                    'ubuntu@%s:%s' % (dns_name, path), dest]
 
-        subprocess.check_call(cmd, env=self.env)
+        subprocess.check_call(cmd, env=self.env, timeout=self.ARCHIVE_TIMEOUT)
+
+
+class TestResult(object):
+    """The outcome of a single test, as passed to the result sinks."""
+
+    def __init__(self, name, juju_env):
+        self.name = name
+        self.juju_env = juju_env
+        self.status = None
+        self.exit_code = None
+        self.message = None
+        # seconds spent running the test, and bootstrapping and destroying
+        # its environment, if it had to be
+        self.duration = None
+        self.bootstrap_time = None
+        self.teardown_time = None
+        self.logdir = None
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class JsonLinesSink(object):
+    """Write each result as a line of JSON as soon as it is known."""
+
+    def __init__(self, filename):
+        if filename == '-':
+            self.fp = sys.stdout
+        else:
+            self.fp = open(filename, 'w')
+
+    def add(self, result):
+        self.fp.write(json.dumps(result.as_dict(), sort_keys=True) + '\n')
+        self.fp.flush()
+
+    def close(self):
+        if self.fp is not sys.stdout:
+            self.fp.close()
+
+
+class JUnitSink(object):
+    """
+    Write the results as a JUnit XML report.  The report is rewritten as each
+    result comes in, so that it is complete up to the last finished test.
+    """
+
+    def __init__(self, filename, suite='juju-test'):
+        self.filename = filename
+        self.suite = suite
+        self.results = []
+
+    def add(self, result):
+        self.results.append(result)
+        self.write()
+
+    def close(self):
+        self.write()
+
+    def to_xml(self):
+        counts = {'failures': 0, 'errors': 0, 'skipped': 0}
+        suite = ElementTree.Element('testsuite', name=self.suite)
+        for result in self.results:
+            case = ElementTree.SubElement(
+                suite, 'testcase', classname=self.suite, name=result.name,
+                time='%.3f' % (result.duration or 0))
+            properties = ElementTree.SubElement(case, 'properties')
+            for key in ('juju_env', 'exit_code', 'bootstrap_time',
+                        'teardown_time', 'logdir'):
+                value = getattr(result, key)
+                if value is not None:
+                    ElementTree.SubElement(properties, 'property', name=key,
+                                           value=str(value))
+            if result.status == 'error':
+                counts['errors'] += 1
+                ElementTree.SubElement(case, 'error',
+                                       message=result.message or '')
+            elif result.status == 'skip':
+                counts['skipped'] += 1
+                ElementTree.SubElement(case, 'skipped')
+            elif result.status != 'pass':
+                counts['failures'] += 1
+                ElementTree.SubElement(
+                    case, 'failure', message=result.message or '',
+                    type=str(result.status))
+        suite.set('tests', str(len(self.results)))
+        suite.set('time', '%.3f' % sum(r.duration or 0
+                                       for r in self.results))
+        for key, count in counts.items():
+            suite.set(key, str(count))
+        return ElementTree.ElementTree(suite)
+
+    def write(self):
+        tmp = self.filename + '.tmp'
+        self.to_xml().write(tmp, encoding='utf-8', xml_declaration=True)
+        os.rename(tmp, self.filename)
+
+
+def result_sinks(args):
+    """Return the result sinks requested on the command line."""
+    sinks = []
+    if args.results_jsonl:
+        sinks.append(JsonLinesSink(args.results_jsonl))
+    if args.junit_xml:
+        suite = os.path.basename(os.getcwd())
+        sinks.append(JUnitSink(args.junit_xml, suite))
+    return sinks
+
+
+def machine_addresses(status):
+    """Return a mapping of machine id to address from a juju status."""
+    return {str(machine): info.get('dns-name')
+            for machine, info in (status.get('machines') or {}).items()}
+
+
+def fan_out(src, dest):
+    """
+    Link every file of the directory ``src`` into the same place under
+    ``dest``, alongside anything already there.
+    """
+    for dirpath, dirnames, filenames in os.walk(src):
+        target = os.path.join(dest, os.path.relpath(dirpath, src))
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        # os.walk doesn't descend into symlinked directories, so they are
+        # linked along with the files
+        links = [d for d in dirnames
+                 if os.path.islink(os.path.join(dirpath, d))]
+        for name in filenames + links:
+            src_file = os.path.join(dirpath, name)
+            dest_file = os.path.join(target, name)
+            if os.path.lexists(dest_file):
+                os.remove(dest_file)
+            if os.path.islink(src_file):
+                os.symlink(os.readlink(src_file), dest_file)
+            else:
+                utils.link_or_copy(src_file, dest_file)
 
 
 # Build Juju class instead? Move bootstrap, wait_for_bootstrap, teardown?
@@ -445,11 +775,11 @@ def get_juju_version():
     jv = JujuVersion()
     cmd = ['juju', 'version']
     try:
-        version = subprocess.check_output(cmd)
+        version = six.ensure_str(subprocess.check_output(cmd))
         version = version.split('-')[0]
     except Exception:
         cmd[1] = '--version'
-        version = subprocess.check_output(cmd)
+        version = six.ensure_str(subprocess.check_output(cmd))
         version = version.split()[1]
 
     for i, ver in enumerate(version.split('.')):
@@ -611,6 +941,10 @@ output:
   In the event a status is rewritten by either the --fail-on-skip flag or the
   --on-timeout flag the original status will be displayed in () next to the
   computed status.
+
+  With --results-jsonl and --junit-xml, a record of each test (its status,
+  exit code, and the time taken by the test, the bootstrap and the teardown)
+  is also written as JSON lines or JUnit XML as soon as the test finishes.
   """)
     # Plugin specific
     parser.add_argument('--description', action="store_true",
@@ -642,11 +976,27 @@ output:
                         help="Comma separated list of environment variables "
                         "to preserve.  This will be added to the default list "
                         "of {}.".format(ENV_WHITELIST))
+    parser.add_argument('--results-jsonl', metavar='FILE',
+                        help="write a JSON record for each test to FILE "
+                             "as it finishes, '-' for stdout")
+    parser.add_argument('--junit-xml', metavar='FILE',
+                        help="write the test results to FILE as JUnit XML")
     # These are bootstrap/juju specific
     parser.add_argument('-e', '--environment', metavar='JUJU_ENV',
                         default=os.environ.get('JUJU_ENV'),
                         dest='juju_env',
                         help="juju environment to operate in")
+    parser.add_argument('--env-pool', metavar='JUJU_ENV[,JUJU_ENV...]',
+                        type=lambda v: [e.strip() for e in v.split(',')],
+                        help="comma separated juju environments to run "
+                             "tests in concurrently, one test per "
+                             "environment at a time; defaults to the "
+                             "--environment")
+    parser.add_argument('--reuse-environments', default=False,
+                        action="store_true",
+                        help="keep an environment bootstrapped for the next "
+                             "test after a test passes, rather than "
+                             "destroying it after every test")
     parser.add_argument('--upload-tools', default=False, action="store_true",
                         help="upload juju tools (available for juju > 1.x)")
     parser.add_argument('--constraints', help="juju environment constraints")
@@ -722,19 +1072,6 @@ def main():
     sys.exit(0)
 
 
-# http://stackoverflow.com/a/601168/196832
-@contextmanager
-def timeout(seconds):
-    def signal_handler(signum, frame):
-        raise TimeoutError()
-    signal.signal(signal.SIGALRM, signal_handler)
-    signal.alarm(seconds)
-    try:
-        yield
-    finally:
-        signal.alarm(0)
-
-
 class StoreTimedelta(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
         setattr(namespace, self.dest, convert_to_timedelta(values))
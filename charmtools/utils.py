@@ -3,26 +3,54 @@ import copy
 import collections
 import hashlib
 import importlib
+import importlib.util
 import json
 import logging
 import os
+import random
 import re
 import six
+import shutil
 import subprocess
 import sys
 import tempfile
 import time
 from contextlib import contextmanager
 
-from .diff_match_patch import diff_match_patch
-import blessings
-import pathspec
 from path import Path as path
 
 log = logging.getLogger('utils')
 PY312 = (3, 12, 0)
 
 
+def lazy_import(name):
+    """
+    Return the module ``name``, deferring its execution until one of its
+    attributes is first used.
+
+    Used for the heavier dependencies, so that subcommands which don't need
+    them (e.g. ``charm version``) don't pay for importing them.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError('No module named {!r}'.format(name), name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    parent, _, child = name.rpartition('.')
+    if parent:
+        # as the import system does for submodules
+        setattr(sys.modules[parent], child, module)
+    spec.loader.exec_module(module)
+    return module
+
+
+blessings = lazy_import('blessings')
+pathspec = lazy_import('pathspec')
+
+
 @contextmanager
 def cd(directory, make=False):
     cwd = os.getcwd()
@@ -243,6 +271,50 @@ dig = Process(('dig', '+short'))
 api_endpoints = Process(('juju', 'api-endpoints'))
 
 
+class PollTimeout(OSError):
+    pass
+
+
+def poll(probe, timeout=0, interval=1, max_interval=30, backoff=2,
+         jitter=0.1, attempts=0):
+    """
+    Call ``probe`` until it returns a true value, and return that value.
+
+    The wait between calls starts at ``interval`` seconds and is multiplied
+    by ``backoff`` after every call, up to ``max_interval``.  Each wait is
+    randomly adjusted by up to ``jitter`` (a fraction of the wait) so that
+    concurrent pollers don't probe in lockstep, and never extends past the
+    deadline.
+
+    The probe can give up early by raising an exception, which is passed on.
+
+    :param timeout: Seconds after which to give up; zero to never give up.
+    :param attempts: Number of calls after which to give up; zero for no
+        limit.
+    :raises PollTimeout: if the probe didn't succeed in time.
+    """
+    deadline = time.monotonic() + timeout if timeout else None
+    delay = interval
+    attempt = 0
+    while True:
+        result = probe()
+        if result:
+            return result
+        attempt += 1
+        if attempts and attempt >= attempts:
+            raise PollTimeout("Gave up after {} attempts".format(attempt))
+        wait = delay * random.uniform(1 - jitter, 1 + jitter)
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise PollTimeout(
+                    "Timed out after {} seconds".format(timeout))
+            wait = min(wait, remaining)
+        if wait > 0:
+            time.sleep(wait)
+        delay = min(delay * backoff, max_interval)
+
+
 def wait_for(timeout, interval, *callbacks, **kwargs):
     """
     Repeatedly try callbacks until all return True
@@ -255,32 +327,21 @@ def wait_for(timeout, interval, *callbacks, **kwargs):
     Setting timeout to zero will loop until cancelled, power runs outs,
     hardware fails, or the heat death of the universe.
     """
-    start = time.time()
-    if timeout:
-        end = start + timeout
-    else:
-        end = 0
-
     bar = kwargs.get('bar', None)
     message = kwargs.get('message', None)
     once = 1
-    while True:
-        passes = True
-        if end > 0 and time.time() > end:
-            raise OSError("Timeout exceeded in wait_for")
+
+    def check():
+        nonlocal once
         if bar:
             bar.next(once, message=message)
-            if once == 1:
-                once = 0
-        if int(time.time()) % interval == 0:
-            for callback in callbacks:
-                result = callback()
-                passes = passes & bool(result)
-                if passes is False:
-                    break
-            if passes is True:
-                break
-        time.sleep(1)
+            once = 0
+        return all(callback() for callback in callbacks)
+
+    try:
+        poll(check, timeout=timeout, interval=interval, backoff=1)
+    except PollTimeout:
+        raise PollTimeout("Timeout exceeded in wait_for")
 
 
 def until(*callbacks, **kwargs):
@@ -291,17 +352,21 @@ def retry(attempts, *callbacks, **kwargs):
     """
     Repeatedly try callbacks a fixed number of times or until all return True
     """
-    for attempt in range(attempts):
+    first = True
+
+    def check():
+        nonlocal first
         if 'bar' in kwargs:
-            kwargs['bar'].next(attempt == 0, message=kwargs.get('message'))
-        for callback in callbacks:
-            if not callback():
-                break
-        else:
-            break
-    else:
-        raise OSError("Retry attempts exceeded")
-    return True
+            kwargs['bar'].next(first, message=kwargs.get('message'))
+            first = False
+        return all(callback() for callback in callbacks)
+
+    if attempts > 0:
+        try:
+            return poll(check, attempts=attempts, interval=0)
+        except PollTimeout:
+            pass
+    raise PollTimeout("Retry attempts exceeded")
 
 
 def which(program):
@@ -372,6 +437,35 @@ def sign(pathobj):
     return hashlib.sha256(p.bytes()).hexdigest()
 
 
+# ioctl to clone a file's extents on copy-on-write filesystems (linux/fs.h)
+FICLONE = 0x40049409
+
+
+def link_or_copy(src, dst):
+    """
+    Make ``dst`` a copy of ``src`` which shares its storage if possible.
+
+    A hardlink is tried first, then a reflink (for copy-on-write filesystems
+    such as btrfs and XFS, or across devices on them), and finally a plain
+    copy.  ``dst`` must not exist.
+    """
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    try:
+        import fcntl
+        with open(src, 'rb') as src_fp, open(dst, 'wb') as dst_fp:
+            fcntl.ioctl(dst_fp.fileno(), FICLONE, src_fp.fileno())
+        shutil.copystat(src, dst)
+        return
+    except (ImportError, OSError):
+        if os.path.exists(dst):
+            os.remove(dst)
+    shutil.copy2(src, dst)
+
+
 def delta_signatures(manifest_filename, ignore=None):
     md = path(manifest_filename)
     repo = md.normpath().dirname()
@@ -478,6 +572,7 @@ def delta_python(orig, dest, patterns=REACTIVE_PATTERNS, context=2):
         log.error('Error reading {}'.format(dest))
         raise
 
+    from .diff_match_patch import diff_match_patch
     differ = diff_match_patch()
     linect = 0
     lastMatch = None
@@ -500,6 +595,7 @@ def delta_python(orig, dest, patterns=REACTIVE_PATTERNS, context=2):
 def delta_python_dump(orig, dest, patterns=REACTIVE_PATTERNS,
                       context=2, term=None,
                       from_name=None, to_name=None):
+    from .diff_match_patch import diff_match_patch
     if term is None:
         term = TermWriter()
 
@@ -0,0 +1,335 @@
+"""
+Detection of the version control system and revision of a directory.
+
+Rather than trying ``git``, ``bzr`` and ``hg`` in turn and letting all but
+one of them fail, the markers each of them leaves on disk are checked first.
+Git revisions are read straight from ``HEAD``, the loose refs and
+``packed-refs``; the other systems are only asked for the revision when their
+marker was found.  Results are memoized per directory until
+:func:`clear_cache` is called (once per build).
+
+The same markers can be read from an archived working tree with
+:func:`get_archive_revision`, without extracting it.
+"""
+import binascii
+import hashlib
+import logging
+import os
+import shlex
+import subprocess
+import tarfile
+import zipfile
+
+log = logging.getLogger(__name__)
+
+MARKERS = (
+    ('git', '.git'),
+    ('bzr', '.bzr'),
+    ('hg', '.hg'),
+)
+
+_roots = {}
+_revisions = {}
+_archive_revisions = {}  # keyed by content, so never needs clearing
+
+
+def clear_cache():
+    _roots.clear()
+    _revisions.clear()
+
+
+def find_root(dir_):
+    """
+    Find the working tree containing ``dir_``.
+
+    Every VCS is considered in turn, in the same order as they used to be
+    tried, and the nearest enclosing working tree of the first one found is
+    returned.
+
+    :returns: Tuple of ``(vcs, root)``, or ``(None, None)`` if ``dir_`` is
+        not under version control.
+    """
+    dir_ = os.path.realpath(str(dir_))
+    if dir_ not in _roots:
+        _roots[dir_] = _find_root(dir_)
+    return _roots[dir_]
+
+
+def _find_root(dir_):
+    for vcs, marker in MARKERS:
+        current = dir_
+        while True:
+            if os.path.exists(os.path.join(current, marker)):
+                return vcs, current
+            parent = os.path.dirname(current)
+            if parent == current:
+                break
+            current = parent
+    return None, None
+
+
+def get_revision(dir_):
+    """
+    Return the revision checked out in ``dir_``, or ``None`` if it is not
+    under version control or the revision can't be determined.
+    """
+    vcs, root = find_root(dir_)
+    if vcs is None:
+        return None
+    key = (vcs, root)
+    if key not in _revisions:
+        reader = {
+            'git': _git_revision,
+            'bzr': _bzr_revision,
+            'hg': _hg_revision,
+        }[vcs]
+        _revisions[key] = reader(root)
+    return _revisions[key]
+
+
+def _run(cmd, cwd):
+    try:
+        return subprocess.check_output(shlex.split(cmd), cwd=cwd,
+                                       stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError) as e:
+        log.debug('%s: %s', cmd, e)
+        return None
+
+
+def git_dirs(root):
+    """
+    Return the git dir and the common git dir of a working tree.
+
+    These differ for linked worktrees, where ``.git`` is a file pointing at
+    ``<common dir>/worktrees/<name>``.
+    """
+    git_dir = os.path.join(root, '.git')
+    if os.path.isfile(git_dir):
+        with open(git_dir) as fp:
+            content = fp.read().strip()
+        if not content.startswith('gitdir:'):
+            return None, None
+        git_dir = os.path.join(root, content[len('gitdir:'):].strip())
+    common_dir = git_dir
+    commondir_file = os.path.join(git_dir, 'commondir')
+    if os.path.isfile(commondir_file):
+        with open(commondir_file) as fp:
+            common_dir = os.path.join(git_dir, fp.read().strip())
+    return os.path.normpath(git_dir), os.path.normpath(common_dir)
+
+
+def parse_packed_refs(text):
+    """Return a mapping of ref name to sha from the text of ``packed-refs``."""
+    refs = {}
+    for line in text.splitlines():
+        if line.startswith(('#', '^')):
+            continue
+        parts = line.split()
+        if len(parts) == 2:
+            refs[parts[1]] = parts[0]
+    return refs
+
+
+def read_packed_refs(common_dir):
+    """Return a mapping of ref name to sha from ``packed-refs``."""
+    try:
+        with open(os.path.join(common_dir, 'packed-refs')) as fp:
+            return parse_packed_refs(fp.read())
+    except OSError:
+        return {}
+
+
+def resolve_git_ref(git_dir, common_dir, ref='HEAD'):
+    """
+    Resolve a (possibly symbolic) ref to a sha by reading the repository
+    files, without running ``git``.
+
+    :returns: The sha, or ``None`` if the ref doesn't exist.
+    """
+    def read_ref(ref):
+        for base in (git_dir, common_dir):
+            try:
+                with open(os.path.join(base, ref)) as fp:
+                    return fp.read()
+            except OSError:
+                continue
+        return None
+
+    return _resolve_ref(read_ref, lambda: read_packed_refs(common_dir), ref)
+
+
+def _resolve_ref(read_ref, read_packed_refs, ref='HEAD'):
+    for _ in range(10):  # guard against symbolic ref loops
+        value = read_ref(ref)
+        if value is None:
+            return read_packed_refs().get(ref)
+        value = value.strip()
+        if not value.startswith('ref:'):
+            return value
+        ref = value[len('ref:'):].strip()
+    return None
+
+
+def _git_revision(root):
+    git_dir, common_dir = git_dirs(root)
+    if git_dir and not os.path.exists(os.path.join(common_dir, 'reftable')):
+        return resolve_git_ref(git_dir, common_dir)
+    # can't read this repository format directly
+    out = _run('git rev-parse HEAD', root)
+    return out.decode('utf8').strip() if out else None
+
+
+def _bzr_revision(root):
+    out = _run('bzr revision-info', root)
+    return out.decode('utf8').strip().split()[1] if out else None
+
+
+HG_DIRSTATE_V2_MARKER = b'dirstate-v2\n'
+
+
+def _hg_revision(root):
+    try:
+        with open(os.path.join(root, '.hg', 'dirstate'), 'rb') as fp:
+            data = fp.read(32)
+    except OSError:
+        data = b''
+    node = hg_dirstate_node(data)
+    if node:
+        return node
+    out = _run("hg log -l 1 --template '{node}\n' -r .", root)
+    return out.decode('utf8').strip() if out else None
+
+
+def hg_dirstate_node(data):
+    """
+    Return the node of the working copy parent from the start of the
+    dirstate (or the dirstate-v2 docket), or ``None`` if it's too short.
+    """
+    if data.startswith(HG_DIRSTATE_V2_MARKER):
+        data = data[len(HG_DIRSTATE_V2_MARKER):]
+    node = data[:20]
+    if len(node) == 20:
+        return binascii.hexlify(node).decode('ascii')
+    return None
+
+
+class UnreadableArchive(Exception):
+    """
+    The revision of an archived working tree can't be determined without
+    extracting it (e.g., it needs ``bzr`` to be run).
+    """
+
+
+# Files read from archives; everything else is only checked for existence.
+_GIT_FILES = ('.git', '.git/HEAD', '.git/packed-refs', '.git/commondir')
+_OTHER_FILES = ('.hg/dirstate', '.pull-source-rev')
+
+
+def get_archive_revision(filename, dir_=''):
+    """
+    Return the revision of the working tree ``dir_`` within a ``.zip`` or
+    ``.tar.gz`` archive, or ``None`` if it can't be determined.
+
+    This matches what :func:`get_revision` (falling back to a
+    ``.pull-source-rev`` file) would return for the extracted tree, but only
+    the VCS markers are read, as the archive is streamed.  Results are
+    memoized by the archive's content.
+
+    :raises UnreadableArchive: if the archive needs to be extracted.
+    """
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            sha.update(chunk)
+    key = (sha.hexdigest(), dir_)
+    if key not in _archive_revisions:
+        _archive_revisions[key] = _archive_revision(str(filename), dir_)
+    return _archive_revisions[key]
+
+
+def _archive_revision(filename, dir_):
+    # the enclosing directories of dir_, nearest first, as name prefixes
+    parts = [p for p in dir_.strip('/').split('/') if p]
+    roots = ['/'.join(parts[:i]) + '/' for i in range(len(parts), 0, -1)]
+    roots.append('')
+
+    def wanted(name):
+        for root in roots:
+            if name.startswith(root):
+                rest = name[len(root):]
+                if (rest in _GIT_FILES or rest in _OTHER_FILES or
+                        rest.startswith('.git/refs/')):
+                    return True
+        return False
+
+    files, dirs = _read_archive(filename, wanted)
+    vcs, root = next(((vcs, root)
+                      for vcs, marker in MARKERS
+                      for root in roots
+                      if root + marker in files or root + marker in dirs),
+                     (None, None))
+    revision = None
+    if vcs == 'git':
+        git_dir = root + '.git/'
+        if (root + '.git' in files or git_dir + 'commondir' in files or
+                git_dir + 'reftable' in dirs):
+            # a linked worktree, or a format we can't read directly
+            raise UnreadableArchive(filename)
+        revision = _resolve_ref(
+            lambda ref: _text(files.get(git_dir + ref)),
+            lambda: parse_packed_refs(
+                _text(files.get(git_dir + 'packed-refs')) or ''))
+    elif vcs == 'hg':
+        revision = hg_dirstate_node(files.get(root + '.hg/dirstate', b''))
+        if revision is None:
+            raise UnreadableArchive(filename)
+    elif vcs is not None:
+        raise UnreadableArchive(filename)
+    if revision:
+        return revision
+    rev_file = files.get(roots[0] + '.pull-source-rev')
+    if rev_file is not None:
+        return _text(rev_file).strip()
+    return None
+
+
+def _text(data):
+    return data.decode('utf8') if data is not None else None
+
+
+def _read_archive(filename, wanted):
+    """
+    Stream through an archive, returning the content of the members for
+    which ``wanted(name)`` is true, and the set of every directory in it.
+    """
+    files, dirs = {}, set()
+
+    def add(name, isdir, read):
+        name = name[2:] if name.startswith('./') else name
+        name = name.rstrip('/')
+        parent = name
+        while '/' in parent:
+            parent = parent.rsplit('/', 1)[0]
+            dirs.add(parent)
+        if isdir:
+            dirs.add(name)
+        elif wanted(name):
+            files[name] = read()
+
+    if filename.endswith('.zip'):
+        with zipfile.ZipFile(filename) as archive:
+            for info in archive.infolist():
+                add(info.filename, info.is_dir(),
+                    lambda: archive.read(info))
+    elif filename.endswith('.tar.gz'):
+        try:
+            with tarfile.open(filename, 'r|gz') as archive:
+                for member in archive:
+                    add(member.name, member.isdir(),
+                        lambda: archive.extractfile(member).read()
+                        if member.isfile() else b'')
+        except tarfile.TarError as e:
+            raise UnreadableArchive('{}: {}'.format(filename, e))
+    else:
+        raise UnreadableArchive(filename)
+    return files, dirs
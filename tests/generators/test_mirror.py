@@ -0,0 +1,120 @@
+#!/usr/bin/python
+
+#    Copyright (C) 2014  Canonical Ltd.
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+from mock import patch
+from unittest import TestCase
+
+from charmtools.generators import (
+    CharmGeneratorException,
+    TemplateMirror,
+)
+from charmtools.templates.reactive_python import (
+    ReactivePythonCharmTemplate,
+)
+
+
+def git(*args, **kw):
+    return subprocess.check_output(
+        ('git', '-c', 'user.name=t', '-c', 'user.email=t@t') + args,
+        **kw).decode('utf8').strip()
+
+
+class TemplateMirrorTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        patcher = patch.object(TemplateMirror, 'CACHE_DIR',
+                               os.path.join(self.directory, 'cache'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # a bare "remote" repo, populated through a working copy
+        self.remote = os.path.join(self.directory, 'template.git')
+        self.work = os.path.join(self.directory, 'work')
+        git('init', '-q', '--bare', self.remote)
+        git('clone', '-q', self.remote, self.work, stderr=subprocess.STDOUT)
+        os.makedirs(os.path.join(self.work, 'reactive'))
+        self.commit({'README.md': 'template readme\n',
+                     'layer.yaml': 'includes: ["layer:basic"]\n',
+                     'reactive/handlers.py': '# $metadata.package\n'})
+
+    def commit(self, files):
+        for name, content in files.items():
+            with open(os.path.join(self.work, name), 'w') as f:
+                f.write(content)
+        git('add', '.', cwd=self.work)
+        git('commit', '-q', '-m', 'update', cwd=self.work)
+        git('push', '-q', 'origin', 'HEAD', cwd=self.work,
+            stderr=subprocess.STDOUT)
+
+    def export(self):
+        output_dir = tempfile.mkdtemp(dir=self.directory)
+        with patch('subprocess.check_call',
+                   wraps=subprocess.check_call) as check_call:
+            TemplateMirror(self.remote).export(output_dir)
+        commands = [tuple(c[0][0][1:4]) for c in check_call.call_args_list]
+        return output_dir, commands
+
+    def read(self, *parts):
+        with open(os.path.join(*parts)) as f:
+            return f.read()
+
+    def test_export(self):
+        output_dir, commands = self.export()
+        self.assertEqual([c[0] for c in commands], ['clone'])
+        self.assertEqual(sorted(os.listdir(output_dir)),
+                         ['README.md', 'layer.yaml', 'reactive'])
+        self.assertEqual(self.read(output_dir, 'reactive', 'handlers.py'),
+                         '# $metadata.package\n')
+
+        # a fresh mirror is used as is
+        self.commit({'layer.yaml': 'includes: ["layer:apt"]\n'})
+        output_dir, commands = self.export()
+        self.assertEqual(commands, [])
+        self.assertIn('basic', self.read(output_dir, 'layer.yaml'))
+
+        # offline, even a stale mirror is used as is
+        with patch.object(TemplateMirror, 'MAX_AGE', -1), \
+                patch.object(TemplateMirror, 'OFFLINE', True):
+            output_dir, commands = self.export()
+        self.assertEqual(commands, [])
+
+        with patch.object(TemplateMirror, 'MAX_AGE', -1):
+            output_dir, commands = self.export()
+        self.assertEqual(commands, [('--git-dir', TemplateMirror(
+            self.remote).path, 'fetch')])
+        self.assertIn('apt', self.read(output_dir, 'layer.yaml'))
+
+    def test_offline_without_mirror(self):
+        with patch.object(TemplateMirror, 'OFFLINE', True):
+            self.assertRaises(CharmGeneratorException, self.export)
+
+    def test_reactive_python_template(self):
+        output_dir = os.path.join(self.directory, 'charm')
+        template = ReactivePythonCharmTemplate()
+        with patch.object(template, '_TEMPLATE_URL', self.remote):
+            template._clone_template(
+                {'metadata': {'package': 'my-charm'}}, output_dir)
+        self.assertEqual(sorted(os.listdir(output_dir)),
+                         ['layer.yaml', 'reactive'])
+        self.assertEqual(os.listdir(os.path.join(output_dir, 'reactive')),
+                         ['my_charm.py'])
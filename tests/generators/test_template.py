@@ -15,12 +15,19 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from mock import Mock
+import os
+import shutil
+import stat
+import tempfile
+
+from Cheetah.Template import Template
+from mock import Mock, patch
 from unittest import TestCase
 
 from charmtools.generators import (
     CharmTemplate,
 )
+from charmtools.generators import template
 
 
 class CharmTemplateTest(TestCase):
@@ -41,3 +48,40 @@ class CharmTemplateTest(TestCase):
         t.validate_input('value', prompt, {})
 
         prompt.validate.assert_called_once_with('value')
+
+    def test_render_files(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        os.makedirs(os.path.join(output_dir, 'hooks'))
+        files = {
+            'metadata.yaml': 'name: $metadata.package\n',
+            'hooks/install': '#!/bin/bash\necho $metadata.package\n',
+            'hooks/stop': '#!/bin/bash\necho $metadata.package\n',
+            'README.ex': 'Not $rendered\n',
+        }
+        for name, content in files.items():
+            with open(os.path.join(output_dir, name), 'w') as f:
+                f.write(content)
+        os.chmod(os.path.join(output_dir, 'hooks', 'install'), 0o755)
+        os.symlink('install', os.path.join(output_dir, 'hooks', 'start'))
+
+        config = {'metadata': {'package': 'foo'}}
+        compile = Template.compile
+        with patch.dict(template._compiled_templates, clear=True), \
+                patch.object(Template, 'compile', wraps=compile) as c:
+            CharmTemplate().render_files(config, output_dir)
+            # the two identical hooks share a compiled template
+            self.assertEqual(c.call_count, 2)
+
+        def read(name):
+            with open(os.path.join(output_dir, name)) as f:
+                return f.read()
+        self.assertEqual(read('metadata.yaml'), 'name: foo\n')
+        self.assertEqual(read('hooks/install'), '#!/bin/bash\necho foo\n')
+        self.assertEqual(read('README.ex'), 'Not $rendered\n')
+        self.assertTrue(os.path.islink(os.path.join(output_dir, 'hooks',
+                                                    'start')))
+        mode = os.stat(os.path.join(output_dir, 'hooks', 'install')).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0o755)
+        self.assertEqual(sorted(os.listdir(output_dir)),
+                         ['README.ex', 'hooks', 'metadata.yaml'])
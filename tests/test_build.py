@@ -1,6 +1,7 @@
 #!usr/bin/env python2
 import os
 import json
+import subprocess
 import tempfile
 import unittest
 import logging
@@ -17,7 +18,8 @@ except ImportError:
         return str(importlib.resources.files(package).joinpath(resource))
 
 from contextlib import contextmanager
-from charmtools import build
+from io import StringIO
+from charmtools import build, utils
 from charmtools.build.errors import BuildError
 from ruamel import yaml
 import mock
@@ -77,6 +79,9 @@ class TestBuild(unittest.TestCase):
                 "Failed to process {0}. "
                 "Ensure the YAML is valid".format(metadata.abspath()), str(e))
 
+    @mock.patch.object(build.tactics.WheelhouseTactic, 'source', None)
+    @mock.patch.object(build.tactics.WheelhouseTactic, 'STORE_DIR', None)
+    @mock.patch.object(build.tactics.InstallerTactic, 'CACHE_DIR', None)
     @mock.patch("argparse.ArgumentParser.parse_args")
     @mock.patch("charmtools.build.builder.proof")
     @mock.patch("charmtools.build.builder.Builder")
@@ -347,6 +352,85 @@ class TestBuild(unittest.TestCase):
                                   "--user", "--ignore-installed",
                                   mock.ANY), env=mock.ANY)
 
+    @mock.patch.object(build.tactics.InstallerTactic, 'CACHE_DIR',
+                       '/pip-cache')
+    @mock.patch.object(build.tactics.InstallerTactic, '_pending', {})
+    @mock.patch("charmtools.utils.sign", wraps=utils.sign)
+    @mock.patch("charmtools.utils.Process")
+    def test_pypi_installer_batch(self, Process, sign):
+        layer_dir = self.build_dir / 'layer'
+        (layer_dir / 'lib').makedirs_p()
+        (layer_dir / 'lib' / 'foo.pypi').write_text('foo>=1.0\n')
+        (layer_dir / 'lib' / 'bar.pypi').write_text(
+            'git+https://example.com/bar.git#egg=bar\n')
+        base = mock.Mock(directory=layer_dir, url='layer:base')
+        top = mock.Mock(directory=layer_dir, url='layer:top')
+        target = mock.Mock(directory=self.build_dir / 'charm')
+        tactics = [
+            build.tactics.InstallerTactic(layer_dir / 'lib' / 'foo.pypi',
+                                          target, base, mock.Mock()),
+            build.tactics.InstallerTactic(layer_dir / 'lib' / 'bar.pypi',
+                                          target, top, mock.Mock()),
+        ]
+
+        def install(command, env):
+            """Fake a pip install of foo, and of bar from before wheels"""
+            site = path(env['PYTHONUSERBASE']) / 'lib/python3/site-packages'
+            (site / 'foo').makedirs_p()
+            (site / 'foo' / '__init__.py').write_text('foo = 1\n')
+            egg_info = site / 'bar-1.0-py3.11.egg-info'
+            egg_info.makedirs_p()
+            (egg_info / 'PKG-INFO').write_text('bar')
+            # a dependency of foo, which no .pypi file asked for
+            (site / 'six.py').write_text('six')
+            (path(env['PYTHONUSERBASE']) / 'bin').makedirs_p()
+            (path(env['PYTHONUSERBASE']) / 'bin' / 'foo').write_text('foo')
+            (site / 'foo-1.0.dist-info').makedirs_p()
+            (site / 'foo-1.0.dist-info' / 'RECORD').write_lines([
+                'foo/__init__.py,'
+                'sha256=_r3vZE8Wzp0jhcjh0VMZ1I1fRMehv4OvIOSKN-Ar46w,8',
+                '../../../bin/foo,'
+                'sha256=LCa0a2j_xo_5m0U8HTBBNBNCLXBkg7-g-YpeiGJm564,3',
+                'foo-1.0.dist-info/RECORD,,',
+            ])
+            return mock.Mock(return_value=mock.Mock(exit_code=0))
+        Process.side_effect = install
+
+        for tactic in tactics:
+            tactic.read()
+        for tactic in tactics:
+            tactic()
+        Process.assert_called_once_with(
+            ('pip3', 'install', '--user', '--ignore-installed',
+             '--cache-dir', '/pip-cache', 'foo>=1.0',
+             'git+https://example.com/bar.git#egg=bar'), env=mock.ANY)
+        # entries without a RECORD are still credited to the right layer
+        self.assertEqual(sorted(tactics[0]._tracked), [
+            ('__pip__', self.build_dir / 'charm/lib/six.py'),
+            ('layer:top',
+             self.build_dir / 'charm/lib/bar-1.0-py3.11.egg-info'),
+        ])
+
+        sigs = {}
+        for tactic in tactics:
+            sigs.update(tactic.sign())
+        charm_dir = self.build_dir / 'charm'
+        # only the files without a hash in a RECORD are hashed
+        self.assertEqual(sorted(c[0][0].relpath(charm_dir)
+                                for c in sign.call_args_list),
+                         ['lib/bar-1.0-py3.11.egg-info/PKG-INFO',
+                          'lib/foo-1.0.dist-info/RECORD', 'lib/six.py'])
+        self.assertEqual(sigs, {
+            relpath: (url, 'dynamic', utils.sign(charm_dir / relpath))
+            for relpath, url in [
+                ('lib/foo/__init__.py', 'layer:base'),
+                ('bin/foo', 'layer:base'),
+                ('lib/foo-1.0.dist-info/RECORD', 'layer:base'),
+                ('lib/bar-1.0-py3.11.egg-info/PKG-INFO', 'layer:top'),
+                ('lib/six.py', '__pip__'),
+            ]
+        })
+
     @mock.patch(
         "charmtools.build.tactics.VersionTactic._try_to_get_current_sha",
         return_value="fake sha")
@@ -621,6 +705,239 @@ class TestBuild(unittest.TestCase):
         self.assertEqual(captured['env']['PIP_BUILD_CONSTRAINT'],
                          str(self.build_dir / wh.CONS_FILENAME))
 
+    @mock.patch.object(build.tactics.WheelhouseTactic, 'removed', [])
+    @mock.patch("charmtools.build.tactics.utils.Process")
+    def test_wheelhouse_store(self, Process):
+        store = self.build_dir / 'wheels'
+        downloads = {}
+
+        def download(command, env=None):
+            """Fake a pip download (or wheel) of the current ``downloads``"""
+            args = command[-1].split()
+            flag = '-d' if '-d' in args else '-w'
+            dest = path(args[args.index(flag) + 1])
+            for name, content in downloads.items():
+                (dest / name).write_text(content)
+            return mock.Mock(return_value=mock.Mock(exit_code=0))
+        Process.side_effect = download
+
+        tactics = []
+        for charm in ('one', 'two'):
+            wheelhouse = self.build_dir / charm / 'wheelhouse'
+            wheelhouse.makedirs_p()
+            wh = build.tactics.WheelhouseTactic(
+                path('wheelhouse.txt'),
+                mock.Mock(directory=self.build_dir / charm),
+                mock.Mock(url=charm),
+                mock.Mock())
+            wh._venv = self.build_dir / 'venv'
+            tactics.append(wh)
+
+        downloads['foo-1.0.tar.gz'] = 'foo 1.0'
+        with mock.patch.object(build.tactics.WheelhouseTactic, 'STORE_DIR',
+                               store):
+            for wh in tactics:
+                wh._add(wh.target.directory / 'wheelhouse', 'foo')
+            stored = store / utils.sign(
+                self.build_dir / 'one/wheelhouse/foo-1.0.tar.gz')
+            self.assertEqual(stored.listdir(), [stored / 'foo-1.0.tar.gz'])
+            for charm in ('one', 'two'):
+                self.assertTrue(
+                    (self.build_dir / charm / 'wheelhouse/foo-1.0.tar.gz')
+                    .samefile(stored / 'foo-1.0.tar.gz'))
+            self.assertEqual(
+                (stored / 'foo-1.0.tar.gz').stat().st_mode & 0o777, 0o444)
+
+            # a layer shipping a file of the same name replaces the link
+            # rather than writing through it to the store
+            layer_file = self.build_dir / 'layer/wheelhouse/foo-1.0.tar.gz'
+            layer_file.parent.makedirs_p()
+            layer_file.write_text('layer foo')
+            build.tactics.CopyTactic(
+                layer_file,
+                mock.Mock(directory=self.build_dir / 'two'),
+                mock.Mock(directory=self.build_dir / 'layer'),
+                mock.Mock())()
+            self.assertEqual(
+                (self.build_dir / 'two/wheelhouse/foo-1.0.tar.gz').text(),
+                'layer foo')
+            self.assertEqual((stored / 'foo-1.0.tar.gz').text(), 'foo 1.0')
+
+            # purging still only affects the wheelhouse, not the store
+            del downloads['foo-1.0.tar.gz']
+            downloads['foo-2.0.tar.gz'] = 'foo 2.0'
+            wh = tactics[0]
+            wh.purge_wheels = True
+            wh._add(wh.target.directory / 'wheelhouse', 'foo')
+        self.assertEqual((self.build_dir / 'one/wheelhouse').listdir(),
+                         [self.build_dir / 'one/wheelhouse/foo-2.0.tar.gz'])
+        self.assertEqual(wh.removed,
+                         [self.build_dir / 'one/wheelhouse/foo-1.0.tar.gz'])
+        self.assertTrue((stored / 'foo-1.0.tar.gz').exists())
+
+        # the stored wheels aren't hashed again when signing
+        sha = utils.sign(self.build_dir / 'one/wheelhouse/foo-2.0.tar.gz')
+        with mock.patch("charmtools.utils.sign") as sign:
+            self.assertEqual(wh.sign(), {
+                'wheelhouse.txt': ('one', 'dynamic', sign.return_value),
+                'wheelhouse-constraints.txt': ('one', 'dynamic',
+                                               sign.return_value),
+                'wheelhouse/foo-2.0.tar.gz': ('__pip__', 'dynamic', sha),
+            })
+        self.assertEqual(sign.call_count, 2)
+
+    def test_wheelhouse_source(self):
+        source = self.build_dir / 'source'
+        (source / 'bar').makedirs_p()
+        for dist in ('foo-1.0.tar.gz', 'foo-2.0.tar.gz', 'setuptools-80.0.zip',
+                     'bar/bar-2.0-py3-none-any.whl', 'README'):
+            (source / dist).touch()
+        wh = build.tactics.WheelhouseTactic(
+            path('wheelhouse.txt'),
+            mock.Mock(directory=self.build_dir),
+            mock.Mock(url='charm'),
+            mock.Mock())
+        wh.lines = ['foo>=1.0', 'Bar>=2.0', 'git+https://github.com/me/qux'
+                    '#egg=qux']
+        wh.cons_lines = ['foo<2.0', 'setuptools<82', 'six<2']
+        with mock.patch.object(build.tactics.WheelhouseTactic, 'source',
+                               source):
+            wh._check_source()
+            env = wh._get_env()
+            self.assertEqual(env['PIP_NO_INDEX'], '1')
+            self.assertEqual(env['PIP_FIND_LINKS'].split(), [
+                'file://' + source, 'file://' + source / 'bar'])
+
+            # every missing requirement is reported at once
+            wh.lines += ['bar<2.0', 'baz']
+            wh.cons_lines += ['setuptools>=81']
+            with self.assertRaises(BuildError) as e:
+                wh._check_source()
+        self.assertEqual(str(e.exception).splitlines()[1:], [
+            '    bar<2.0', '    baz', '    setuptools<82',
+            '    setuptools>=81'])
+
+    @mock.patch.dict(build.tactics.RequirementLine._cache, clear=True)
+    def test_wheelhouse_combine_parses_once(self):
+        tactics = []
+        for i, content in enumerate(['foo==1.0\nbar==1.0\n',
+                                     '# comment\nfoo==2.0\n',
+                                     'bar-baz\nbar>=2.0\n']):
+            layer_dir = self.build_dir / 'layer{}'.format(i)
+            layer_dir.makedirs_p()
+            (layer_dir / 'wheelhouse.txt').write_text(content)
+            tactic = build.tactics.WheelhouseTactic(
+                layer_dir / 'wheelhouse.txt',
+                mock.Mock(directory=self.build_dir),
+                mock.Mock(url='layer{}'.format(i)),
+                mock.Mock())
+            if tactics:
+                tactic = tactic.combine(tactics[-1])
+            tactics.append(tactic)
+
+        requirements = build.tactics.requirements
+        with mock.patch.object(requirements, 'parse',
+                               wraps=requirements.parse) as parse:
+            top = build.tactics.WheelhouseTactic(
+                self.build_dir / 'wheelhouse.txt',
+                mock.Mock(directory=self.build_dir),
+                mock.Mock(url='top'),
+                mock.Mock())
+            top.lines = []
+            top.cons_lines = []
+            top.combine(tactics[-1])
+        # only the line commented out by layer2 is new at this level; every
+        # other line was already parsed while combining the lower layers
+        parse.assert_called_once_with('# bar==1.0  # overridden by layer2')
+        self.assertEqual(top.lines, [
+            '# layer0',
+            '# foo==1.0  # overridden by layer1',
+            '# bar==1.0  # overridden by layer2',
+            '',
+            '# layer1',
+            '# comment',
+            'foo==2.0',
+            '',
+            '# layer2',
+            'bar-baz',
+            'bar>=2.0',
+            '',
+        ])
+        self.assertEqual({name: str(req.specs)
+                          for name, req in top.modules.items()},
+                         {'foo': "[('==', '2.0')]",
+                          'bar': "[('>=', '2.0')]",
+                          'bar-baz': '[]'})
+
+    def test_copy_unchanged(self):
+        layer = mock.Mock(directory=self.build_dir / 'layer')
+        target = mock.Mock(directory=self.build_dir / 'charm')
+        (self.build_dir / 'layer').makedirs_p()
+        entity = self.build_dir / 'layer' / 'README.md'
+        entity.write_text('readme')
+        copy = build.tactics.CopyTactic(entity, target, layer, mock.Mock())
+        copy()
+        self.assertEqual(copy.target_file.text(), 'readme')
+
+        entity.chmod(0o700)
+        with mock.patch('path.Path.copy2') as copy2:
+            copy()
+        self.assertFalse(copy2.called)
+        self.assertEqual(copy.target_file.stat().st_mode & 0o777, 0o700)
+
+        # a hardlinked target is only replaced, rather than written
+        # through, when it has to change
+        link = self.build_dir / 'README.link'
+        os.link(copy.target_file, link)
+        copy()
+        self.assertTrue(link.samefile(copy.target_file))
+
+        entity.write_text('changed')
+        copy()
+        self.assertEqual(copy.target_file.text(), 'changed')
+        self.assertEqual(link.text(), 'readme')
+
+    @mock.patch.dict(build.tactics.DynamicHookBind._templates, clear=True)
+    def test_hook_bind_unchanged(self):
+        target = mock.Mock(directory=self.build_dir)
+        template_file = self.build_dir / 'hooks' / 'hook.template'
+        template_file.parent.makedirs_p()
+        template_file.write_text('# {}\n')
+        output_files = {'hooks/start': mock.Mock()}
+
+        def bind():
+            tactics = [
+                build.tactics.StandardHooksBind('hook', 'layer:basic',
+                                                target, mock.Mock(),
+                                                output_files, template_file),
+                build.tactics.InterfaceBind('db', 'layer:basic', target,
+                                            mock.Mock(), output_files,
+                                            template_file),
+            ]
+            for tactic in tactics:
+                tactic()
+            return tactics
+
+        with mock.patch('path.Path.text', autospec=True,
+                        side_effect=path.text) as text:
+            tactics = bind()
+        # the template was only read once
+        self.assertEqual([c[0][0] for c in text.call_args_list
+                          if c[0][0] == template_file], [template_file])
+        install = self.build_dir / 'hooks' / 'install'
+        self.assertEqual(install.text(), '# hook\n')
+        self.assertEqual(install.stat().st_mode & 0o777, 0o755)
+        self.assertFalse((self.build_dir / 'hooks' / 'start').exists())
+        self.assertEqual(len(tactics[1].tracked), 5)
+
+        with mock.patch('path.Path.write_text') as write_text:
+            bind()
+        self.assertFalse(write_text.called)
+
+        template_file.write_text('# changed {}\n')
+        bind()
+        self.assertEqual(install.text(), '# changed hook\n')
+
     @mock.patch.object(build.tactics, 'log')
     @mock.patch.object(build.tactics.YAMLTactic, 'read',
                        lambda s: setattr(s, '_read', True))
@@ -768,6 +1085,268 @@ class TestFetchers(unittest.TestCase):
         copytree.assert_called_once_with(path('/tmp/src/layers/test'),
                                          path('/tmp/dst/test'))
 
+    def test_locked_fetcher(self):
+        with TempDir() as tmp:
+            origin = tmp / 'layer-foo'
+            origin.makedirs_p()
+            git = build.fetchers.git
+            git('init -q', cwd=origin)
+            (origin / 'layer.yaml').write_text('includes: []\n')
+            (origin / 'sub').makedirs_p()
+            (origin / 'sub' / 'layer.yaml').write_text('repo: sub\n')
+            git('add .', cwd=origin)
+            git('-c user.name=t -c user.email=t@t commit -q -m one',
+                cwd=origin)
+            commit = subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], cwd=origin).decode().strip()
+            (origin / 'layer.yaml').write_text('includes: [layer:bar]\n')
+            git('-c user.name=t -c user.email=t@t commit -q -am two',
+                cwd=origin)
+            lock = {
+                'type': 'layer',
+                'item': 'layer:foo',
+                'url': str(origin),
+                'vcs': 'git',
+                'branch': 'refs/heads/master',
+                'commit': commit,
+            }
+            self.assertTrue(build.fetchers.LockedFetcher.can_fetch_lock(lock))
+            self.assertFalse(build.fetchers.LockedFetcher.can_fetch_lock(
+                dict(lock, vcs=None)))
+            self.assertFalse(build.fetchers.LockedFetcher.can_fetch_lock(
+                dict(lock, branch='refs/heads/stable'), use_branches=True))
+
+            dest = tmp / 'dest'
+            dest.makedirs_p()
+            with mock.patch.object(build.fetchers.LockedFetcher,
+                                   'MIRROR_DIR', tmp / 'mirrors'), \
+                    mock.patch('requests.get') as get:
+                fetcher = build.fetchers.LockedFetcher('layer', lock)
+                target = fetcher.fetch(dest)
+                self.assertEqual(target, dest / 'foo')
+                self.assertEqual((target / 'layer.yaml').text(),
+                                 'includes: []\n')
+                self.assertEqual(fetcher.get_revision(target), commit)
+
+                # once mirrored, the origin is no longer needed
+                origin.rmtree()
+                fetcher = build.fetchers.LockedFetcher(
+                    'layer', dict(lock, subdir='sub'))
+                target = fetcher.fetch(dest)
+                self.assertEqual((target / 'layer.yaml').text(),
+                                 'repo: sub\n')
+                self.assertFalse(get.called)
+
+
+class TestIncludeResolver(unittest.TestCase):
+    def setUp(self):
+        self.includes = {
+            'top': ['layer:a', 'layer:b', 'interface:x'],
+            'layer:a': ['layer:c', 'interface:y'],
+            'layer:b': ['layer:c', 'layer:a', 'interface:x'],
+            'layer:c': [],
+        }
+        self.revs = {}
+        self.fetches = []
+
+    def make_item(self, url):
+        item = mock.Mock(url=url, revision=self.revs.get(url, 'rev-' + url),
+                         config={'includes': self.includes.get(url, [])})
+        item.name = url.split(':', 1)[-1]
+        item.fetch.side_effect = lambda: self.fetches.append(url) or item
+        return item
+
+    def resolve(self):
+        top = self.make_item('top')
+        resolver = build.resolver.IncludeResolver(self.make_item)
+        return top, resolver, resolver.resolve(top)
+
+    def test_resolve_order(self):
+        top, _, graph = self.resolve()
+        results = graph.results()
+        self.assertEqual([i.url for i in results['layers']],
+                         ['layer:c', 'layer:a', 'layer:b', 'top'])
+        self.assertEqual([i.url for i in results['interfaces']],
+                         ['interface:y', 'interface:x'])
+        # each item is only fetched once, even for diamond includes
+        self.assertEqual(sorted(self.fetches), [
+            'interface:x', 'interface:y', 'layer:a', 'layer:b', 'layer:c'])
+        self.assertIn('c', graph)
+        self.assertNotIn('d', graph)
+
+    def test_cycle(self):
+        self.includes['layer:c'] = ['layer:b']
+        with self.assertRaises(build.resolver.IncludeCycleError) as cm:
+            self.resolve()
+        self.assertEqual(str(cm.exception),
+                         'Layer include cycle detected: '
+                         'layer:c -> layer:b -> layer:c')
+
+    def test_cycle_to_top(self):
+        self.includes['layer:c'] = ['layer:top']
+        with self.assertRaises(build.resolver.IncludeCycleError) as cm:
+            self.resolve()
+        self.assertEqual(str(cm.exception),
+                         'Layer include cycle detected: '
+                         'top -> layer:a -> layer:c -> layer:top')
+
+    def test_load(self):
+        top, resolver, graph = self.resolve()
+        data = json.loads(json.dumps(graph.serialize()))
+        self.assertEqual(data['top'], {
+            'name': 'top',
+            'includes': ['layer:a', 'layer:b', 'interface:x'],
+        })
+        self.assertEqual(data['layers'][0], {
+            'item': 'layer:c', 'name': 'c', 'rev': 'rev-layer:c',
+            'includes': [],
+        })
+
+        del self.fetches[:]
+        loaded = resolver.load(data, top, lambda entry: True)
+        self.assertEqual([i.url for i in loaded.results()['layers']],
+                         ['layer:c', 'layer:a', 'layer:b', 'top'])
+        self.assertEqual([i.url for i in loaded.results()['interfaces']],
+                         ['interface:y', 'interface:x'])
+        self.assertEqual(len(self.fetches), 5)
+
+        # not everything pinned
+        self.assertIsNone(resolver.load(data, top,
+                                        lambda e: e['item'] != 'layer:a'))
+        # fetched revision differs from the recorded one, in which case
+        # nothing is reported as fetched, as it will be when re-resolving
+        self.revs['layer:b'] = 'other'
+        fetched = mock.Mock()
+        resolver.on_fetched = fetched
+        self.assertIsNone(resolver.load(data, top, lambda entry: True))
+        self.assertFalse(fetched.called)
+        # top layer includes changed since the graph was recorded
+        self.includes['top'] = ['layer:a']
+        self.assertIsNone(resolver.load(data, self.make_item('top'),
+                                        lambda entry: True))
+
+
+class TestInspector(unittest.TestCase):
+    def setUp(self):
+        self.charm = path(tempfile.mkdtemp()) / 'foo'
+        self.addCleanup(self.charm.dirname().rmtree_p)
+        (self.charm / 'hooks').makedirs()
+        files = {
+            'metadata.yaml': 'name: foo\n',
+            'layer.yaml': 'is: foo\n',
+            'hooks/install': '#!/bin/sh\n',
+            'hooks/start': '#!/bin/sh\n',
+            'README.md': 'readme\n',
+        }
+        signatures = {'.build.manifest': ['build', 'dynamic', 'unchecked']}
+        for name, text in files.items():
+            (self.charm / name).write_text(text)
+            signatures[name] = ['layer:basic' if name.startswith('hooks')
+                                else 'foo', 'static',
+                                utils.sign(self.charm / name)]
+        (self.charm / 'README.md').write_text('changed\n')
+        (self.charm / '.build.manifest').write_text(json.dumps({
+            'layers': [{'url': 'layer:basic'}, {'url': 'foo'}],
+            'signatures': signatures,
+        }))
+
+    def test_get_guides(self):
+        def scan_guides(depths):
+            # the original forward scan, for comparison
+            guides = []
+            for cur, depth in enumerate(depths):
+                guides.append("".join(
+                    " │  " if any(d and d == i for d in depths[cur:])
+                    else "    " for i in range(depth)))
+            return guides
+
+        depths = [0, 1, 2, 2, 1, 3, 0, 1, 0, 2, 2, 1]
+        self.assertEqual(build.inspector.get_guides(depths),
+                         scan_guides(depths))
+
+    def test_inspect(self):
+        out = StringIO()
+        build.inspector.inspect(self.charm, fp=out)
+        # without colour every entry is annotated; as before, the last
+        # entry of the walk is not drawn
+        self.assertEqual(out.getvalue().splitlines()[-7:], [
+            '{}'.format(self.charm),
+            ' ├─── .build.manifest  (build artifact)',
+            ' ├─── README.md * (from foo)',
+            ' └─── hooks ',
+            '     ├─── install  (from layer:basic)',
+            '     └─── start  (from layer:basic)',
+            ' ├─── layer.yaml  (from foo)',
+        ])
+
+    def test_inspect_json(self):
+        out = StringIO()
+        build.inspector.inspect(self.charm, as_json=True, fp=out)
+        result = json.loads(out.getvalue())
+        self.assertEqual(result['charm'], 'foo')
+        self.assertEqual(result['layers'], ['foo', 'layer:basic'])
+        tree = result['tree']
+        self.assertEqual([c['name'] for c in tree['children']], [
+            '.build.manifest', 'README.md', 'hooks', 'layer.yaml',
+            'metadata.yaml'])
+        readme, hooks = tree['children'][1:3]
+        self.assertEqual((readme['layer'], readme['status']),
+                         ('foo', 'changed'))
+        self.assertEqual(hooks['type'], 'dir')
+        self.assertEqual([(c['path'], c['layer']) for c in hooks['children']],
+                         [('hooks/install', 'layer:basic'),
+                          ('hooks/start', 'layer:basic')])
+
+    def test_query(self):
+        index = build.inspector.ManifestIndex(self.charm)
+        self.assertEqual(index.owned['layer:basic'],
+                         ['hooks/install', 'hooks/start'])
+        with mock.patch.object(utils, 'sign') as sign, \
+                mock.patch.object(utils, 'walk') as walk:
+            which = index.query(self.charm / 'hooks' / 'start')
+            self.assertEqual(which['layer'], 'layer:basic')
+            self.assertEqual(index.query('layer:basic')['files'],
+                             ['hooks/install', 'hooks/start'])
+            self.assertFalse(sign.called)
+            self.assertFalse(walk.called)
+
+        # only files touched after the build are considered without --verify
+        built = (self.charm / '.build.manifest').stat().st_mtime
+        os.utime(self.charm / 'README.md', (built - 10, built - 10))
+        (self.charm / 'hooks' / 'start').remove()
+        (self.charm / 'hooks' / 'stop').write_text('new\n')
+        changed = index.query('changed')
+        self.assertEqual((changed['added'], changed['changed'],
+                          changed['deleted']), ([], [], ['hooks/start']))
+        changed = index.query('changed', verify=True)
+        self.assertEqual((changed['added'], changed['changed'],
+                          changed['deleted']),
+                         (['hooks/stop'], ['README.md'], ['hooks/start']))
+        self.assertEqual(index.query('README.md', verify=True)['status'],
+                         'changed')
+
+        out = StringIO()
+        self.assertFalse(build.inspector.query(
+            self.charm, ['metadata.yaml', 'missing', 'layer:basic'], fp=out))
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 'metadata.yaml: foo (static) {}'.format(
+            index.files['metadata.yaml'][2]))
+        self.assertEqual(lines[1:], ['missing: not in manifest',
+                                     'hooks/install', 'hooks/start'])
+
+
+    def test_not_built(self):
+        (self.charm / '.build.manifest').remove()
+        with self.assertRaises(BuildError):
+            build.inspector.ManifestIndex(self.charm)
+        for args in ([], ['--query', 'changed']):
+            with mock.patch.object(build.builder.log, 'error') as error, \
+                    self.assertRaises(SystemExit) as cm:
+                build.builder.inspect(args + [str(self.charm)])
+            self.assertEqual(cm.exception.code, 1)
+            error.assert_called_once_with(
+                '{} is not a built charm: no .build.manifest'.format(
+                    self.charm))
 
 if __name__ == '__main__':
     logging.basicConfig()
@@ -15,9 +15,16 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import charmtools.bundles
+import os
+import shutil
+import tempfile
 import unittest
 
+from mock import patch
+
+import charmtools.bundles
+from charmtools import proof
+
 
 class TestCharmProof(unittest.TestCase):
     def setUp(self):
@@ -152,3 +159,61 @@ class TestCharmProof(unittest.TestCase):
             self.assertIn('E: display-name: not in valid format. '
                           'Only letters, numbers, dashes, and hyphens are permitted.',
                           self.linter.lint)
+
+
+class TestBatchBundleProof(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.validate = patch.object(charmtools.bundles.bundle_validation,
+                                     'validate', return_value=[]).start()
+        self.addCleanup(patch.stopall)
+
+    def make_bundle(self, name, units=1):
+        bundle_dir = os.path.join(self.tmpdir, name)
+        os.makedirs(bundle_dir)
+        with open(os.path.join(bundle_dir, 'bundle.yaml'), 'w') as f:
+            f.write('series: focal\n'
+                    'applications:\n'
+                    '  memcached:\n'
+                    '    charm: cs:memcached\n'
+                    '    num_units: {}\n'.format(units))
+        return bundle_dir
+
+    def test_bundle_parsed_once(self):
+        bundle = charmtools.bundles.Bundle(self.make_bundle('one'))
+        with patch('yaml.safe_load', wraps=charmtools.bundles.yaml.safe_load
+                   ) as safe_load:
+            lint, exit_code = bundle.proof()
+        self.assertEqual(safe_load.call_count, 1)
+        self.assertEqual(exit_code, 100)
+
+    def test_batch_validation(self):
+        paths = [self.make_bundle('one'), self.make_bundle('two'),
+                 self.make_bundle('three', units=2)]
+        results = list(proof.proof_all(paths, True, False, jobs=1))
+        self.assertEqual(self.validate.call_count, 3)
+        for path, lint, exit_code in results:
+            self.assertIn('W: memcached: charm URL should include a revision',
+                          lint)
+            self.assertIn('W: memcached: No annotations found, will render '
+                          'poorly in GUI', lint)
+
+    def test_report(self):
+        report = proof.build_report([
+            ('/one', ['W: careful', 'I: note'], 100),
+            ('/two', [], 0),
+            ('/three', ['E: broken'], 200),
+        ])
+        self.assertEqual(report, {
+            'exit_code': 200,
+            'summary': {'error': 1, 'warning': 1, 'info': 1},
+            'targets': [
+                {'path': '/one', 'exit_code': 100, 'messages': [
+                    {'level': 'warning', 'message': 'careful'},
+                    {'level': 'info', 'message': 'note'}]},
+                {'path': '/two', 'exit_code': 0, 'messages': []},
+                {'path': '/three', 'exit_code': 200, 'messages': [
+                    {'level': 'error', 'message': 'broken'}]},
+            ],
+        })
@@ -63,6 +63,7 @@ class BashCreateTest(TestCase):
             charmhome = self.tempdir
             template = 'bash'
             verbose = False
+            offline = False
 
         setup_parser.return_value.parse_args.return_value = args
 
@@ -95,6 +96,7 @@ class BashCreateTest(TestCase):
             charmhome = None
             template = 'bash'
             verbose = False
+            offline = False
 
         setup_parser.return_value.parse_args.return_value = args
 
@@ -120,6 +122,7 @@ class BashCreateTest(TestCase):
             charmhome = self.tempdir
             template = 'bash'
             verbose = False
+            offline = False
 
         setup_parser.return_value.parse_args.return_value = args
         os.mkdir(join(self.tempdir, args.charmname))
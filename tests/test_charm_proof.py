@@ -15,11 +15,14 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
+import os
 import sys
+import time
 import yaml
 
 from os.path import abspath, dirname, join
-from shutil import rmtree
+from shutil import copytree, rmtree
 from tempfile import mkdtemp
 from textwrap import dedent
 from unittest import main, TestCase
@@ -47,6 +50,7 @@ from charmtools.charms import validate_terms  # noqa
 from charmtools.charms import validate_resources  # noqa
 from charmtools.charms import validate_deployment  # noqa
 from charmtools.charms import validate_metadata_keys  # noqa
+from charmtools import charms, proof  # noqa
 
 
 class TestCharmProof(TestCase):
@@ -448,6 +452,65 @@ class TestCharmProof(TestCase):
         self.assertEqual(["I: Unknown root metadata field (fake)"], self.linter.lint)
 
 
+class HookCheckTest(TestCase):
+    def setUp(self):
+        self.charm_dir = mkdtemp()
+        self.hooks_path = join(self.charm_dir, 'hooks')
+        os.makedirs(self.hooks_path)
+        self.linter = Linter()
+
+    def tearDown(self):
+        rmtree(self.charm_dir)
+
+    def write_hook(self, name, text='#!/bin/sh\n', mode=0o755):
+        path = join(self.hooks_path, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        os.chmod(path, mode)
+
+    def test_check_hook(self):
+        self.write_hook('install')
+        self.write_hook('start', mode=0o644)
+        self.write_hook('stop.ps1', mode=0o644)
+        self.write_hook('db-relation-joined',
+                        '#!/bin/sh\ncurl http://169.254.169.254/latest\n')
+        self.assertTrue(self.linter.check_hook('install', self.hooks_path))
+        self.assertTrue(self.linter.check_hook('start', self.hooks_path))
+        self.assertTrue(self.linter.check_hook('stop', self.hooks_path))
+        self.assertTrue(self.linter.check_hook('db-relation-joined',
+                                               self.hooks_path))
+        self.assertFalse(self.linter.check_hook('config-changed',
+                                                self.hooks_path,
+                                                recommended=True))
+        self.assertFalse(self.linter.check_hook('upgrade-charm',
+                                                self.hooks_path))
+        self.assertEqual(self.linter.lint, [
+            'I: start not executable',
+            'W: (db-relation-joined:2) - hook accesses EC2 metadata '
+            'service directly',
+            'I: missing recommended hook config-changed',
+        ])
+
+    def test_hooks_directory_is_listed_once(self):
+        self.write_hook('db-relation-joined')
+        with patch('os.scandir', wraps=os.scandir) as scandir, \
+                patch('charmtools.charms.open', create=True,
+                      side_effect=open) as open_:
+            self.linter.check_relation_hooks(
+                {'db': {'interface': 'mysql'},
+                 'web': {'interface': 'http'}}, False, self.hooks_path)
+            self.linter.check_hook('db-relation-joined', self.hooks_path)
+        self.assertEqual(scandir.call_count, 1)
+        self.assertEqual(open_.call_count, 1)
+        self.assertEqual(self.linter.lint, ['I: relation web has no hooks'])
+
+    def test_missing_hooks_directory(self):
+        self.assertFalse(self.linter.check_hook(
+            'install', join(self.charm_dir, 'missing'), recommended=True))
+        self.assertEqual(self.linter.lint,
+                         ['I: missing recommended hook install'])
+
+
 class CategoriesTagsValidationTest(TestCase):
     def test_no_categories_or_tags(self):
         """Charm has neither categories nor tags."""
@@ -1072,6 +1135,32 @@ class ResourcesValidationTest(TestCase):
         validate_resources(charm, linter, extensions)
         self.assertEqual(linter.err.call_args_list, [])
 
+    def test_schemas_are_compiled_once(self):
+        """Item and extension schemas are reused across items and charms."""
+        linter = Mock()
+        extensions = [{'name': 'unknown', 'type': 'String'}]
+        with patch('charmtools.charms.SchemaBuilder.dict_to_schema',
+                   wraps=charms.SchemaBuilder().dict_to_schema) as compile_, \
+                patch('charmtools.charms.ResourceItem',
+                      wraps=charms.ResourceItem) as item_class, \
+                patch.dict(charms._item_schemas, clear=True), \
+                patch.dict(charms._extension_schemas, clear=True):
+            for _ in range(3):
+                charm = {
+                    'resources': {
+                        name: {'type': 'file', 'unknown': 'x'}
+                        for name in ('one', 'two', 'three')
+                    }
+                }
+                validate_resources(charm, linter, list(extensions))
+                validate_resources({'resources': {'bad': {'type': 'snap'}}},
+                                   linter, list(extensions))
+        self.assertEqual(compile_.call_count, 1)
+        self.assertEqual(item_class.call_count, 1)
+        self.assertEqual(linter.err.call_args_list, [
+            call('resources.bad.type: "snap" is not one of file, oci-image'),
+        ] * 3)
+
 
 class PayloadsValidationTest(TestCase):
     def test_minimal_payloads_config(self):
@@ -1366,5 +1455,203 @@ class ExtraBindingsValidationTest(TestCase):
         self.assertFalse(linter.err.called)
 
 
+class MultiTargetProofTest(TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.charm = self.write('charms/good', 'metadata.yaml', """
+            name: good
+            summary: A good charm
+            description: A good charm
+            """)
+        self.broken = self.write('charms/nested/broken', 'metadata.yaml',
+                                 'name: broken\n')
+        self.bundle = self.write('bundles/mybundle', 'bundle.yaml', """
+            applications:
+              good:
+                charm: cs:good
+                num_units: 1
+            """)
+        self.write('.hidden/charm', 'metadata.yaml', 'name: hidden\n')
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def write(self, dir_, name, text):
+        dir_ = join(self.tmpdir, dir_)
+        os.makedirs(dir_)
+        with open(join(dir_, name), 'w') as f:
+            f.write(dedent(text))
+        return dir_
+
+    def test_find_targets(self):
+        self.assertEqual(proof.find_targets(self.tmpdir),
+                         [self.bundle, self.charm, self.broken])
+        self.assertEqual(proof.find_targets(self.charm), [self.charm])
+        self.assertEqual(proof.find_targets(join(self.tmpdir, 'missing')),
+                         [join(self.tmpdir, 'missing')])
+
+    def test_proof_all(self):
+        missing = join(self.tmpdir, 'missing')
+        expected = [proof.proof(path, False, False) + (path,)
+                    for path in (self.charm, self.broken, missing)]
+        results = list(proof.proof_all(
+            [self.charm, join(self.tmpdir, 'charms/nested'), missing],
+            False, False, jobs=2))
+        self.assertEqual([(lint, code, path)
+                          for path, lint, code in results], expected)
+
+    def test_lint_records(self):
+        self.assertEqual(
+            proof.lint_records('/x', ['W: careful', 'FATAL: gone'], 200),
+            [{'path': '/x', 'level': 'warning', 'message': 'careful',
+              'exit_code': 200},
+             {'path': '/x', 'level': 'error', 'message': 'FATAL: gone',
+              'exit_code': 200}])
+        self.assertEqual(
+            proof.lint_records('/x', [], 0),
+            [{'path': '/x', 'level': None, 'message': None, 'exit_code': 0}])
+
+    @patch('sys.stdout')
+    def test_main_json(self, stdout):
+        argv = ['charm-proof', '--format', 'json', '-j', '1',
+                self.charm, self.broken]
+        with patch.object(sys, 'argv', argv):
+            with self.assertRaises(SystemExit) as e:
+                proof.main()
+        output = ''.join(c[0][0] for c in stdout.write.call_args_list)
+        records = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual({r['path'] for r in records},
+                         {self.charm, self.broken})
+        self.assertEqual(e.exception.code,
+                         max(r['exit_code'] for r in records))
+        self.assertEqual(e.exception.code, 200)
+
+
+class PatternMatcherTest(TestCase):
+    def test_search(self):
+        matcher = charms.PatternMatcher(['he', 'she', 'his', 'hers', 'x'])
+        self.assertEqual(matcher.search(['ushers']), {0, 1, 3})
+        # matches spanning chunks
+        self.assertEqual(matcher.search(['us', 'h', 'ers']), {0, 1, 3})
+        self.assertEqual(matcher.search(['nothing']), set())
+        self.assertEqual(matcher.search([]), set())
+
+    def test_readme_boilerplate(self):
+        charm_dir = mkdtemp()
+        self.addCleanup(rmtree, charm_dir)
+        template_line = ('This charm provides [service](http://example.com). '
+                         'Add a description here of what the service itself '
+                         'actually does.')
+        with open(join(charm_dir, 'metadata.yaml'), 'w') as f:
+            f.write('name: foo\nsummary: foo\ndescription: foo\n')
+        with open(join(charm_dir, 'README.md'), 'w') as f:
+            f.write('# Foo\n\n' + 'x' * 100000 + template_line + '\n')
+        charms.boilerplate_matcher.cache_clear()
+        with patch('charmtools.charms.PatternMatcher',
+                   wraps=charms.PatternMatcher) as matcher_class:
+            for _ in range(2):
+                lint, _ = Charm(charm_dir).proof()
+                self.assertIn(
+                    'W: README.md includes boilerplate: ' + template_line,
+                    lint)
+                self.assertEqual(
+                    len([line for line in lint if 'boilerplate' in line]), 1)
+        self.assertEqual(matcher_class.call_count, 1)
+
+
+@patch('charmtools.proof.cached_charm_tools_version',
+       Mock(return_value={'version': '1.0', 'git': '', 'gitn': 0}))
+class ProofCacheTest(TestCase):
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.charm_dir = join(self.tmpdir, 'charm')
+        self.cache_dir = join(self.tmpdir, 'cache')
+        os.makedirs(join(self.charm_dir, 'hooks'))
+        self.write('metadata.yaml', 'name: foo\nsummary: foo\n'
+                                    'description: foo\n')
+        self.write('hooks/install', '#!/bin/sh\n')
+        os.chmod(join(self.charm_dir, 'hooks/install'), 0o755)
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def write(self, name, text):
+        with open(join(self.charm_dir, name), 'w') as f:
+            f.write(text)
+
+    def test_content_digest(self):
+        digest = proof.content_digest(self.charm_dir)
+        self.assertEqual(proof.content_digest(self.charm_dir), digest)
+        os.chmod(join(self.charm_dir, 'hooks/install'), 0o644)
+        self.assertNotEqual(proof.content_digest(self.charm_dir), digest)
+
+    def test_content_digest_uses_manifest(self):
+        self.write('.build.manifest', json.dumps({'signatures': {
+            'metadata.yaml': ['foo', 'static', '1' * 64],
+            'hooks/install': ['foo', 'static', '2' * 64],
+            '.build.manifest': ['build', 'dynamic', 'unchecked'],
+        }}))
+        # as if the charm was built well after its files were written
+        manifest = join(self.charm_dir, '.build.manifest')
+        built = time.time_ns() + 10 ** 10
+        os.utime(manifest, ns=(built, built))
+        with patch('charmtools.utils.sign', return_value='0') as sign:
+            digest = proof.content_digest(self.charm_dir)
+            sign.assert_called_once_with(manifest)
+            # files are trusted to match the manifest until they change
+            self.assertEqual(proof.content_digest(self.charm_dir), digest)
+            self.write('metadata.yaml', 'name: foo\n')
+            os.utime(join(self.charm_dir, 'metadata.yaml'),
+                     ns=(built + 1, built + 1))
+            sign.reset_mock()
+            self.assertNotEqual(proof.content_digest(self.charm_dir), digest)
+            sign.assert_any_call(join(self.charm_dir, 'metadata.yaml'))
+
+    def test_cached_results(self):
+        with patch.object(Charm, 'proof', autospec=True,
+                          side_effect=Charm.proof) as charm_proof:
+            result = proof.proof(self.charm_dir, False, False, self.cache_dir)
+            self.assertEqual(
+                proof.proof(self.charm_dir, False, False, self.cache_dir),
+                result)
+            self.assertEqual(charm_proof.call_count, 1)
+            # content changed
+            self.write('README.md', 'readme')
+            proof.proof(self.charm_dir, False, False, self.cache_dir)
+            self.assertEqual(charm_proof.call_count, 2)
+            # charm-tools version changed
+            with patch('charmtools.proof.cached_charm_tools_version',
+                       return_value={'version': '2.0'}):
+                proof.proof(self.charm_dir, False, False, self.cache_dir)
+            self.assertEqual(charm_proof.call_count, 3)
+            # no cache
+            proof.proof(self.charm_dir, False, False)
+            self.assertEqual(charm_proof.call_count, 4)
+            # unknown charm-tools version
+            with patch('charmtools.proof.cached_charm_tools_version',
+                       return_value={'version': 'unavailable'}):
+                proof.proof(self.charm_dir, False, False, self.cache_dir)
+                proof.proof(self.charm_dir, False, False, self.cache_dir)
+            self.assertEqual(charm_proof.call_count, 6)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 3)
+
+
+    def test_cache_key_directory_name(self):
+        # the metadata name is checked against the directory name
+        other = join(self.tmpdir, 'foo')
+        copytree(self.charm_dir, other)
+        first = proof.proof(self.charm_dir, False, False, self.cache_dir)
+        second = proof.proof(other, False, False, self.cache_dir)
+        self.assertNotEqual(first, second)
+        self.assertEqual(second, proof.proof(other, False, False))
+
+    def test_cache_key_empty_directory(self):
+        rmtree(join(self.charm_dir, 'hooks'))
+        first = proof.proof(self.charm_dir, False, False, self.cache_dir)
+        os.makedirs(join(self.charm_dir, 'hooks'))
+        second = proof.proof(self.charm_dir, False, False, self.cache_dir)
+        self.assertNotEqual(first, second)
+        self.assertEqual(second, proof.proof(self.charm_dir, False, False))
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,87 @@
+import re
+import subprocess
+import sys
+from unittest import mock
+from unittest import TestCase
+
+from charmtools import cli
+
+
+HEAVY_MODULES = {'requests', 'blessings', 'curses', 'jsonschema',
+                 'ruamel.yaml', 'colander', 'jujubundlelib.validation',
+                 'Cheetah', 'pkg_resources'}
+
+# Per subcommand: the module implementing it, the heavy modules it is
+# allowed to import up front, and a (generous) budget for importing it.
+IMPORT_TARGETS = {
+    'version': ('charmtools.version', set(), 0.25),
+    'help': ('charmtools.cli', set(), 0.25),
+    'proof': ('charmtools.proof', {'colander'}, 0.5),
+    'create': ('charmtools.create', set(), 0.5),
+    'build': ('charmtools.build.builder', {'ruamel.yaml'}, 0.75),
+    'layers': ('charmtools.build.builder', {'ruamel.yaml'}, 0.75),
+    'pull-source': ('charmtools.pullsource', {'ruamel.yaml'}, 0.75),
+}
+
+
+def import_times(module):
+    """Return a mapping of module name to cumulative import time (seconds)
+    for everything imported by ``module``, as reported by -X importtime."""
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stderr=subprocess.STDOUT).decode('utf8')
+    times = {}
+    for line in output.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \|\s+(\S+)', line)
+        if match:
+            times[match.group(2)] = int(match.group(1)) / 1e6
+    return times
+
+
+class TestDispatcher(TestCase):
+    @mock.patch.object(cli, 'builtin_subcommands')
+    @mock.patch.object(cli.subprocess, 'call')
+    def test_builtin_runs_in_process(self, call, builtin_subcommands):
+        entry_point = mock.Mock()
+        entry_point.name = 'charm-foo'
+        entry_point.load.return_value.return_value = 3
+        builtin_subcommands.return_value = {'foo': entry_point}
+        with mock.patch.object(sys, 'argv', ['charm', 'foo', '--bar']):
+            self.assertEqual(cli.run_subcommand('foo', ['--bar']), 3)
+            self.assertEqual(sys.argv, ['charm-foo', '--bar'])
+        self.assertFalse(call.called)
+
+    @mock.patch.object(cli, 'builtin_subcommands', mock.Mock(return_value={}))
+    @mock.patch.object(cli.subprocess, 'call')
+    @mock.patch.object(cli.os.path, 'exists')
+    def test_external_subcommand(self, exists, call):
+        exists.return_value = True
+        call.return_value = 1
+        with mock.patch.object(sys, 'argv', ['/usr/bin/charm', 'foo']):
+            self.assertEqual(cli.run_subcommand('foo', ['-x']), 1)
+        call.assert_called_once_with(['/usr/bin/charm-foo', '-x'])
+
+        exists.return_value = False
+        with mock.patch.object(sys, 'stderr'):
+            with self.assertRaises(SystemExit) as e:
+                cli.run_subcommand('foo', [])
+        self.assertEqual(e.exception.code, 2)
+
+
+class TestImportTime(TestCase):
+    def test_all_subcommands_have_targets(self):
+        builtins = cli.builtin_subcommands()
+        if not builtins:
+            self.skipTest('charm-tools is not installed')
+        self.assertEqual(set(builtins), set(IMPORT_TARGETS))
+        for sub, entry_point in builtins.items():
+            self.assertEqual(entry_point.value.split(':')[0],
+                             IMPORT_TARGETS[sub][0])
+
+    def test_import_time(self):
+        for sub, (module, allowed, budget) in sorted(IMPORT_TARGETS.items()):
+            times = import_times(module)
+            self.assertEqual(set(times) & HEAVY_MODULES - allowed, set(),
+                             'charm {} imports heavy modules'.format(sub))
+            self.assertLess(times[module], budget,
+                            'charm {} is slow to import'.format(sub))
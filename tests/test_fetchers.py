@@ -1,8 +1,17 @@
+import hashlib
 import os
+import re
 import shutil
+import stat
 import tempfile
+import threading
 import unittest
+import zipfile
+from http.server import BaseHTTPRequestHandler, HTTPServer
 
+from mock import patch
+
+from charmtools import fetchers
 from charmtools.fetchers import (
     BzrFetcher,
     BzrMergeProposalFetcher,
@@ -13,8 +22,11 @@ from charmtools.fetchers import (
     LocalFetcher,
     CharmstoreDownloader,
     BundleDownloader,
+    FetchError,
     rename,
     normalize_bundle_name,
+    download_file,
+    extract_archive,
 )
 
 
@@ -361,3 +373,159 @@ class BundleDownloaderTest(unittest.TestCase):
 
         for i, bundle_name in enumerate(inputs):
             self.assertEqual(f(bundle_name), outputs[i])
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves ``server.payload``, honouring Range requests, and cuts off
+    the first ``server.drop`` responses half way through."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        payload = self.server.payload
+        self.server.requests.append(self.headers.get('Range'))
+        if self.path == '/missing':
+            self.send_error(404)
+            return
+        start, end = 0, len(payload) - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match and self.server.ranges:
+            start = int(match.group(1))
+            end = int(match.group(2) or end)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, end, len(payload)))
+        else:
+            self.send_response(200)
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        body = payload[start:end + 1]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.server.drop:
+            self.server.drop -= 1
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+class DownloadFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = HTTPServer(('127.0.0.1', 0), RangeHandler)
+        self.server.payload = os.urandom(300 * 1024)
+        self.server.requests = []
+        self.server.ranges = True
+        self.server.drop = 0
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:{}/archive'.format(
+            self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def read(self, filename):
+        with open(filename, 'rb') as fp:
+            return fp.read()
+
+    def test_download(self):
+        checksum = 'sha256:' + hashlib.sha256(self.server.payload).hexdigest()
+        filename = download_file(self.url, self.directory, checksum=checksum)
+        self.assertEqual(self.read(filename), self.server.payload)
+        self.assertEqual(self.server.requests, [None])
+
+    @patch.object(fetchers, 'DOWNLOAD_CHUNK_SIZE', 16 * 1024)
+    def test_resume(self):
+        self.server.drop = 1
+        filename = download_file(self.url, self.directory)
+        self.assertEqual(self.read(filename), self.server.payload)
+        self.assertEqual(self.server.requests[0], None)
+        self.assertRegex(self.server.requests[1], r'^bytes=[1-9]\d*-307199$')
+
+    def test_resume_without_ranges(self):
+        self.server.drop = 1
+        self.server.ranges = False
+        filename = download_file(self.url, self.directory)
+        self.assertEqual(self.read(filename), self.server.payload)
+
+    @patch.object(fetchers, 'PARALLEL_DOWNLOAD_MIN_SIZE', 1024)
+    def test_parallel(self):
+        self.server.drop = 2
+        filename = download_file(self.url, self.directory)
+        self.assertEqual(self.read(filename), self.server.payload)
+        # the initial request, plus one per further part, plus resumes
+        self.assertEqual(len(self.server.requests),
+                         fetchers.DOWNLOAD_PARTS + 2)
+
+    def test_failures_leave_nothing_behind(self):
+        with self.assertRaises(FetchError):
+            download_file(self.url, self.directory, checksum='sha256:bad')
+        self.server.drop = fetchers.DOWNLOAD_ATTEMPTS
+        with self.assertRaises(FetchError):
+            download_file(self.url, self.directory)
+        with self.assertRaises(FetchError):
+            download_file(self.url[:-len('archive')] + 'missing',
+                          self.directory)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class ExtractArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def add(self, zf, name, mode, data=b''):
+        info = zipfile.ZipInfo(name)
+        info.create_system = fetchers.ZIP_UNIX_SYSTEM
+        info.external_attr = mode << 16
+        zf.writestr(info, data)
+
+    def test_extract_archive(self):
+        archive = os.path.join(self.directory, 'archive.zip')
+        with zipfile.ZipFile(archive, 'w') as zf:
+            self.add(zf, 'hooks/', stat.S_IFDIR | 0o755)
+            self.add(zf, 'hooks/install', stat.S_IFREG | 0o755, b'#!/bin/sh')
+            self.add(zf, 'README.md', stat.S_IFREG | 0o600, b'readme')
+            self.add(zf, 'hooks/start', stat.S_IFLNK | 0o777, b'install')
+            zf.writestr('metadata.yaml', b'name: foo\n')
+
+        extracted = extract_archive(archive, self.directory)
+
+        def mode(name):
+            return stat.S_IMODE(os.lstat(os.path.join(extracted, name))
+                                .st_mode)
+        self.assertEqual(mode('hooks/install'), 0o755)
+        self.assertEqual(mode('README.md'), 0o600)
+        self.assertEqual(
+            os.readlink(os.path.join(extracted, 'hooks/start')), 'install')
+        with open(os.path.join(extracted, 'metadata.yaml')) as fp:
+            self.assertEqual(fp.read(), 'name: foo\n')
+
+    def assertRefused(self, *members):
+        archive = os.path.join(self.directory, 'archive.zip')
+        with zipfile.ZipFile(archive, 'w') as zf:
+            for member in members:
+                self.add(zf, *member)
+        with self.assertRaises(FetchError):
+            extract_archive(archive, self.directory)
+        self.assertEqual(os.listdir(self.directory), ['archive.zip'])
+
+    def test_extract_archive_absolute_link(self):
+        self.assertRefused(('evil', stat.S_IFLNK | 0o777, b'/etc'))
+
+    def test_extract_archive_escaping_link(self):
+        self.assertRefused(('hooks/', stat.S_IFDIR | 0o755),
+                           ('hooks/evil', stat.S_IFLNK | 0o777, b'../../'))
+
+    def test_extract_archive_through_link(self):
+        self.assertRefused(('hooks/', stat.S_IFDIR | 0o755),
+                           ('evil', stat.S_IFLNK | 0o777, b'hooks'),
+                           ('evil/x', stat.S_IFREG | 0o644, b'x'))
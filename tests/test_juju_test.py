@@ -2,12 +2,17 @@
 
 from __future__ import print_function
 
+import json
 import os
+import shutil
 import six
+import stat
+import tempfile
 import unittest
 import yaml
 
 from contextlib import contextmanager
+from xml.etree import ElementTree
 from charmtools import test as juju_test
 from mock import patch, call, Mock, MagicMock
 
@@ -134,11 +139,11 @@ class JujuTestPluginTest(unittest.TestCase):
 
     def test_conductor_keeps_whitelist_env(self):
         """Ensure that the conductor copies the environment whitelist."""
-        os.environ['PATH'] = 'FOOBAR'
-        os.environ['SSH_AGENT_PID'] = 'FOOBAR'
-        os.environ['SSH_AUTH_SOCK'] = 'FOOBAR'
         args = Arguments(tests="dummy")
-        with cd('tests_functional/charms/test/'):
+        with cd('tests_functional/charms/test/'), \
+                patch.dict(os.environ, {'PATH': 'FOOBAR',
+                                        'SSH_AGENT_PID': 'FOOBAR',
+                                        'SSH_AUTH_SOCK': 'FOOBAR'}):
             c = juju_test.Conductor(args)
             self.assertEqual('FOOBAR', c.env['PATH'])
             self.assertEqual('FOOBAR', c.env['SSH_AGENT_PID'])
@@ -161,6 +166,17 @@ class JujuTestPluginTest(unittest.TestCase):
         args = Arguments(tests=None)
         self.assertRaises(juju_test.NoTests, juju_test.Conductor, args)
 
+    @patch.object(juju_test.Conductor, 'find_tests')
+    def test_conductor_no_tests_opens_no_sinks(self, mfind_tests):
+        mfind_tests.return_value = None
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        args = Arguments(tests=None,
+                         results_jsonl=os.path.join(directory, 'r.jsonl'),
+                         junit_xml=os.path.join(directory, 'r.xml'))
+        self.assertRaises(juju_test.NoTests, juju_test.Conductor, args)
+        self.assertEqual(os.listdir(directory), [])
+
     @patch('subprocess.check_output')
     def test_conductor_status(self, mcheck_output):
         yml_output = '''
@@ -334,7 +350,8 @@ class JujuTestPluginTest(unittest.TestCase):
             c.juju_version = juju_test.JujuVersion(major=1, minor=8, patch=0)
 
             c.bootstrap(juju_env)
-            mcheck_output.assert_called_once_with(expected_cmd, env=c.env)
+            mcheck_output.assert_called_once_with(
+                expected_cmd, env=c.env, timeout=400)
 
             # Cover python as well.
             mcheck_output.reset_mock()
@@ -348,7 +365,8 @@ class JujuTestPluginTest(unittest.TestCase):
             c.juju_version = juju_test.JujuVersion(major=0, minor=8, patch=0)
 
             c.bootstrap(juju_env)
-            mcheck_output.assert_called_once_with(expected_cmd, env=c.env)
+            mcheck_output.assert_called_once_with(
+                expected_cmd, env=c.env, timeout=400)
 
     @patch('time.sleep')
     @patch('subprocess.check_call')
@@ -375,7 +393,8 @@ class JujuTestPluginTest(unittest.TestCase):
             c.juju_version = juju_test.JujuVersion(major=1, minor=8, patch=0)
 
             c.bootstrap(juju_env)
-            mcheck_output.assert_called_once_with(expected_cmd, env=c.env)
+            mcheck_output.assert_called_once_with(
+                expected_cmd, env=c.env, timeout=400)
 
             mcheck_output.reset_mock()
             const_cmd = [
@@ -388,7 +407,8 @@ class JujuTestPluginTest(unittest.TestCase):
             c.juju_version = juju_test.JujuVersion(major=1, minor=8, patch=0)
 
             c.bootstrap(juju_env)
-            mcheck_output.assert_called_once_with(const_cmd, env=c.env)
+            mcheck_output.assert_called_once_with(
+                const_cmd, env=c.env, timeout=400)
 
     @patch('subprocess.check_call')
     def test_conductor_bootstrap_error(self, mcheck_output):
@@ -404,10 +424,8 @@ class JujuTestPluginTest(unittest.TestCase):
             self.assertRaises(juju_test.BootstrapError, c.bootstrap, juju_env)
 
     @patch('subprocess.check_call')
-    @patch.object(juju_test, 'timeout')
     @patch.object(juju_test.Conductor, 'status')
-    def test_conductor_bootstrap_unreliable(self, mock_status, mtimeout,
-                                            mcheck_output):
+    def test_conductor_bootstrap_unreliable(self, mock_status, mcheck_output):
         goyml_output = '''
         machines:
             '0':
@@ -419,7 +437,6 @@ class JujuTestPluginTest(unittest.TestCase):
         services: {}'''
 
         gostatus_output = yaml.safe_load(goyml_output)
-        mtimeout.side_effect = juju_test.TimeoutError
         mock_status.return_value = gostatus_output
         jenv = 'test-env'
 
@@ -429,7 +446,24 @@ class JujuTestPluginTest(unittest.TestCase):
             c.juju_version = juju_test.JujuVersion(major=1, minor=8, patch=0)
 
             self.assertRaises(
-                juju_test.BootstrapUnreliable, c.bootstrap, jenv, 1)
+                juju_test.BootstrapUnreliable, c.bootstrap, jenv, 0.1)
+
+    @patch.object(juju_test.Conductor, 'destroy')
+    @patch('subprocess.check_call')
+    def test_conductor_bootstrap_command_timeout(self, mcheck_call,
+                                                 mdestroy):
+        from subprocess import TimeoutExpired
+        mcheck_call.side_effect = TimeoutExpired('juju', 5)
+
+        args = Arguments(tests='dummy', upload_tools=False, constraints=False)
+        with cd('tests_functional/charms/test/'):
+            c = juju_test.Conductor(args)
+            c.juju_version = juju_test.JujuVersion(major=1, minor=8, patch=0)
+
+            self.assertRaises(
+                juju_test.BootstrapUnreliable, c.bootstrap, 'test-env', 5)
+            self.assertEqual(mcheck_call.call_args[1]['timeout'], 5)
+            mdestroy.assert_called_once_with('test-env')
 
     def test_conductor_isolate_environment(self):
         args = Arguments(tests='dummy')
@@ -601,7 +635,8 @@ class JujuTestPluginTest(unittest.TestCase):
             o.build_env()
             o.rsync(machine, path, logdir)
 
-            mcheck_call.assert_called_once_with(expected_cmd, env=o.env)
+            mcheck_call.assert_called_once_with(
+                expected_cmd, env=o.env, timeout=o.ARCHIVE_TIMEOUT)
 
     @patch('subprocess.check_call')
     @patch.object(juju_test.Conductor, 'status')
@@ -650,7 +685,8 @@ class JujuTestPluginTest(unittest.TestCase):
             o.build_env()
             o.rsync(machine, path, logdir)
 
-            mcheck_call.assert_called_once_with(expected_cmd, env=o.env)
+            mcheck_call.assert_called_once_with(
+                expected_cmd, env=o.env, timeout=o.ARCHIVE_TIMEOUT)
 
     @patch.object(juju_test.Orchestra, 'rsync')
     @patch.object(juju_test.Conductor, 'status')
@@ -694,11 +730,14 @@ class JujuTestPluginTest(unittest.TestCase):
             rsync.assert_has_calls([
                 call(
                     0, '/var/./log/juju/*',
-                    os.path.join(args.logdir, 'bootstrap', '')),
+                    os.path.join(o.archive, 'bootstrap', ''),
+                    'juju-yy-yy-yy-yy.compute.cloudprovider.tld'),
                 call(
                     '1', '/var/./log/juju/*',
-                    os.path.join(args.logdir, 'dummy', ''))
-            ])
+                    os.path.join(o.archive, 'dummy', ''),
+                    'juju-xx-xx-xx-xx.compute.cloudprovider.tld')
+            ], any_order=True)
+            mstatus.assert_called_once_with(juju_env)
 
     @patch.object(juju_test.Orchestra, 'rsync')
     @patch.object(juju_test.Conductor, 'status')
@@ -736,17 +775,34 @@ class JujuTestPluginTest(unittest.TestCase):
 
             o.build_env()
             o.archive_logs()
+            yy = 'juju-yy-yy-yy-yy.compute.cloudprovider.tld'
+            xx = 'juju-xx-xx-xx-xx.compute.cloudprovider.tld'
             rsync.assert_has_calls([
                 call(
                     0, '/var/./log/juju/*',
-                    os.path.join(args.logdir, 'bootstrap', '')),
+                    os.path.join(o.archive, 'bootstrap', ''), yy),
                 call(
                     1, '/var/./log/juju/*',
-                    os.path.join(args.logdir, 'dummy', '')),
+                    os.path.join(o.archive, 'dummy', ''), xx),
                 call(
                     1, '/var/lib/juju/units/./*/charm.log',
-                    os.path.join(args.logdir, 'dummy', ''))
-            ])
+                    os.path.join(o.archive, 'dummy', ''), xx)
+            ], any_order=True)
+
+    @patch('subprocess.check_output')
+    @patch.object(juju_test.Orchestra, 'archive_logs')
+    def test_orchestra_logdir_per_test(self, marchive_logs, mcheck_output):
+        args = Arguments(tests='dummy', juju_env='testing', logdir='/tmp',
+                         timeout=30, on_timeout='skip', fail_on_skip=False)
+        with cd('tests_functional/charms/test/'):
+            c = juju_test.Conductor(args)
+            one = juju_test.Orchestra(c, 'tests/01-one')
+            two = juju_test.Orchestra(c, 'tests/02-two')
+            one.perform()
+            two.perform()
+
+        self.assertEqual(one.result.logdir, os.path.join('/tmp', '01-one'))
+        self.assertEqual(two.result.logdir, os.path.join('/tmp', '02-two'))
 
     @patch.object(juju_test.Conductor, 'status')
     def test_orchestra_archive_logs_status_fails(self, mstatus):
@@ -779,7 +835,247 @@ class JujuTestPluginTest(unittest.TestCase):
             o.archive_logs()
             expected_warns = [call('Failed to fetch logs for bootstrap node'),
                               call('Failed to grab logs for dummy/0')]
-            o.log.warn.assert_has_calls(expected_warns)
+            o.log.warn.assert_has_calls(expected_warns, any_order=True)
+
+
+FAKE_JUJU = """#!/bin/sh
+echo "$*" >> "$FAKE_JUJU_LOG"
+case "$1" in
+  version) echo 1.25.0-trusty-amd64 ;;
+  status) echo '{"machines": {"0": {"agent-state": "'"$FAKE_JUJU_STATE"'"}}}' ;;
+esac
+"""
+
+# Each test waits for the other one to start, so they can only pass when
+# they run at the same time.  Only tests which rely on that wait for long.
+RENDEZVOUS_TEST = """#!/bin/sh
+touch "$RENDEZVOUS/$(basename $0)"
+for i in $(seq $RENDEZVOUS_TRIES); do
+  [ -e "$RENDEZVOUS/{other}" ] && exit 0
+  sleep 0.1
+done
+exit 1
+"""
+
+
+def write_script(filename, content):
+    with open(filename, 'w') as fp:
+        fp.write(content)
+    os.chmod(filename, stat.S_IRWXU)
+
+
+class ConductorPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.bin = os.path.join(self.directory, 'bin')
+        self.charm = os.path.join(self.directory, 'charm')
+        self.rendezvous = os.path.join(self.directory, 'rendezvous')
+        self.juju_log = os.path.join(self.directory, 'juju.log')
+        for d in (self.bin, self.rendezvous,
+                  os.path.join(self.charm, 'tests')):
+            os.makedirs(d)
+        write_script(os.path.join(self.bin, 'juju'), FAKE_JUJU)
+        tests = {'01-one': '02-two', '02-two': '01-one'}
+        for name, other in tests.items():
+            write_script(os.path.join(self.charm, 'tests', name),
+                         RENDEZVOUS_TEST.format(other=other))
+
+    def juju_calls(self):
+        with open(self.juju_log) as fp:
+            return [line.split() for line in fp.read().splitlines()]
+
+    def run_conductor(self, state='started', tries=1, **kwargs):
+        env = {'PATH': self.bin + os.pathsep + os.environ['PATH'],
+               'FAKE_JUJU_LOG': self.juju_log,
+               'FAKE_JUJU_STATE': state,
+               'RENDEZVOUS': self.rendezvous,
+               'RENDEZVOUS_TRIES': str(tries)}
+        kwargs.setdefault('tests', None)
+        args = Arguments(setup_timeout=30, timeout=30,
+                         preserve_environment_variables=','.join(
+                             name for name in env if name != 'PATH'),
+                         **kwargs)
+        with cd(self.charm), patch.dict(os.environ, env):
+            self.conductor = juju_test.Conductor(args)
+            return self.conductor.run()
+
+    def test_tests_run_concurrently(self):
+        result = self.run_conductor(juju_env='a', env_pool=['a', 'b'],
+                                    tries=30)
+        self.assertEqual(result, (0, 0, 2))
+        calls = self.juju_calls()
+        bootstraps = sorted(c[-1] for c in calls if c[0] == 'bootstrap')
+        destroys = sorted(c[-1] for c in calls
+                          if c[0] == 'destroy-environment')
+        self.assertEqual(bootstraps, ['a', 'b'])
+        self.assertEqual(destroys, ['a', 'b'])
+
+    def test_serial_run(self):
+        # with a single environment the first test gives up waiting
+        result = self.run_conductor(juju_env='a')
+        self.assertEqual(result, (0, 1, 1))
+        calls = [c[0] for c in self.juju_calls() if c[0] != 'status']
+        self.assertEqual(calls, ['version', 'bootstrap', 'destroy-environment',
+                                 'bootstrap', 'destroy-environment'])
+
+    def test_result_sinks(self):
+        jsonl = os.path.join(self.directory, 'results.jsonl')
+        junit = os.path.join(self.directory, 'results.xml')
+        self.run_conductor(juju_env='a', results_jsonl=jsonl,
+                           junit_xml=junit)
+
+        with open(jsonl) as fp:
+            records = [json.loads(line) for line in fp]
+        self.assertEqual([(r['name'], r['status'], r['exit_code'])
+                          for r in records],
+                         [('01-one', 'fail', 1), ('02-two', 'pass', 0)])
+        for record in records:
+            self.assertEqual(record['juju_env'], 'a')
+            self.assertGreater(record['duration'], 0)
+            self.assertIsNotNone(record['bootstrap_time'])
+            self.assertIsNotNone(record['teardown_time'])
+
+        suite = ElementTree.parse(junit).getroot()
+        self.assertEqual((suite.get('name'), suite.get('tests'),
+                          suite.get('failures'), suite.get('errors')),
+                         ('charm', '2', '1', '0'))
+        one, two = suite.findall('testcase')
+        self.assertEqual(one.get('name'), '01-one')
+        self.assertIsNotNone(one.find('failure'))
+        self.assertIsNone(two.find('failure'))
+        properties = {p.get('name'): p.get('value')
+                      for p in two.iter('property')}
+        self.assertEqual(properties['exit_code'], '0')
+        self.assertIn('bootstrap_time', properties)
+
+    def test_bootstrap_probe(self):
+        self.run_conductor(juju_env='a', tests=['02-two'])
+        probes = [c for c in self.juju_calls() if c[0] == 'status']
+        self.assertEqual(probes, [['status', '-e', 'a', '--format', 'json',
+                                   '0']])
+
+    def test_bootstrap_error_state(self):
+        with patch.object(juju_test.utils.time, 'sleep') as sleep:
+            result = self.run_conductor(state='error', juju_env='a',
+                                        tests=['02-two'])
+        # no waiting for the deadline once the node is in error; the only
+        # sleeps are subprocess's short ones while it waits for a command
+        # with a timeout
+        polls = [c for c in sleep.call_args_list
+                 if c[0][0] >= juju_test.Conductor.POLL_INTERVAL / 2]
+        self.assertEqual(polls, [])
+        self.assertEqual(result, (1, 0, 0))
+        self.assertEqual(self.conductor.results[0].status, 'error')
+        self.assertIn('state error', self.conductor.results[0].message)
+        calls = [c[0] for c in self.juju_calls()]
+        self.assertEqual(calls, ['version', 'bootstrap', 'status',
+                                 'destroy-environment'])
+
+    def test_reuse_environments(self):
+        os.remove(os.path.join(self.charm, 'tests', '02-two'))
+        write_script(os.path.join(self.charm, 'tests', '02-two'),
+                     '#!/bin/sh\n')
+        write_script(os.path.join(self.charm, 'tests', '03-three'),
+                     '#!/bin/sh\n')
+        result = self.run_conductor(juju_env='a', reuse_environments=True)
+        # 01-one fails, so the environment is replaced after it
+        self.assertEqual(result, (0, 1, 2))
+        calls = [c[0] for c in self.juju_calls() if c[0] != 'status']
+        self.assertEqual(calls, ['version', 'bootstrap', 'destroy-environment',
+                                 'bootstrap', 'destroy-environment'])
+
+
+ARCHIVE_STATUS = """
+machines:
+  "0": {dns-name: bootstrap.example}
+  "1": {dns-name: shared.example}
+  "2": {dns-name: slow.example}
+services:
+  wordpress:
+    units:
+      wordpress/0: {machine: "1"}
+      wordpress/1: {machine: "1"}
+  mysql:
+    units:
+      mysql/0: {machine: "1"}
+  haproxy:
+    units:
+      haproxy/0: {machine: "2"}
+"""
+
+FAKE_RSYNC = """#!/bin/sh
+echo "$*" >> "$FAKE_RSYNC_LOG"
+case "$*" in
+  *slow.example*) sleep 10 ;;
+esac
+for dest; do :; done
+mkdir -p "${dest}log/juju"
+echo "$*" > "${dest}log/juju/machine.log"
+"""
+
+
+class ArchiveLogsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        bin_dir = os.path.join(self.directory, 'bin')
+        os.makedirs(bin_dir)
+        with open(os.path.join(self.directory, 'status.yaml'), 'w') as fp:
+            fp.write(ARCHIVE_STATUS)
+        write_script(os.path.join(bin_dir, 'juju'),
+                     '#!/bin/sh\necho "$*" >> "$FAKE_JUJU_LOG"\n'
+                     'cat "$FAKE_STATUS"\n')
+        write_script(os.path.join(bin_dir, 'rsync'), FAKE_RSYNC)
+        self.logs = {name: os.path.join(self.directory, name + '.log')
+                     for name in ('juju', 'rsync')}
+        env = {'PATH': bin_dir + os.pathsep + os.environ['PATH'],
+               'FAKE_JUJU_LOG': self.logs['juju'],
+               'FAKE_RSYNC_LOG': self.logs['rsync'],
+               'FAKE_STATUS': os.path.join(self.directory, 'status.yaml')}
+        with cd('tests_functional/charms/test/'), \
+                patch.dict(os.environ, env):
+            args = Arguments(tests='dummy', juju_env='testing',
+                             logdir=os.path.join(self.directory, 'logs'),
+                             preserve_environment_variables=','.join(env))
+            c = juju_test.Conductor(args)
+        c.juju_version = juju_test.JujuVersion(major=1, minor=25, patch=0)
+        self.orchestra = juju_test.Orchestra(c, 'test/dummy')
+        self.orchestra.build_env()
+
+    def read_log(self, name):
+        with open(self.logs[name]) as fp:
+            return fp.read().splitlines()
+
+    @patch.object(juju_test.Orchestra, 'ARCHIVE_TIMEOUT', 0.5)
+    def test_archive_logs(self):
+        self.orchestra.log.warn = MagicMock()
+        self.orchestra.archive_logs()
+
+        self.assertEqual(self.read_log('juju'), ['status -e testing'])
+        logdir = self.orchestra.archive
+        transfers = sorted(line.split()[-2:]
+                           for line in self.read_log('rsync'))
+        # the machine shared by mysql and wordpress is only copied from
+        # once, into a staging directory which is fanned out from
+        shared = transfers.pop(1)
+        self.assertEqual(transfers, [
+            ['ubuntu@bootstrap.example:/var/./log/juju/*',
+             os.path.join(logdir, 'bootstrap', '')],
+            ['ubuntu@slow.example:/var/./log/juju/*',
+             os.path.join(logdir, 'haproxy', '')],
+        ])
+        self.assertEqual(shared[0], 'ubuntu@shared.example:/var/./log/juju/*')
+        for service in ('mysql', 'wordpress'):
+            with open(os.path.join(logdir, service, 'log', 'juju',
+                                   'machine.log')) as fp:
+                self.assertIn('shared.example', fp.read())
+        # and the hung transfer never got to create haproxy's
+        self.assertEqual(sorted(os.listdir(logdir)),
+                         ['bootstrap', 'mysql', 'wordpress'])
+        # the hung transfer is abandoned without holding up the others
+        self.orchestra.log.warn.assert_called_once_with(
+            'Failed to grab logs for haproxy/0')
 
 
 class TestCfgTest(unittest.TestCase):
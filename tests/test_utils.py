@@ -97,3 +97,63 @@ class TestUtils(TestCase):
             utils.get_python_version('/some/dir', env={'some': 'envvar'}),
             (3, 12, 4)
         )
+
+
+class TestPoll(TestCase):
+    def setUp(self):
+        self.now = 0.0
+        patches = [
+            unittest.mock.patch.object(utils.time, 'monotonic',
+                                       lambda: self.now),
+            unittest.mock.patch.object(utils.time, 'sleep', self.sleep),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.sleeps = []
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def test_backoff(self):
+        results = iter([None, None, None, None, 'done'])
+        self.assertEqual(utils.poll(lambda: next(results), interval=1,
+                                    max_interval=5, jitter=0), 'done')
+        self.assertEqual(self.sleeps, [1, 2, 4, 5])
+
+    def test_jitter(self):
+        results = iter([False] * 50 + [True])
+        utils.poll(lambda: next(results), interval=10, backoff=1, jitter=0.5)
+        self.assertTrue(all(5 <= s <= 15 for s in self.sleeps))
+        self.assertGreater(len(set(self.sleeps)), 1)
+
+    def test_deadline(self):
+        calls = []
+        with self.assertRaises(utils.PollTimeout):
+            utils.poll(lambda: calls.append(self.now), timeout=10,
+                       interval=4, jitter=0)
+        # the last wait is cut short to probe once more at the deadline
+        self.assertEqual(calls, [0, 4, 10])
+
+    def test_early_exit(self):
+        def probe():
+            raise ValueError('terminal')
+        with self.assertRaises(ValueError):
+            utils.poll(probe, timeout=10)
+        self.assertEqual(self.sleeps, [])
+
+    def test_wait_for_and_retry(self):
+        results = iter([False, False, True])
+        utils.wait_for(0, 3, lambda: next(results))
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertTrue(all(2.7 <= s <= 3.3 for s in self.sleeps))
+
+        with self.assertRaisesRegex(OSError, 'Timeout exceeded'):
+            utils.wait_for(5, 1, lambda: True, lambda: False)
+
+        calls = []
+        with self.assertRaisesRegex(OSError, 'Retry attempts exceeded'):
+            utils.retry(3, lambda: calls.append(1))
+        self.assertEqual(len(calls), 3)
+        self.assertTrue(utils.retry(3, lambda: True))
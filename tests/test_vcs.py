@@ -0,0 +1,159 @@
+import binascii
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+import mock
+
+from charmtools import vcs
+
+
+_check_output = subprocess.check_output
+
+
+def git(*args, **kw):
+    return _check_output(
+        ('git', '-c', 'user.name=t', '-c', 'user.email=t@t') + args,
+        **kw).decode('utf8').strip()
+
+
+class VCSTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = os.path.realpath(tempfile.mkdtemp())
+        vcs.clear_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        vcs.clear_cache()
+
+    def make_git_repo(self):
+        repo = os.path.join(self.directory, 'repo')
+        os.makedirs(os.path.join(repo, 'sub'))
+        git('init', '-q', repo)
+        with open(os.path.join(repo, 'sub', 'file'), 'w') as fp:
+            fp.write('data')
+        git('add', '.', cwd=repo)
+        git('commit', '-q', '-m', 'one', cwd=repo)
+        return repo, git('rev-parse', 'HEAD', cwd=repo)
+
+    def test_no_vcs(self):
+        self.assertEqual(vcs.find_root(self.directory), (None, None))
+        self.assertIsNone(vcs.get_revision(self.directory))
+
+    @mock.patch('subprocess.check_output',
+                mock.Mock(side_effect=AssertionError('git was run')))
+    def test_git_loose_and_packed_refs(self):
+        repo, sha = self.make_git_repo()
+
+        self.assertEqual(vcs.find_root(os.path.join(repo, 'sub')),
+                         ('git', repo))
+        self.assertEqual(vcs.get_revision(os.path.join(repo, 'sub')), sha)
+
+        branch = git('symbolic-ref', 'HEAD', cwd=repo)
+        git('pack-refs', '--all', cwd=repo)
+        self.assertFalse(os.path.exists(os.path.join(repo, '.git', branch)))
+        vcs.clear_cache()
+        self.assertEqual(vcs.get_revision(repo), sha)
+
+        # detached HEAD
+        with open(os.path.join(repo, '.git', 'HEAD'), 'w') as fp:
+            fp.write('0' * 40 + '\n')
+        self.assertEqual(vcs.get_revision(repo), sha)  # memoized
+        vcs.clear_cache()
+        self.assertEqual(vcs.get_revision(repo), '0' * 40)
+
+    def test_git_worktree(self):
+        repo, sha = self.make_git_repo()
+        worktree = os.path.join(self.directory, 'wt')
+        git('worktree', 'add', '-q', '--detach', worktree, cwd=repo)
+        self.assertTrue(os.path.isfile(os.path.join(worktree, '.git')))
+        self.assertEqual(vcs.get_revision(worktree), sha)
+
+    def test_hg_dirstate(self):
+        node = os.urandom(20)
+        os.makedirs(os.path.join(self.directory, '.hg'))
+        with open(os.path.join(self.directory, '.hg', 'dirstate'), 'wb') as fp:
+            fp.write(node + b'\0' * 20)
+        self.assertEqual(vcs.get_revision(self.directory),
+                         binascii.hexlify(node).decode('ascii'))
+        vcs.clear_cache()
+        with open(os.path.join(self.directory, '.hg', 'dirstate'), 'wb') as fp:
+            fp.write(vcs.HG_DIRSTATE_V2_MARKER + node + b'\0' * 44)
+        self.assertEqual(vcs.get_revision(self.directory),
+                         binascii.hexlify(node).decode('ascii'))
+
+    @mock.patch.object(vcs, '_run')
+    def test_bzr(self, _run):
+        os.makedirs(os.path.join(self.directory, '.bzr'))
+        _run.return_value = b'12 me@example.com-20200101-abc\n'
+        self.assertEqual(vcs.get_revision(self.directory),
+                         'me@example.com-20200101-abc')
+        vcs.get_revision(self.directory)
+        _run.assert_called_once_with('bzr revision-info', self.directory)
+
+    def archive(self, src, arcname, fmt):
+        filename = os.path.join(self.directory, arcname + fmt)
+        if fmt == '.zip':
+            with zipfile.ZipFile(filename, 'w') as archive:
+                for dirpath, dirnames, filenames in os.walk(src):
+                    for name in filenames:
+                        full = os.path.join(dirpath, name)
+                        archive.write(full, os.path.join(
+                            arcname, os.path.relpath(full, src)))
+        else:
+            with tarfile.open(filename, 'w:gz') as archive:
+                archive.add(src, arcname)
+        return filename
+
+    @mock.patch('charmtools.vcs._archive_revision',
+                wraps=vcs._archive_revision)
+    def test_archive_git(self, _archive_revision):
+        repo, sha = self.make_git_repo()
+        git('pack-refs', '--all', cwd=repo)
+        with mock.patch('subprocess.check_output',
+                        mock.Mock(side_effect=AssertionError('git was run'))):
+            for fmt in ('.zip', '.tar.gz'):
+                archive = self.archive(repo, 'pkg', fmt)
+                self.assertEqual(vcs.get_archive_revision(archive, 'pkg'),
+                                 sha)
+                self.assertEqual(vcs.get_archive_revision(archive, 'pkg'),
+                                 sha)
+                self.assertIsNone(vcs.get_archive_revision(archive, 'other'))
+        # memoized by content, not by name
+        self.assertEqual(_archive_revision.call_count, 4)
+
+    def test_archive_hg_and_pull_source_rev(self):
+        tree = os.path.join(self.directory, 'tree')
+        os.makedirs(os.path.join(tree, '.hg'))
+        with open(os.path.join(tree, '.pull-source-rev'), 'w') as fp:
+            fp.write('pulled\n')
+        archive = self.archive(tree, 'pkg', '.zip')
+        self.assertEqual(vcs.get_archive_revision(archive, 'pkg'), 'pulled')
+
+        node = os.urandom(20)
+        with open(os.path.join(tree, '.hg', 'dirstate'), 'wb') as fp:
+            fp.write(node + b'\0' * 20)
+        archive = self.archive(tree, 'pkg', '.tar.gz')
+        self.assertEqual(vcs.get_archive_revision(archive, 'pkg'),
+                         binascii.hexlify(node).decode('ascii'))
+
+    def test_archive_unreadable(self):
+        tree = os.path.join(self.directory, 'tree')
+        os.makedirs(os.path.join(tree, '.bzr'))
+        with open(os.path.join(tree, '.bzr', 'branch-format'), 'w') as fp:
+            fp.write('format')
+        archive = self.archive(tree, 'pkg', '.zip')
+        self.assertRaises(vcs.UnreadableArchive,
+                          vcs.get_archive_revision, archive, 'pkg')
+        other = os.path.join(self.directory, 'pkg.whl')
+        shutil.copy(archive, other)
+        self.assertRaises(vcs.UnreadableArchive,
+                          vcs.get_archive_revision, other, 'pkg')
+
+
+if __name__ == '__main__':
+    unittest.main()